@@ -0,0 +1,791 @@
+#!/usr/bin/env python3
+# Copyright (C) 2015 Okami, okami@fuzetsu.info
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import ast
+import os
+import re
+import resource
+import stat
+import sys
+import time
+
+import dns.zone
+
+from dnssec import defs, rollmgr
+from dnssec.parsers import zonefile
+from dnssec.parsers.abstract import tokenize
+from dnssec.parsers.keyrec import KeyRec, Zone, KeySet, Key
+from dnssec.parsers.rollrec import LazyRollRec, RollRec, Roll
+from dnssec.rollerd import RollerD
+from dnssec.rollerd.daemon import DaemonMixin
+
+
+HOME_DIR = '/tmp'
+BZF = os.path.join(HOME_DIR, 'bench.zone')
+BRRF = os.path.join(HOME_DIR, 'bench.rollrec')
+BKRF = os.path.join(HOME_DIR, 'bench.krf')
+
+ZONE_RECORDS = 1000000
+PARSE_RECORDS = 100000
+
+
+def measure(func, *args):
+    '''
+    Run a function in a forked child to get its own peak memory usage.
+
+    @returns: function's result, seconds taken and peak RSS in KiB
+    @rtype: tuple
+    '''
+    r, w = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(r)
+        started = time.time()
+        result = func(*args)
+        elapsed = time.time() - started
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(w, repr((result, elapsed, rss)).encode('utf8'))
+        os._exit(0)
+    os.close(w)
+    data = b''
+    while 42:
+        chunk = os.read(r, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(r)
+    os.waitpid(pid, 0)
+    return ast.literal_eval(data.decode('utf8'))
+
+
+def report(name, result, elapsed, rss):
+    print('%-24s %12s %10.2f s %10d KiB' % (name, result, elapsed, rss))
+
+
+def generate_zone(records):
+    '''
+    Signed-looking zone: an A record and a multi-line RRSIG per name.
+    '''
+    with open(BZF, 'w') as f:
+        f.write('$ORIGIN bench.example.\n$TTL 3600\n')
+        f.write('@ IN SOA ns.bench.example. root.bench.example. (\n'
+                '    1 43200 3600 1209600 300 )\n')
+        f.write('@ IN NS ns\nns IN A 192.0.2.1\n')
+        for i in range(records // 2):
+            f.write('host%d 300 IN A 10.%d.%d.%d\n' % (
+                i, (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff))
+            f.write(
+                '    300 IN RRSIG A 8 3 300 20300101000000 (\n'
+                '        20200101000000 12345 bench.example.\n'
+                '        AwEAAcMnWBKLuvG/LwnPVykcmpvnntwxfshHlHRhlY0F3oz8AMcuF8gw\n'
+                '        9McCw+BoC2YasJJakl5S7JR7ax/iW6MzeB5f6+1Q3UW7B4Ppd0Q= )\n')
+
+
+def dnspython_maxttl(path):
+    zone = dns.zone.from_file(path, origin=None, check_origin=False)
+    return max((
+        rdataset.ttl
+        for node in zone.values()
+        for rdataset in node.rdatasets), default=0)
+
+
+def maxttl():
+    '''
+    Zone max-TTL: streaming scanner vs dns.zone.from_file
+    '''
+    generate_zone(ZONE_RECORDS)
+    print('zone of %d records, %d bytes' % (
+        ZONE_RECORDS, os.stat(BZF).st_size))
+    report('TTLScanner', *measure(zonefile.maxttl, BZF))
+    report('dns.zone.from_file', *measure(dnspython_maxttl, BZF))
+    os.remove(BZF)
+
+
+def generate_rollrec(records):
+    rollrec = RollRec()
+    for i in range(records):
+        roll = Roll()
+        roll._parent = rollrec
+        roll.name = 'zone%d.example' % i
+        roll.is_active = bool(i % 10)
+        for key, value in (
+                ('zonename', roll.name),
+                ('zonefile', roll.name + '.signed'),
+                ('keyrec', roll.name + '.krf'),
+                ('kskphase', '0'),
+                ('zskphase', str(i % 5)),
+                ('ksk_rolldate', ' '),
+                ('ksk_rollsecs', '0'),
+                ('zsk_rolldate', 'Mon Jan  5 12:00:00 2015'),
+                ('zsk_rollsecs', '1420459200'),
+                ('maxttl', '86400'),
+                ('phasestart', 'Mon Jan  5 12:00:00 2015'),
+                ('istrustanchor', 'no'),
+                ('holddowntime', '60D')):
+            roll[key] = value
+        rollrec[roll.name] = roll
+    rollrec.write(BRRF)
+
+
+def generate_keyrec(records):
+    keyrec = KeyRec()
+    for i in range(records // 4):
+        name = 'zone%d.example' % i
+        zone = Zone()
+        zone.name = name
+        zone['zonefile'] = name
+        zone['signedzone'] = name + '.signed'
+        zone['zskcur'] = 'signing-set-%d' % i
+        keyrec[name] = zone
+        keyset = KeySet()
+        keyset.name = 'signing-set-%d' % i
+        keyset['zonename'] = name
+        keyset['set_type'] = 'zskcur'
+        keys = []
+        for j in range(2):
+            key = Key()
+            key.name = 'K%s.+008+%05d' % (name, i * 2 + j)
+            key['zonename'] = name
+            key['keyrec_type'] = 'zsk'
+            key['algorithm'] = 'RSASHA256'
+            key['keypath'] = './%s.key' % key.name
+            key['ksklength'] = '2048'
+            key['keyrec_gensecs'] = '1420459200'
+            key['keyrec_gendate'] = 'Mon Jan  5 12:00:00 2015'
+            keys.append(key.name)
+            keyrec[key.name] = key
+        keyset['keys'] = ' '.join(keys)
+        keyrec[keyset.name] = keyset
+    keyrec.write(BKRF)
+
+
+def legacy_pairs(path):
+    '''
+    Line matching as done by the parsers before tokenize().
+    '''
+    f = open(path, 'r')
+    for i in f.readlines():
+        if not i.strip().startswith('#'):
+            match = re.match(r'(\S+)\s+"([^"]+)"', i.strip())
+            if match:
+                yield match.group(1), match.group(2)
+    f.close()
+
+
+def count_pairs(pairs):
+    return sum(1 for pair in pairs)
+
+
+def read_conf(conf_class, path):
+    conf = conf_class()
+    conf.read(path)
+    return len(conf)
+
+
+def round_trip(conf_class, path):
+    conf = conf_class()
+    conf.read(path)
+    with open(path, 'r') as f:
+        assert str(conf) == f.read(), '%s round trip failed' % path
+
+
+def parse():
+    '''
+    Rollrec/keyrec parsing: tokenize() vs per-line regex
+    '''
+    measure(generate_rollrec, PARSE_RECORDS)
+    measure(generate_keyrec, PARSE_RECORDS)
+    for path in (BRRF, BKRF):
+        print('%s: %d bytes' % (path, os.stat(path).st_size))
+        report('regex', *measure(count_pairs, legacy_pairs(path)))
+        report('tokenize', *measure(count_pairs, tokenize(path)))
+    report('RollRec.read', *measure(read_conf, RollRec, BRRF))
+    report('KeyRec.read', *measure(read_conf, KeyRec, BKRF))
+    round_trip(RollRec, BRRF)
+    round_trip(KeyRec, BKRF)
+    os.remove(BRRF)
+    os.remove(BKRF)
+
+
+def read_compact(conf_class, path, compact):
+    conf = conf_class()
+    conf.read(path, compact=compact)
+    return len(conf)
+
+
+def memory():
+    '''
+    Rollrec/keyrec records: TabbedConf vs CompactConf memory usage
+    '''
+    measure(generate_rollrec, PARSE_RECORDS)
+    measure(generate_keyrec, PARSE_RECORDS)
+    report('empty', *measure(len, ''))
+    report('RollRec', *measure(read_compact, RollRec, BRRF, False))
+    report('RollRec compact', *measure(read_compact, RollRec, BRRF, True))
+    report('KeyRec', *measure(read_compact, KeyRec, BKRF, False))
+    report('KeyRec compact', *measure(read_compact, KeyRec, BKRF, True))
+    os.remove(BRRF)
+    os.remove(BKRF)
+
+
+def read_snapshot(compact):
+    rollrec = RollRec()
+    assert rollrec.read_snapshot(BRRF, compact=compact)
+    return len(rollrec)
+
+
+def write_snapshot(compact):
+    rollrec = RollRec()
+    rollrec.read(BRRF, compact=compact)
+    rollrec.write_snapshot()
+
+
+def snapshot():
+    '''
+    Rollrec loading: text file vs binary snapshot
+    '''
+    measure(generate_rollrec, PARSE_RECORDS)
+    for compact in (False, True):
+        name = 'compact' if compact else 'tabbed'
+        measure(write_snapshot, compact)
+        report('text %s' % name, *measure(read_compact, RollRec, BRRF, compact))
+        report('snapshot %s' % name, *measure(read_snapshot, compact))
+    os.remove(BRRF)
+    os.remove(BRRF + '.snap')
+
+
+def lazy_zone(rollrec_class):
+    '''
+    Read the rollrec, change a zone and save it, as zone commands do.
+    '''
+    rollrec = rollrec_class()
+    rollrec.read(BRRF)
+    roll = rollrec['zone%d.example' % (PARSE_RECORDS // 2)]
+    roll.settime()
+    rollrec.save()
+    return roll['zskphase']
+
+
+def lazy():
+    '''
+    Single zone operation: RollRec vs LazyRollRec
+    '''
+    measure(generate_rollrec, PARSE_RECORDS)
+    report('RollRec', *measure(lazy_zone, RollRec))
+    report('LazyRollRec', *measure(lazy_zone, LazyRollRec))
+    os.remove(BRRF)
+
+
+SIGN_ZONES = 32
+SIGN_SLEEP = 0.5
+BZS = os.path.join(HOME_DIR, 'bench-zonesigner')
+
+
+class SignRollerD(RollerD):
+    '''
+    Signs every zone once, with a zonesigner which only sleeps.
+    '''
+    def rolllog_log(self, level, group, message):
+        pass
+
+    def rollzone(self, rname):
+        rrr = self.rollrec_fullrec(rname)
+        self.signer(rname, 'ZSK phase 2', rrr.keyrec())
+
+
+def sign_zones(signers):
+    rollerd = SignRollerD()
+    rollerd.rollrecfile = BRRF
+    rollerd.xqtdir = HOME_DIR
+    rollerd.zonesigner = BZS
+    rollerd.signers = signers
+    rollerd.rollrec_read()
+    rollerd.rollzones(rollerd.rollrec_names())
+    return sum(1 for roll in rollerd.ROLLREC.values() if roll.is_active)
+
+
+def sign():
+    '''
+    Zone signing: sequential vs a pool of concurrent zonesigners
+    '''
+    with open(BZS, 'w') as f:
+        f.write('#!/bin/sh\nsleep %s\n' % SIGN_SLEEP)
+    os.chmod(BZS, stat.S_IRWXU)
+    measure(generate_keyrec, SIGN_ZONES * 4)
+    rollrec = RollRec()
+    for i in range(SIGN_ZONES):
+        roll = Roll()
+        roll.name = 'zone%d.example' % i
+        roll['zonename'] = roll.name
+        roll['keyrec'] = BKRF
+        rollrec[roll.name] = roll
+    rollrec.write(BRRF)
+    print('%d zones, zonesigner sleeping %s s' % (SIGN_ZONES, SIGN_SLEEP))
+    for signers in (1, 4, 16):
+        report('signers=%d' % signers, *measure(sign_zones, signers))
+    os.remove(BZS)
+    os.remove(BRRF)
+    os.remove(BKRF)
+
+
+RELOAD_ZONES = 200
+RELOAD_SLEEP = 0.02
+BRNDC = os.path.join(HOME_DIR, 'bench-rndc')
+
+
+class ReloadRollerD(RollerD):
+    '''
+    Reloads every zone for two phases, with an rndc which only sleeps.
+    '''
+    rndc = BRNDC
+    rndcopts = ''
+    zoneload = True
+
+    def rolllog_log(self, level, group, message):
+        pass
+
+    def rollzone(self, rname):
+        rrr = self.rollrec_fullrec(rname)
+        self.loadzone(rname, rrr, 'ZSK phase 2')
+        self.loadzone(rname, rrr, 'ZSK phase 4')
+
+
+def reload_zones(batch, jobs):
+    rollerd = ReloadRollerD()
+    rollerd.rollrecfile = BRRF
+    rollerd.reload_batch = batch
+    rollerd.reload_jobs = jobs
+    rollerd.rollrec_read()
+    rollerd.rollzones(rollerd.rollrec_names())
+    with open(BRNDC + '.log') as f:
+        return sum(1 for line in f)
+
+
+def reload():
+    '''
+    Zone reloads: one rndc per phase vs batched concurrent rndc
+    '''
+    with open(BRNDC, 'w') as f:
+        f.write('#!/bin/sh\nsleep %s\necho \"$@\" >> %s.log\n' % (
+            RELOAD_SLEEP, BRNDC))
+    os.chmod(BRNDC, stat.S_IRWXU)
+    measure(generate_rollrec, RELOAD_ZONES)
+    print('%d zones, rndc sleeping %s s' % (RELOAD_ZONES, RELOAD_SLEEP))
+    for name, batch, jobs in (
+            ('rndc per phase', False, 1),
+            ('batched jobs=1', True, 1),
+            ('batched jobs=8', True, 8)):
+        report(name, *measure(reload_zones, batch, jobs))
+        os.remove(BRNDC + '.log')
+    os.remove(BRNDC)
+    os.remove(BRRF)
+
+
+COALESCE_ZONES = 32
+COALESCE_SLEEP = 0.1
+
+
+class CoalesceRollerD(SignRollerD):
+    '''
+    Re-signs every zone for a modified zone file, signs it for a phase,
+    then re-signs it for -alwayssign.
+    '''
+    def rollzone(self, rname):
+        rrr = self.rollrec_fullrec(rname)
+        self.signer(rname, rrr.phaseargs, rrr.keyrec())
+        self.signer(rname, 'ZSK phase 2', rrr.keyrec())
+        self.signer(rname, rrr.phaseargs, rrr.keyrec())
+
+
+def coalesce_zones(coalesce):
+    rollerd = CoalesceRollerD()
+    rollerd.rollrecfile = BRRF
+    rollerd.xqtdir = HOME_DIR
+    rollerd.zonesigner = BZS
+    rollerd.coalesce = coalesce
+    rollerd.rollrec_read()
+    rollerd.rollzones(rollerd.rollrec_names())
+    with open(BZS + '.log') as f:
+        return sum(1 for line in f)
+
+
+def coalesce():
+    '''
+    Zone signing: every signing vs coalesced re-signings
+    '''
+    with open(BZS, 'w') as f:
+        f.write('#!/bin/sh\nsleep %s\necho \"$@\" >> %s.log\n' % (
+            COALESCE_SLEEP, BZS))
+    os.chmod(BZS, stat.S_IRWXU)
+    measure(generate_keyrec, COALESCE_ZONES * 4)
+    rollrec = RollRec()
+    for i in range(COALESCE_ZONES):
+        roll = Roll()
+        roll.name = 'zone%d.example' % i
+        roll['zonename'] = roll.name
+        roll['keyrec'] = BKRF
+        roll['kskphase'] = '0'
+        roll['zskphase'] = '0'
+        rollrec[roll.name] = roll
+        open(os.path.join(os.path.dirname(BKRF), roll.name), 'w').close()
+    rollrec.write(BRRF)
+    print('%d zones, zonesigner sleeping %s s' % (
+        COALESCE_ZONES, COALESCE_SLEEP))
+    for name, flag in (('every signing', False), ('coalesced', True)):
+        report(name, *measure(coalesce_zones, flag))
+        os.remove(BZS + '.log')
+    for name in rollrec:
+        os.remove(os.path.join(os.path.dirname(BKRF), name))
+    os.remove(BZS)
+    os.remove(BRRF)
+    os.remove(BKRF)
+
+
+CONTROL_ROUNDS = 2000
+CONTROL_ZONES = 5000
+CONTROL_STATUS = 3
+BSOCK = os.path.join(HOME_DIR, 'bench-rollmgr.socket')
+
+
+class LegacyFrameReader(rollmgr.FrameReader):
+    '''
+    Reads a byte at a time, as rollmgr_getcmd() and rollmgr_getresp() did.
+    '''
+    def readframe(self):
+        data = b''
+        buf = b'  '  # 2-byted buf
+        while buf != rollmgr.EOL:
+            s = self.sock.recv(1)
+            if not s:
+                break
+            buf += s  # push byte into buf
+            data += s  # and into stored data
+            buf = buf[-2:]  # truncate to last 2 bytes
+        return data[:-3]
+
+
+class ControlPeer(rollmgr.RollMgrMixin):
+    sockfile = BSOCK
+
+
+def control_rounds(legacy, rounds, resp):
+    '''
+    Send a command and read its response, rounds times, with a server
+    process sending resp.
+    '''
+    if legacy:
+        rollmgr.FrameReader = LegacyFrameReader
+    server = ControlPeer()
+    server.rollmgr_channel(True)
+    pid = os.fork()
+    if not pid:
+        for i in range(rounds):
+            server.rollmgr_getcmd()
+            server.rollmgr_sendresp(0, resp)
+            server.rollmgr_closechan()
+        os._exit(0)
+    server.SOCK.close()
+
+    client = ControlPeer()
+    received = 0
+    for i in range(rounds):
+        client.rollmgr_sendcmd(rollmgr.CHANNEL_WAIT, 'rollcmd_zonestatus', '')
+        ret, respbuf = client.rollmgr_getresp()
+        client.rollmgr_closechan()
+        received += len(respbuf)
+    os.waitpid(pid, 0)
+    os.remove(BSOCK)
+    return received
+
+
+def control_latency(legacy):
+    started = time.time()
+    control_rounds(legacy, CONTROL_ROUNDS, 'rollerd is running')
+    return '%.0f us/cmd' % (
+        (time.time() - started) * 1000000 / CONTROL_ROUNDS)
+
+
+def control_throughput(legacy):
+    resp = ''.join(
+        'zone%d.example\tactive\tZSK 2\tKSK 0\t2015-01-05 12:00\n' % i
+        for i in range(CONTROL_ZONES))
+    started = time.time()
+    received = control_rounds(legacy, CONTROL_STATUS, resp)
+    return '%.1f MB/s' % (received / (time.time() - started) / 1000000)
+
+
+def control():
+    '''
+    Control socket: byte-at-a-time vs buffered frame reading
+    '''
+    print('%d small commands, %d zonestatus responses of %d zones' % (
+        CONTROL_ROUNDS, CONTROL_STATUS, CONTROL_ZONES))
+    report('latency recv(1)', *measure(control_latency, True))
+    report('latency buffered', *measure(control_latency, False))
+    report('zonestatus recv(1)', *measure(control_throughput, True))
+    report('zonestatus buffered', *measure(control_throughput, False))
+
+
+PIPELINE_ZONES = 5000
+
+
+class PipelinePeer(DaemonMixin, rollmgr.RollMgrMixin):
+    '''
+    Daemon answering every command at once, as commander() does.
+    '''
+    sockfile = BSOCK
+    control_queue = None
+
+    def rolllog_log(self, level, group, msg):
+        pass
+
+    def runcmd(self, cmd, data):
+        self.rollmgr_sendresp(
+            defs.ROLLCMD_RC_OKAY, 'rollover restarted for zone %s' % data)
+        return False
+
+
+def pipeline_zones(session):
+    '''
+    Send a rollzone command for PIPELINE_ZONES zones, through a session
+    or one connection each.
+    '''
+    server = PipelinePeer()
+    server.rollmgr_channel(True)
+    pid = os.fork()
+    if not pid:
+        while 42:
+            server.commander(5)
+    server.SOCK.close()
+
+    client = PipelinePeer()
+    zones = ['zone%d.example' % i for i in range(PIPELINE_ZONES)]
+    started = time.time()
+    if session:
+        for cmd, data, ret, resp in client.rollmgr_pipeline(
+                (defs.ROLLCMD_ROLLZONE, zone) for zone in zones):
+            assert ret == defs.ROLLCMD_RC_OKAY
+    else:
+        for zone in zones:
+            client.rollmgr_sendcmd(
+                rollmgr.CHANNEL_WAIT, defs.ROLLCMD_ROLLZONE, zone)
+            ret, resp = client.rollmgr_getresp()
+            client.rollmgr_closechan()
+            assert ret == defs.ROLLCMD_RC_OKAY
+    elapsed = time.time() - started
+    os.kill(pid, 9)
+    os.waitpid(pid, 0)
+    os.remove(BSOCK)
+    return '%.0f us/zone' % (elapsed * 1000000 / PIPELINE_ZONES)
+
+
+def pipeline():
+    '''
+    Control socket: one connection per command vs a pipelined session
+    '''
+    print('rollzone of %d zones' % PIPELINE_ZONES)
+    report('connection per zone', *measure(pipeline_zones, False))
+    report('session', *measure(pipeline_zones, True))
+
+
+class StatusDaemon(RollerD):
+    sockfile = BSOCK
+    rollrecfile = BRRF
+
+    def rolllog_log(self, level, group, msg):
+        pass
+
+
+def zonestatus_client(stream):
+    '''
+    Get the status of the zones of BRRF from a daemon process, as
+    a single response or streamed.
+    '''
+    pid = os.fork()
+    if not pid:
+        server = StatusDaemon()
+        server.rollrec_read()
+        server.status_load()  # as eminent_domains() does
+        server.rollmgr_channel(True)
+        while 42:
+            server.commander(5)
+    while not os.path.exists(BSOCK):
+        time.sleep(0.1)
+
+    client = StatusDaemon()
+    client.rollmgr_sendcmd(
+        rollmgr.CHANNEL_WAIT, defs.ROLLCMD_ZONESTATUS,
+        'stream' if stream else '')
+    zones = 0
+    for ret, resp in client.rollmgr_getstream():
+        zones += resp.count('\n')
+    client.rollmgr_closechan()
+    os.kill(pid, 9)
+    os.waitpid(pid, 0)
+    os.remove(BSOCK)
+    return '%d zones' % zones
+
+
+def zonestatus():
+    '''
+    zonestatus: single response vs streamed chunks, client memory
+    '''
+    measure(generate_rollrec, PARSE_RECORDS)
+    report('empty', *measure(len, ''))
+    report('single response', *measure(zonestatus_client, False))
+    report('streamed', *measure(zonestatus_client, True))
+    os.remove(BRRF)
+
+
+STATUS_ROUNDS = 10
+
+
+def status_rounds(table):
+    '''
+    Move a zone to its next phase, then get the status of a zone,
+    STATUS_ROUNDS times: from the rollrec file parsed again, as the
+    readers' snapshot did, or from the daemon's status table.
+    '''
+    daemon = StatusDaemon()
+    daemon.rollrec_read()
+    daemon.status_load()
+    opts = daemon.zonestatus_opts('zone=zone0.example')
+    elapsed = 0
+    for i in range(STATUS_ROUNDS):
+        rname = 'zone%d.example' % i
+        daemon.ROLLREC[rname]['zskphase'] = '1'
+        daemon.rollrec_write()
+        started = time.time()
+        if table:
+            daemon.status_zone(rname)
+            zones = daemon.status_table().zones
+        else:
+            rollrec = RollRec()
+            rollrec.read(BRRF)
+            zones = [
+                daemon.status_entry(rname, rrr)
+                for rname, rrr in rollrec.rolls(active_only=False)]
+        list(daemon.zonestatus_lines(zones, opts))
+        elapsed += time.time() - started
+    return '%.1f ms' % (elapsed * 1000 / STATUS_ROUNDS)
+
+
+def status():
+    '''
+    zonestatus after a phase change: rollrec parsed again vs status table
+    '''
+    measure(generate_rollrec, PARSE_RECORDS)
+    report('parsed again', *measure(status_rounds, False))
+    report('status table', *measure(status_rounds, True))
+    os.remove(BRRF)
+
+
+WRITE_SAVES = 20
+
+
+def save_rollrec(legacy):
+    '''
+    Change a zone and save the rollrec, WRITE_SAVES times.
+    '''
+    rollrec = RollRec()
+    rollrec.read(BRRF)
+    rollrec.save()  # formats all the zones once
+    for i in range(WRITE_SAVES):
+        roll = rollrec['zone%d.example' % i]
+        roll.settime()
+        if legacy:  # as TabbedConf.write() did before
+            f = open(BRRF, 'w')
+            f.write('\n'.join('%s' % roll for roll in rollrec.values()))
+            f.close()
+        else:
+            rollrec.save()
+    return WRITE_SAVES
+
+
+def write():
+    '''
+    Rollrec saving: cached section text and atomic replace vs full rewrite
+    '''
+    measure(generate_rollrec, PARSE_RECORDS)
+    report('rewrite', *measure(save_rollrec, True))
+    report('save', *measure(save_rollrec, False))
+    os.remove(BRRF)
+
+
+if __name__ == '__main__':
+    started = False
+
+    if 'maxttl' in sys.argv:
+        started = True
+        maxttl()
+    if 'parse' in sys.argv:
+        started = True
+        parse()
+    if 'write' in sys.argv:
+        started = True
+        write()
+    if 'memory' in sys.argv:
+        started = True
+        memory()
+    if 'snapshot' in sys.argv:
+        started = True
+        snapshot()
+    if 'lazy' in sys.argv:
+        started = True
+        lazy()
+    if 'sign' in sys.argv:
+        started = True
+        sign()
+    if 'reload' in sys.argv:
+        started = True
+        reload()
+    if 'coalesce' in sys.argv:
+        started = True
+        coalesce()
+    if 'control' in sys.argv:
+        started = True
+        control()
+    if 'pipeline' in sys.argv:
+        started = True
+        pipeline()
+    if 'zonestatus' in sys.argv:
+        started = True
+        zonestatus()
+    if 'status' in sys.argv:
+        started = True
+        status()
+    if 'all' in sys.argv:
+        started = True
+        maxttl()
+        parse()
+        write()
+        memory()
+        snapshot()
+        lazy()
+        sign()
+        reload()
+        coalesce()
+        control()
+        pipeline()
+        zonestatus()
+        status()
+
+    if not started:
+        print(
+            'Usage: ./benchmarks.py '
+            '<maxttl|parse|write|memory|snapshot|lazy|sign|reload|coalesce|'
+            'control|pipeline|zonestatus|status|all>')
@@ -33,12 +33,14 @@ class CommonMixin(object):
         print(self.VERS)
         print(self.DTVERS)
 
-    def get_options(self, opts, args):
+    def get_options(self, opts, args, positional=False):
         '''
         @param opts: options with default values
         @type opts: dict
         @param args: command line arguments
         @type args: list
+        @param positional: allow arguments which aren't options
+        @type positional: bool
         @returns: parsed options
         @rtype: dict
         '''
@@ -56,6 +58,8 @@ class CommonMixin(object):
                 value = None
             if re.match(r'\-{1,2}[^\-]+', key):
                 key = key.lstrip('-')
+            elif positional:
+                continue
             else:
                 return None
             if key in opts:
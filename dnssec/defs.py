@@ -61,6 +61,7 @@ MIN_SLEEP = 10  # Minimum time rollerd will sleep.
 
 EVT_FULLLIST = 1  # Full list is run every N seconds.
 EVT_QUEUE_SOON = 2  # Queues, with "soon" events.
+EVT_EVENTLOOP = 3  # Soon queue, subprocesses and commands in an event loop.
 
 QUEUE_ERRTIME = 60  # Time to sleep on rollrec error.
 
@@ -112,6 +113,7 @@ ROLLCMD_ZONEGROUP = 'rollcmd_zonegroup'
 ROLLCMD_ZONELOG = 'rollcmd_zonelog'
 ROLLCMD_ZONESTATUS = 'rollcmd_zonestatus'
 ROLLCMD_ZSARGS = 'rollcmd_zsargs'
+ROLLCMD_SESSION = 'rollcmd_session'  # pyrollerd only, see rollmgr.
 
 # The ROLLCMD_RC_ entities are return codes sent from rollerd and received
 # by client programs from rollmgr_getresp().
@@ -131,3 +133,5 @@ ROLLCMD_RC_ZSKROLL = 12
 ROLLCMD_RC_NOARGS = 13
 ROLLCMD_RC_BADEVENT = 14
 ROLLCMD_RC_BADZONEGROUP = 15
+ROLLCMD_RC_CHUNK = 16  # pyrollerd only, see rollmgr_sendstream().
+ROLLCMD_RC_BADARGS = 17  # pyrollerd only.
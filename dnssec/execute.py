@@ -0,0 +1,162 @@
+# Copyright (C) 2015 Okami, okami@fuzetsu.info
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import collections
+import os
+import selectors
+import signal
+import subprocess
+import time
+
+OUTPUT_LIMIT = 64 * 1024  # Bytes of output kept (the last ones).
+KILL_GRACE = 5  # Seconds between SIGTERM and SIGKILL on a timeout.
+READ_SIZE = 1 << 16
+
+# Outcome of a command.
+Result = collections.namedtuple('Result', (
+    'args',  # command's arguments
+    'returncode',  # exit status, negative for a signal
+    'duration',  # seconds
+    'output',  # last OUTPUT_LIMIT bytes of stdout and stderr, decoded
+    'size',  # total output size in bytes
+    'timedout',  # killed after its timeout
+))
+
+
+class RingBuffer(object):
+    '''
+    Keeps the last bytes written to it, up to a limit.
+    '''
+    def __init__(self, limit=OUTPUT_LIMIT):
+        self.limit = limit
+        self.size = 0  # Bytes written so far.
+        self._chunks = collections.deque()
+        self._kept = 0
+
+    def write(self, data):
+        self.size += len(data)
+        self._chunks.append(data)
+        self._kept += len(data)
+        while self._kept - len(self._chunks[0]) >= self.limit:
+            self._kept -= len(self._chunks.popleft())
+
+    def getvalue(self):
+        data = b''.join(self._chunks)[-self.limit:]
+        text = data.decode('utf8', 'replace')
+        if self.size > len(data):
+            text = '[%d bytes dropped]\n%s' % (self.size - len(data), text)
+        return text
+
+
+def start(args, cwd=None):
+    '''
+    Start a command in its own process group, so a timeout kills
+    the programs it runs too.
+
+    @param args: Command's arguments.
+    @type args: list
+    @param cwd: Command's directory.
+    @type cwd: str
+
+    @returns: running command
+    @rtype: subprocess.Popen
+    '''
+    return subprocess.Popen(
+        args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT, cwd=cwd, start_new_session=True)
+
+
+def kill(p, signum):
+    '''
+    Send a signal to a command's process group.
+    '''
+    try:
+        os.killpg(p.pid, signum)
+    except OSError:
+        pass
+
+
+def collect(p, timeout=None, limit=OUTPUT_LIMIT, started=None):
+    '''
+    Read a command's output as it comes and wait for it.  A command
+    still running after its timeout gets a SIGTERM, then a SIGKILL
+    KILL_GRACE seconds later.
+
+    @param p: Command started by start().
+    @type p: subprocess.Popen
+    @param timeout: Seconds the command may run, None for no limit.
+    @type timeout: float
+    @param limit: Bytes of output kept.
+    @type limit: int
+    @param started: Command's start time, now by default.
+    @type started: float
+
+    @returns: command's outcome
+    @rtype: Result
+    '''
+    started = started or time.time()
+    deadline = started + timeout if timeout else None
+    timedout = False
+    output = RingBuffer(limit)
+    fd = p.stdout.fileno()
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        while 42:
+            wait = 1.0
+            if deadline:
+                wait = max(0, min(wait, deadline - time.time()))
+            if selector.select(wait):
+                data = os.read(fd, READ_SIZE)
+                if not data:
+                    break
+                output.write(data)
+                continue
+            # The output may be kept open by a program left behind.
+            if p.poll() is not None:
+                break
+            if deadline and time.time() >= deadline:
+                if not timedout:
+                    timedout = True
+                    kill(p, signal.SIGTERM)
+                    deadline = time.time() + KILL_GRACE
+                else:
+                    kill(p, signal.SIGKILL)
+                    deadline = None
+    p.stdout.close()
+    returncode = p.wait()
+    return Result(
+        p.args, returncode, time.time() - started, output.getvalue(),
+        output.size, timedout)
+
+
+def execute(args, cwd=None, timeout=None, limit=OUTPUT_LIMIT):
+    '''
+    Run a command and wait for it.
+
+    @param args: Command's arguments.
+    @type args: list
+    @param cwd: Command's directory.
+    @type cwd: str
+    @param timeout: Seconds the command may run, None for no limit.
+    @type timeout: float
+    @param limit: Bytes of output kept.
+    @type limit: int
+
+    @returns: command's outcome
+    @rtype: Result
+    '''
+    started = time.time()
+    return collect(start(args, cwd), timeout, limit, started)
@@ -15,11 +15,143 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
 import collections
+import collections.abc
+import os
+import re
+import stat
+import sys
+import tempfile
 
 
-class TabbedConf(collections.OrderedDict):
+BLOCKSIZE = 1 << 20  # Read buffer size.
+
+
+def file_stamp(path):
+    '''
+    Identify the current version of a file on disk.
+
+    @param path: File path.
+    @type path: str
+
+    @returns: (inode, mtime in nanoseconds, size)
+    @rtype: tuple
+    '''
+    st = os.stat(path)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def tokenize(path):
+    '''
+    Iterate over the <key> "<value>" lines of a DNSSEC-Tools
+    configuration file (rollrec, keyrec).  Comments and lines which
+    don't match are skipped.
+
+    @param path: File path.
+    @type path: str
+
+    @returns: (key, value) pairs
+    @rtype: generator
+    '''
+    with open(path, 'r', buffering=BLOCKSIZE) as f:
+        yield from tokenize_lines(f)
+
+
+def tokenize_lines(lines):
+    '''
+    Same as tokenize(), for lines already in memory.
+
+    @param lines: Lines of a configuration file.
+    @type lines: iterable
+
+    @returns: (key, value) pairs
+    @rtype: generator
+    '''
+    for line in lines:
+        pair = line.split(None, 1)
+        if len(pair) < 2 or pair[0][0] == '#':
+            continue
+        key, rest = pair
+        if rest[0] != '"':
+            continue
+        end = rest.find('"', 1)
+        if end > 1:
+            yield key, rest[1:end]
+
+
+def replace_file(path, data):
+    '''
+    Write the data to a temporary file in the same directory, sync it and
+    rename it over the old file, so readers never see a partially written
+    file.  The mode of the old file is kept.
+
+    @param path: File path.
+    @type path: str
+    @param data: File contents.
+    @type data: str or bytes
+
+    @returns: file_stamp() of the new file
+    @rtype: tuple
+    '''
+    path = os.path.realpath(path)
+    directory, name = os.path.split(path)
+    fd, tmppath = tempfile.mkstemp(prefix='.%s.' % name, dir=directory)
+    try:
+        with open(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        else:  # mode of a file created with open()
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmppath, mode)
+        os.replace(tmppath, path)
+    except:
+        os.remove(tmppath)
+        raise
+    dirfd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dirfd)
+    finally:
+        os.close(dirfd)
+    return file_stamp(path)
+
+
+class Conf(object):
+    '''
+    Common part of the sections, whatever their storage.
+
+    Sections keep their serialized text until they are changed, so that
+    saving a file only formats the sections which were modified.
+    '''
+    __slots__ = ()
+
     _parent = None
     _directory = None
+    _stamp = None  # file_stamp() of the file as last read or written
+    _text = None  # cached str(self)
+    _dirty = True  # root: changed since the file was last read or written
+
+    def touch(self):
+        '''
+        Mark the section and its parents as changed.
+        '''
+        conf = self
+        while conf is not None:
+            conf._text = None
+            conf._dirty = True
+            conf = conf._parent
+
+    def text(self):
+        '''
+        @returns: str(self), cached until the section is changed
+        @rtype: str
+        '''
+        if self._text is None:
+            self._text = str(self)
+        return self._text
 
     def _format(self, key, value):
         tabs = 1  # minimum tabs count
@@ -28,12 +160,165 @@ class TabbedConf(collections.OrderedDict):
         return ('\t%s' + ('\t' * tabs) + '"%s"\n') % (key, value)
 
     def write(self, path):
-        f = open(path, 'w')
-        f.write(str(self))
-        f.close()
+        '''
+        Replace the file with the formatted configuration.
+
+        @param path: File path.
+        @type path: str
+        '''
+        self._stamp = replace_file(path, self.text())
+        self._dirty = False
 
     def save(self):
         if self._parent:
             self._parent.save()
-        else:  # root
+        elif self._dirty:  # root
             self.write(self._path)
+
+
+class TabbedConf(Conf, collections.OrderedDict):
+    _setitem = collections.OrderedDict.__setitem__  # no change tracking
+
+    def _dump(self):
+        '''
+        @returns: field names and values, as stored
+        @rtype: tuple
+        '''
+        return tuple(self.keys()), tuple(self.values())
+
+    def _load(self, keys, values):
+        '''
+        Set the fields from _dump() output, without change tracking.
+        '''
+        setitem = collections.OrderedDict.__setitem__
+        for key, value in zip(keys, values):
+            setitem(self, key, value)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if isinstance(value, Conf):
+            value._parent = self
+        self.touch()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.touch()
+
+
+class Shape(object):
+    '''
+    Field names of compact sections, shared by all the sections having
+    the same fields in the same order.
+    '''
+    __slots__ = ('keys', 'index', '_next')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.index = {key: i for i, key in enumerate(keys)}
+        self._next = {}
+
+    def add(self, key):
+        '''
+        @returns: shape with the field appended
+        @rtype: Shape
+        '''
+        shape = self._next.get(key)
+        if shape is None:
+            shape = self._next[key] = get_shape(self.keys + (sys.intern(key),))
+        return shape
+
+    def remove(self, key):
+        '''
+        @returns: shape without the field
+        @rtype: Shape
+        '''
+        return get_shape(tuple(x for x in self.keys if x != key))
+
+
+SHAPES = {}  # {field names: Shape}
+
+NUMBER = re.compile(r'0|[1-9][0-9]*')  # numbers which str(int()) gives back
+
+
+def get_shape(keys):
+    shape = SHAPES.get(keys)
+    if shape is None:
+        shape = SHAPES[keys] = Shape(keys)
+    return shape
+
+
+class CompactConf(Conf, collections.abc.MutableMapping):
+    '''
+    Section storing its values in a list next to a shared Shape, instead
+    of an ordered dict per section.  The fields listed in _NUMERIC are
+    kept as integers when their text is a plain number, and are given
+    back as text, so the section reads and formats like a TabbedConf.
+    '''
+    __slots__ = ('_parent', '_directory', '_stamp', '_text', '_dirty',
+                 '_shape', '_values')
+
+    _NUMERIC = frozenset()
+
+    def __init__(self):
+        self._parent = None
+        self._directory = None
+        self._stamp = None
+        self._text = None
+        self._dirty = True
+        self._shape = get_shape(())
+        self._values = []
+
+    def _setitem(self, key, value):
+        '''
+        Set a field without change tracking.
+        '''
+        if (key in self._NUMERIC and type(value) is str and
+                NUMBER.fullmatch(value)):
+            value = int(value)
+        i = self._shape.index.get(key)
+        if i is None:
+            self._shape = self._shape.add(key)
+            self._values.append(value)
+        else:
+            self._values[i] = value
+
+    def _dump(self):
+        '''
+        @returns: field names and values, as stored
+        @rtype: tuple
+        '''
+        return self._shape.keys, tuple(self._values)
+
+    def _load(self, keys, values):
+        '''
+        Set the fields from _dump() output, without change tracking.
+        '''
+        self._shape = get_shape(keys)
+        self._values = list(values)
+
+    def __setitem__(self, key, value):
+        self._setitem(key, value)
+        self.touch()
+
+    def __getitem__(self, key):
+        value = self._values[self._shape.index[key]]
+        if type(value) is int and key in self._NUMERIC:
+            return str(value)
+        return value
+
+    def __delitem__(self, key):
+        del self._values[self._shape.index[key]]
+        self._shape = self._shape.remove(key)
+        self.touch()
+
+    def __contains__(self, key):
+        return key in self._shape.index
+
+    def __iter__(self):
+        return iter(self._shape.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, list(self.items()))
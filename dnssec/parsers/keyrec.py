@@ -26,17 +26,123 @@ import re
 import time
 
 from . import DATETIME_FORMAT
-from .abstract import TabbedConf
+from .abstract import CompactConf, TabbedConf, file_stamp, tokenize
 
 
-class Section(TabbedConf):
+# Parsed DNSKEY record of a .key file.
+DNSKey = collections.namedtuple(
+    'DNSKey', ('flags', 'protocol', 'algorithm', 'key', 'keytag'))
+
+# .key files parsed by this process: {abspath: (file_stamp, DNSKey)}
+DNSKEY_CACHE = {}
+
+# Apex DNSKEYs of the signed zones parsed by this process:
+# {abspath: (file_stamp, frozenset of key bytes)}
+ZONE_DNSKEYS_CACHE = {}
+
+
+def dnskey_keytag(flags, protocol, algorithm, key):
+    '''
+    Key tag of a DNSKEY record (RFC 4034, Appendix B).
+    '''
+    if algorithm == 1:  # RSA/MD5
+        return (key[-3] << 8) + key[-2]
+    rdata = bytes((flags >> 8, flags & 0xff, protocol, algorithm)) + key
+    ac = sum(rdata[0::2]) << 8
+    ac += sum(rdata[1::2])
+    ac += (ac >> 16) & 0xffff
+    return ac & 0xffff
+
+
+def read_dnskey(path):
+    '''
+    Parse the DNSKEY record of a .key file.  Records are shared by all
+    the keys of the process and parsed again only if the file changes.
+
+    @param path: .key file path.
+    @type path: str
+
+    @returns: DNSKEY record
+    @rtype: DNSKey
+    '''
+    path = os.path.abspath(path)
+    stamp = file_stamp(path)
+    cached = DNSKEY_CACHE.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    with open(path, 'r') as f:
+        tokens = ' '.join(
+            x.split(';', 1)[0] for x in f
+            if not x.strip().startswith(';')).split()
+    i = tokens.index('DNSKEY')
+    flags, protocol, algorithm = map(int, tokens[i + 1:i + 4])
+    key = base64.b64decode(''.join(tokens[i + 4:]))
+    dnskey = DNSKey(
+        flags, protocol, algorithm, key,
+        dnskey_keytag(flags, protocol, algorithm, key))
+    DNSKEY_CACHE[path] = (stamp, dnskey)
+    return dnskey
+
+
+def read_private(path):
+    '''
+    Parse the fields of a BIND .private file ("Modulus", "PrivateKey",
+    ...).  The values are left encoded.
+
+    @param path: .private file path.
+    @type path: str
+
+    @returns: fields
+    @rtype: dict
+    '''
+    fields = {}
+    with open(path, 'r') as f:
+        for line in f:
+            key, sep, value = line.partition(':')
+            if sep:
+                fields[key.strip()] = value.strip()
+    return fields
+
+
+def zone_dnskeys(path, origin):
+    '''
+    Keys of the apex DNSKEY RRset of a (signed) zone file.
+
+    @param path: Zone file path.
+    @type path: str
+    @param origin: Zone name.
+    @type origin: str
+
+    @returns: keys
+    @rtype: frozenset
+    '''
+    path = os.path.abspath(path)
+    stamp = file_stamp(path)
+    cached = ZONE_DNSKEYS_CACHE.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    zonedata = dns.zone.from_file(path, origin)
+    dnskeys = zonedata.get_rdataset(zonedata.origin, dns.rdatatype.DNSKEY)
+    keys = frozenset(x.key for x in dnskeys or ())
+    ZONE_DNSKEYS_CACHE[path] = (stamp, keys)
+    return keys
+
+
+class SectionMixin(object):
+    '''
+    Keyrec section, see the Zone, KeySet and Key classes and their
+    compact variants for the storage.
+    '''
+    __slots__ = ()
+
     _TYPE = None
     _name = None
-    _directory = None
 
-    name = property(
-        lambda self: self._name,
-        lambda self, name: setattr(self, '_name', name))
+    def _set_name(self, name):
+        self._name = name
+        self.touch()
+
+    name = property(lambda self: self._name, _set_name)
     directory = property(
         lambda self: self._directory,
         lambda self, directory: setattr(self, '_directory', directory))
@@ -47,12 +153,16 @@ class Section(TabbedConf):
             ''.join(map(lambda x: self._format(*x), self.items())))
 
 
-class Zone(Section):
+class ZoneMixin(SectionMixin):
     ''' Zone section '''
+    __slots__ = ()
+
+    _NUMERIC = frozenset(('keyrec_signsecs',))
 
     _TYPE = 'zone'
     _zskcur = None
     _zskpub = None
+    _zsknew = None
     _kskcur = None
     _kskpub = None
 
@@ -101,7 +211,11 @@ class Zone(Section):
             datetime.datetime.utcfromtimestamp(t).strftime(DATETIME_FORMAT))
 
 
-class KeySet(Section):
+class KeySetMixin(SectionMixin):
+    __slots__ = ()
+
+    _NUMERIC = frozenset(('keyrec_setsecs',))
+
     _TYPE = 'set'
     _zone = None
     _keys = tuple()
@@ -130,10 +244,14 @@ class KeySet(Section):
             datetime.datetime.utcfromtimestamp(t).strftime(DATETIME_FORMAT))
 
 
-class Key(Section):
+class KeyMixin(SectionMixin):
+    __slots__ = ()
+
+    _NUMERIC = frozenset((
+        'keyrec_gensecs', 'zsklife', 'ksklife', 'zsklength', 'ksklength'))
+
     _TYPE = 'key'
     _zone = None
-    _contents = None
 
     def definition(self):
         return '%s %s' % (
@@ -149,19 +267,13 @@ class Key(Section):
     def key_path(self):
         return self._full_path('keypath')
 
-    def _get_contents(self):
-        if not self._contents:
-            f = open(self.key_path)
-            self._contents = ''.join(
-                x.strip('\n ')
-                for x in f.readlines()
-                if not x.strip().startswith(';'))
-        return self._contents
-
-    def _dnskey_data(self, i):
-        dnskey = self._get_contents().split().index('DNSKEY')
-        if dnskey >= 0:
-            return self._get_contents().split()[dnskey + i]
+    @property
+    def dnskey(self):
+        '''
+        @returns: DNSKEY record of the .key file
+        @rtype: DNSKey
+        '''
+        return read_dnskey(self.key_path)
 
     @property
     def zone(self):
@@ -183,7 +295,7 @@ class Key(Section):
 
     @property
     def protocol(self):
-        return int(self._dnskey_data(2))
+        return self.dnskey.protocol
 
     @property
     def algorithm(self):
@@ -191,18 +303,27 @@ class Key(Section):
         Algorithm number, see IANA Assignments:
         http://www.iana.org/assignments/dns-sec-alg-numbers/dns-sec-alg-numbers.xml
         '''
-        return int(self._dnskey_data(3))
+        return self.dnskey.algorithm
 
     def public_key(self):
-        dnskey = self._get_contents().split().index('DNSKEY')
-        if dnskey >= 0:
-            return ' '.join(self._get_contents().split()[dnskey + 4:])
+        return base64.b64encode(self.dnskey.key).decode('ascii')
 
     def public_key_source(self):
-        return base64.b64decode(self.public_key())
+        return self.dnskey.key
+
+    @property
+    def private_path(self):
+        path = self.key_path
+        if path.endswith('.key'):
+            path = path[:-4]
+        return path + '.private'
 
     def private_key(self):
-        raise NotImplemented()
+        '''
+        @returns: fields of the .private file
+        @rtype: dict
+        '''
+        return read_private(self.private_path)
 
     @property
     def keytype(self):
@@ -239,11 +360,8 @@ class Key(Section):
         '''
         is zone signed with this key
         '''
-        zonedata = dns.zone.from_file(
+        return self.dnskey.key in zone_dnskeys(
             self.zone.signedzone_path, self.zone.name)
-        dnskeys = zonedata.get_rdataset(zonedata.origin, dns.rdatatype.DNSKEY)
-        return len(list(filter(
-            lambda x: x.key == self.public_key_source(), dnskeys))) > 0
 
     def settime(self):
         t = int(time.time())
@@ -252,6 +370,51 @@ class Key(Section):
             datetime.datetime.utcfromtimestamp(t).strftime(DATETIME_FORMAT))
 
 
+class Zone(ZoneMixin, TabbedConf):
+    pass
+
+
+class KeySet(KeySetMixin, TabbedConf):
+    pass
+
+
+class Key(KeyMixin, TabbedConf):
+    pass
+
+
+class CompactZone(ZoneMixin, CompactConf):
+    __slots__ = (
+        '_name', '_zskcur', '_zskpub', '_zsknew', '_kskcur', '_kskpub')
+
+    def __init__(self):
+        super().__init__()
+        self._name = None
+        self._zskcur = None
+        self._zskpub = None
+        self._zsknew = None
+        self._kskcur = None
+        self._kskpub = None
+
+
+class CompactKeySet(KeySetMixin, CompactConf):
+    __slots__ = ('_name', '_zone', '_keys')
+
+    def __init__(self):
+        super().__init__()
+        self._name = None
+        self._zone = None
+        self._keys = tuple()
+
+
+class CompactKey(KeyMixin, CompactConf):
+    __slots__ = ('_name', '_zone')
+
+    def __init__(self):
+        super().__init__()
+        self._name = None
+        self._zone = None
+
+
 class KeyRec(TabbedConf):
     '''
     KRF .krf (key record file) parser
@@ -259,34 +422,44 @@ class KeyRec(TabbedConf):
     def __str__(self):
         return (
             '\n' +
-            '\n'.join('%s' % section for section in self.values()) +
+            '\n'.join(section.text() for section in self.values()) +
             '\n')
 
-    def read(self, path):
+    def read(self, path, compact=False):
+        '''
+        @param path: Keyrec file path.
+        @type path: str
+        @param compact: Store the sections as Compact* classes (less memory).
+        @type compact: bool
+        '''
         self._path = path
-        f = open(path, 'r')
+        self._stamp = file_stamp(path)
         self._directory = os.path.dirname(path)
+        if compact:
+            section_classes = {
+                'zone': CompactZone,
+                'set': CompactKeySet,
+                'key': CompactKey,
+            }
+        else:
+            section_classes = {
+                'zone': Zone,
+                'set': KeySet,
+                'key': Key,
+            }
         section = None
-        for i in f.readlines():
-            if not i.strip().startswith('#'):
-                match = re.match(r'(\S+)\s+"([^"]+)"', i.strip())
-                if match:
-                    key, value = match.group(1), match.group(2)
-                    if key in ('zone', 'set', 'key'):
-                        section_class = {
-                            'zone': Zone,
-                            'set': KeySet,
-                            'key': Key,
-                        }[key]
-                        section = section_class()
-                        section.name = value
-                        section.directory = self._directory
-                        self[value] = section
-                    elif section is not None:
-                        section[key] = value
+        for key, value in tokenize(path):
+            if key in section_classes:
+                section = section_classes[key]()
+                section.name = value
+                section.directory = self._directory
+                self[value] = section
+            elif section is not None:
+                # No change tracking, the file is marked clean below.
+                section._setitem(key, value)
         # link objects together
         for name, section in self.items():
-            if type(section) == KeySet:
+            if isinstance(section, KeySetMixin):
                 # link set with zone
                 if 'zonename' in section:
                     section._zone = self[section['zonename']]
@@ -306,8 +479,8 @@ class KeyRec(TabbedConf):
                     self[section['zonename']]._kskcur = section
                 if section['set_type'] == 'kskpub':
                     self[section['zonename']]._kskpub = section
-            elif type(section) == Key:
+            elif isinstance(section, KeyMixin):
                 # link key with zone
                 if 'zonename' in section:
                     section._zone = self[section['zonename']]
-        f.close()
+        self._dirty = False
@@ -15,35 +15,78 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
 import calendar
+import collections
 import datetime
-import itertools
+import hashlib
+import locale
+import marshal
+import mmap
 import os
 import re
 import shlex
-import subprocess
+import struct
+import sys
 import time
 
 import dns
 import dns.zone
 
 from . import DATETIME_FORMAT
-from .abstract import TabbedConf
+from . import zonefile
+from .. import execute
+from .abstract import (
+    CompactConf, TabbedConf, file_stamp, replace_file, tokenize,
+    tokenize_lines)
 from .keyrec import KeyRec
 
 
-class Roll(TabbedConf):
+# Maximum TTLs of the zone files parsed by this process, shared by all the
+# Roll objects: {abspath: ((inode, mtime_ns, size), maxttl)}
+MAXTTL_CACHE = {}
+
+# Binary copy of a rollrec file, see RollRec.write_snapshot().
+SNAPSHOT_SUFFIX = '.snap'
+SNAPSHOT_MAGIC = b'PYROLLREC'
+SNAPSHOT_VERSION = 1
+
+# Keyrec files parsed by this process: {abspath: KeyRec}.  An entry is used
+# while the file is the one the KeyRec was last read from or written to.
+KEYREC_CACHE = {}
+
+
+def forget_keyrec(path):
+    '''
+    Drop a keyrec file from the cache, e.g. after zonesigner has run on it.
+
+    @param path: Keyrec file path.
+    @type path: str
+    '''
+    KEYREC_CACHE.pop(os.path.abspath(path), None)
+
+
+class RollMixin(object):
+    '''
+    Roll record, see Roll and CompactRoll for the storage.
+    '''
+    __slots__ = ()
+
+    _NUMERIC = frozenset((
+        'kskphase', 'zskphase', 'ksk_rollsecs', 'zsk_rollsecs', 'maxttl',
+        'curerrors', 'maxerrors'))
+
     _name = None
     _is_active = True
-    _keyrec = None
-    _zone = None
-    _keys = None
 
-    name = property(
-        lambda self: self._name,
-        lambda self, name: setattr(self, '_name', name))
-    is_active = property(
-        lambda self: self._is_active,
-        lambda self, is_active: setattr(self, '_is_active', is_active))
+    def _set_name(self, name):
+        self._name = name
+        self.touch()
+
+    def _set_is_active(self, is_active):
+        self._is_active = is_active
+        self.touch()
+
+    name = property(lambda self: self._name, _set_name)
+    is_active = property(lambda self: self._is_active, _set_is_active)
 
     def _format(self, key, value):
         r = super()._format(key, value)
@@ -105,10 +148,18 @@ class Roll(TabbedConf):
             return ' -signonly'
 
     def keyrec(self):
+        '''
+        The zone's keyrec is parsed once and shared until the file is
+        changed or dropped with forget_keyrec().
+        '''
         path = self.keyrec_path
         if os.path.exists(path) and os.path.isfile(path):
-            keyrec = KeyRec()
-            keyrec.read(path)
+            path = os.path.abspath(path)
+            keyrec = KEYREC_CACHE.get(path)
+            if keyrec is None or keyrec._stamp != file_stamp(path):
+                keyrec = KeyRec()
+                keyrec.read(path, compact=isinstance(self, CompactConf))
+                KEYREC_CACHE[path] = keyrec
             return keyrec
 
     def zoneerr(self):
@@ -152,12 +203,21 @@ class Roll(TabbedConf):
             origin=self['zonename'], check_origin=False)
 
     def maxttl(self):
-        rdatasets = reversed(sorted(itertools.chain(
-            *tuple(map(lambda node: node.rdatasets, self.dnszone().values()))),
-            key=lambda node: node.ttl))
-        rdataset = next(iter(rdatasets), None)
-        ttl = rdataset and rdataset.ttl or 0
-        self['maxttl'] = str(ttl)
+        '''
+        The zone's maximum TTL is cached until the zone file is changed,
+        so the zone is not parsed again by every phase calculation.
+        '''
+        path = os.path.abspath(self.zonefile_path)
+        stamp = file_stamp(path)
+        cached = MAXTTL_CACHE.get(path)
+        if cached and cached[0] == stamp:
+            ttl = cached[1]
+        else:
+            ttl = zonefile.maxttl(path, self['zonename'])
+            MAXTTL_CACHE[path] = (stamp, ttl)
+        # Only a change marks the record for writing.
+        if self.get('maxttl') != str(ttl):
+            self['maxttl'] = str(ttl)
         return ttl * 2
 
     def ttlexpire(self):
@@ -186,14 +246,10 @@ class Roll(TabbedConf):
             left = datetime.timedelta()
         return left
 
-    def loadzone(self, rndc, rndcopts):
+    def loadzone(self, rndc, rndcopts, timeout=None):
         ''' Reload the zone '''
         cmd = '%s %s reload %s' % (rndc, rndcopts, self['zonename'])
-        p = subprocess.Popen(
-            shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        rcode = p.wait()
-        out = p.stdout.read().decode('utf8')
-        return rcode
+        return execute.execute(shlex.split(cmd), timeout=timeout).returncode
 
     def dspub(self, provider, api_key):
         keyrec = self.keyrec()
@@ -305,35 +361,257 @@ class Roll(TabbedConf):
             return datetime.timedelta(seconds=int(td.total_seconds()))
 
 
+class Roll(RollMixin, TabbedConf):
+    pass
+
+
+class CompactRoll(RollMixin, CompactConf):
+    __slots__ = ('_name', '_is_active')
+
+    def __init__(self):
+        super().__init__()
+        self._name = None
+        self._is_active = True
+
+
 class RollRec(TabbedConf):
     '''
     RRF .rollrec (roll record file) parser
     '''
     def __str__(self):
-        return '\n'.join('%s' % roll for roll in self.values())
+        return '\n'.join(roll.text() for roll in self.values())
 
-    def read(self, path, directory=None):
+    def read(self, path, directory=None, compact=False):
+        '''
+        @param path: Rollrec file path.
+        @type path: str
+        @param directory: Default directory of the zones' files.
+        @type directory: str
+        @param compact: Store the zones as CompactRoll (less memory).
+        @type compact: bool
+        '''
         self._path = path
         self._directory = directory
-        f = open(path, 'r')
+        self._stamp = file_stamp(path)
+        roll_class = CompactRoll if compact else Roll
         roll = None
-        for i in f.readlines():
-            if not i.strip().startswith('#'):
-                match = re.match(r'(\S+)\s+"([^"]+)"', i.strip())
-                if match:
-                    key, value = match.group(1), match.group(2)
-                    if key in ('roll', 'skip'):
-                        roll = Roll()
-                        roll._parent = self
-                        roll.name = value
-                        roll.is_active = key == 'roll'
-                        self[value] = roll
-                    elif roll is not None:
-                        roll[key] = value
-        f.close()
+        for key, value in tokenize(path):
+            if key in ('roll', 'skip'):
+                roll = roll_class()
+                roll._parent = self
+                roll.name = value
+                roll.is_active = key == 'roll'
+                self[value] = roll
+            elif roll is not None:
+                # No change tracking, the file is marked clean below.
+                roll._setitem(key, value)
+        self._dirty = False
+
+    def write_snapshot(self):
+        '''
+        Save a binary copy of the rollrec next to the rollrec file
+        (see SNAPSHOT_SUFFIX).  The snapshot records the size, mtime and
+        hash of the text file it was made from and is ignored by
+        read_snapshot() once the text file has changed.
+        '''
+        with open(self._path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            digest = hashlib.sha1(f.read()).digest()
+        compact = False
+        rolls = []
+        for roll in self.values():
+            compact = isinstance(roll, CompactConf)
+            rolls.append((roll.name, roll.is_active) + roll._dump())
+        header = marshal.dumps((
+            SNAPSHOT_VERSION, tuple(sys.version_info[:2]), compact,
+            st.st_size, st.st_mtime_ns, digest))
+        replace_file(
+            self._path + SNAPSHOT_SUFFIX,
+            SNAPSHOT_MAGIC + struct.pack('!I', len(header)) + header +
+            marshal.dumps(tuple(rolls)))
+
+    def read_snapshot(self, path, directory=None, compact=False):
+        '''
+        Load the rollrec from its snapshot, if there is an up to date one.
+        Parameters are the same as read().
+
+        @returns: snapshot was loaded
+        @rtype: bool
+        '''
+        try:
+            with open(path + SNAPSHOT_SUFFIX, 'rb') as f:
+                data = f.read()
+            i = len(SNAPSHOT_MAGIC)
+            if data[:i] != SNAPSHOT_MAGIC:
+                return False
+            length, = struct.unpack('!I', data[i:i + 4])
+            i += 4
+            (version, pyversion, snapcompact,
+             size, mtime, digest) = marshal.loads(data[i:i + length])
+            if (version != SNAPSHOT_VERSION or
+                    pyversion != tuple(sys.version_info[:2]) or
+                    snapcompact != compact):
+                return False
+            with open(path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if (st.st_size != size or st.st_mtime_ns != mtime or
+                        hashlib.sha1(f.read()).digest() != digest):
+                    return False
+            rolls = marshal.loads(data[i + length:])
+        except (OSError, EOFError, ValueError, TypeError, struct.error):
+            return False
+
+        self._path = path
+        self._directory = directory
+        self._stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        roll_class = CompactRoll if compact else Roll
+        setitem = collections.OrderedDict.__setitem__
+        for name, is_active, keys, values in rolls:
+            roll = roll_class()
+            roll._parent = self
+            roll._name = name
+            roll._is_active = is_active
+            roll._load(keys, values)
+            setitem(self, name, roll)
+        self._dirty = False
+        return True
 
     def rolls(self, active_only=True):
         if active_only:
             return filter(lambda x: x[1].is_active, self.items())
         else:
             return self.items()
+
+
+class LazyRollRec(RollRec):
+    '''
+    Rollrec which only indexes the records of the file when read and
+    parses a record when it is accessed.  Saving the file copies the
+    records which weren't changed as they are, and formats the others.
+
+    Record headers are recognized by a "roll" or "skip" keyword at the
+    beginning of a line, followed by blanks and a quoted zone name.
+    '''
+    HEADER = re.compile(rb'^[ \t]*(roll|skip)[ \t]+"([^"\n]+)"', re.M)
+
+    _map = b''  # mmap of the file
+    _spans = None  # {name: (start, end)} byte range of the records in _map
+    _prefix = (0, 0)  # byte range of the lines before the first record
+    _roll_class = Roll
+
+    def read(self, path, directory=None, compact=False):
+        self._path = path
+        self._directory = directory
+        self._roll_class = CompactRoll if compact else Roll
+        self._index(path)
+        self._dirty = False
+
+    def _map_file(self, path):
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if st.st_size:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._map = b''
+        self._stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _index(self, path):
+        '''
+        Map the file and find the byte range of each record.
+        '''
+        encoding = locale.getpreferredencoding(False)
+        setitem = collections.OrderedDict.__setitem__
+        self._map_file(path)
+        self._spans = {}
+        self._prefix = (0, len(self._map))
+        name = None
+        for match in self.HEADER.finditer(self._map):
+            if name is None:
+                self._prefix = (0, match.start())
+            else:
+                self._spans[name] = (start, match.start())
+            start = match.start()
+            name = match.group(2).decode(encoding)
+            if name not in self:
+                setitem(self, name, None)
+        if name is not None:
+            self._spans[name] = (start, len(self._map))
+
+    def _load_roll(self, name):
+        '''
+        Parse a record of the file.
+        '''
+        start, end = self._spans[name]
+        lines = self._map[start:end].decode(
+            locale.getpreferredencoding(False)).splitlines()
+        roll = None
+        for key, value in tokenize_lines(lines):
+            if roll is None:
+                roll = self._roll_class()
+                roll._parent = self
+                roll._name = name
+                roll._is_active = key == 'roll'
+            else:
+                # No change tracking, the record is marked clean below.
+                roll._setitem(key, value)
+        roll._dirty = False
+        collections.OrderedDict.__setitem__(self, name, roll)
+        return roll
+
+    def __getitem__(self, name):
+        roll = super().__getitem__(name)
+        if roll is None:
+            roll = self._load_roll(name)
+        return roll
+
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self._spans.pop(name, None)
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+        return default
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+    def _contents(self):
+        '''
+        @returns: the file's contents and the byte range of each record
+        @rtype: tuple
+        '''
+        encoding = locale.getpreferredencoding(False)
+        parts = [self._map[slice(*self._prefix)]]
+        spans = {}
+        offset = len(parts[0])
+        for name, roll in collections.OrderedDict.items(self):
+            span = self._spans.get(name)
+            if span and (roll is None or not roll._dirty):
+                data = self._map[span[0]:span[1]]
+            else:
+                data = (roll.text() + '\n').encode(encoding)
+            spans[name] = (offset, offset + len(data))
+            offset += len(data)
+            parts.append(data)
+        return b''.join(parts), spans
+
+    def __str__(self):
+        return self._contents()[0].decode(locale.getpreferredencoding(False))
+
+    def write(self, path):
+        data, spans = self._contents()
+        replace_file(path, data)
+        if os.path.realpath(path) == os.path.realpath(self._path):
+            # Unchanged records are now found in the new file.
+            prefix = self._prefix[1] - self._prefix[0]
+            self._map_file(path)
+            self._spans = spans
+            self._prefix = (0, prefix)
+            for roll in collections.OrderedDict.values(self):
+                if roll is not None:
+                    roll._dirty = False
+        self._dirty = False
@@ -0,0 +1,215 @@
+# Copyright (C) 2015 Okami, okami@fuzetsu.info
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import re
+
+import dns
+import dns.zone
+
+from .abstract import BLOCKSIZE
+
+CLASSES = ('IN', 'CH', 'CHAOS', 'HS', 'HESIOD', 'NONE', 'ANY')
+
+# Tokens of a line which can't be split with str.split():
+# parentheses, comments, quoted strings and escaped characters.
+TOKEN = re.compile(r'''
+    (?P<paren>[()])
+  | (?P<comment>;.*)
+  | (?P<token>(?:"(?:[^"\\]|\\.)*"?|\\.|[^\s"();\\])+)
+''', re.X)
+
+TTL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+TTL_PART = re.compile(r'(\d+)([smhdw])', re.I)
+
+
+class UnsupportedSyntax(Exception):
+    pass
+
+
+def ttl_from_text(text):
+    '''
+    Convert a TTL ("3600" or BIND-style "1h30m") to seconds.
+    '''
+    if text.isdigit():
+        return int(text)
+    parts = TTL_PART.findall(text)
+    if not parts or ''.join(n + u for n, u in parts) != text:
+        raise UnsupportedSyntax('bad TTL "%s"' % text)
+    return sum(int(n) * TTL_UNITS[u.lower()] for n, u in parts)
+
+
+class TTLScanner(object):
+    '''
+    Single pass master file scanner, which finds the maximum TTL of the
+    records without building the zone.  Only one record is held in memory
+    at a time.
+
+    The TTL of a record without explicit TTL is the $TTL value or the TTL
+    of the previous record (RFC 1035).  Unlike dnspython, the TTLs of an
+    RRset are not clamped to the lowest one; they must be equal anyway
+    (RFC 2181).
+    '''
+    def __init__(self):
+        self.maxttl = 0
+        self.records = 0
+        self.default_ttl = None  # $TTL
+        self.last_ttl = None  # TTL of the previous record
+        self.origin = None
+        self._pending = []  # tokens of a record continued in parentheses
+        self._pending_owner = False
+        self._depth = 0
+
+    def scan(self, path):
+        '''
+        @param path: Zone file path.
+        @type path: str
+
+        @returns: maximum TTL
+        @rtype: int
+        '''
+        with open(path, 'r', buffering=BLOCKSIZE, encoding='latin-1') as f:
+            for line in f:
+                if '"' in line or '\\' in line:
+                    self._line(line)
+                    continue
+                i = line.find(';')
+                if i >= 0:
+                    line = line[:i]
+                if self._depth or '(' in line or ')' in line:
+                    self._parens(line)
+                    continue
+                # Fast path: a plain single-line entry.
+                tokens = line.split()
+                if tokens:
+                    self._entry(tokens, not line[0].isspace())
+        if self._depth:
+            raise UnsupportedSyntax('unbalanced parentheses in "%s"' % path)
+        return self.maxttl
+
+    def _parens(self, line):
+        '''
+        Line of a multi-line record, without quotes and comments.
+        '''
+        if not self._depth and not self._pending:
+            self._pending_owner = bool(line) and not line[0].isspace()
+        self._depth += line.count('(') - line.count(')')
+        if self._depth < 0:
+            raise UnsupportedSyntax('unbalanced parentheses')
+        # Rdata is of no interest, the type is the 4th token at most.
+        if len(self._pending) < 4:
+            self._pending.extend(
+                line.replace('(', ' ').replace(')', ' ').split())
+        if not self._depth and self._pending:
+            tokens, self._pending = self._pending, []
+            self._entry(tokens, self._pending_owner)
+
+    def _line(self, line):
+        '''
+        Line with quoted strings or escaped characters.
+        '''
+        if not self._depth and not self._pending:
+            self._pending_owner = bool(line) and not line[0].isspace()
+        for match in TOKEN.finditer(line):
+            paren, comment, token = match.groups()
+            if paren == '(':
+                self._depth += 1
+            elif paren == ')':
+                self._depth -= 1
+                if self._depth < 0:
+                    raise UnsupportedSyntax('unbalanced parentheses')
+            elif comment:
+                break
+            else:
+                self._pending.append(token)
+        if not self._depth and self._pending:
+            tokens, self._pending = self._pending, []
+            self._entry(tokens, self._pending_owner)
+
+    def _entry(self, tokens, owner):
+        if owner and tokens[0].startswith('$'):
+            self._directive(tokens)
+            return
+
+        # [<owner>] [<TTL>] [<class>] <type> <rdata>
+        # [<owner>] [<class>] [<TTL>] <type> <rdata>
+        fields = tokens[1:] if owner else tokens
+        ttl = None
+        i = 0
+        while i < len(fields) and i < 2:
+            field = fields[i]
+            if field[0].isdigit():
+                if ttl is not None:
+                    raise UnsupportedSyntax('two TTLs in a record')
+                ttl = ttl_from_text(field)
+            elif not (field.upper() in CLASSES or
+                      field.upper().startswith('CLASS')):
+                break
+            i += 1
+        if i >= len(fields):
+            raise UnsupportedSyntax('record type is missing')
+
+        if ttl is None:
+            if self.default_ttl is not None:
+                ttl = self.default_ttl
+            elif self.last_ttl is not None:
+                ttl = self.last_ttl
+            else:
+                raise UnsupportedSyntax('record without TTL')
+        else:
+            self.last_ttl = ttl
+
+        self.records += 1
+        if ttl > self.maxttl:
+            self.maxttl = ttl
+
+    def _directive(self, tokens):
+        directive = tokens[0].upper()
+        if directive == '$TTL' and len(tokens) > 1:
+            self.default_ttl = ttl_from_text(tokens[1])
+        elif directive == '$ORIGIN' and len(tokens) > 1:
+            self.origin = tokens[1]
+        elif directive == '$INCLUDE' and len(tokens) > 1:
+            origin = self.origin
+            if len(tokens) > 2:
+                self.origin = tokens[2]
+            # Relative to the working directory, as in BIND and dnspython.
+            self.scan(tokens[1].strip('"'))
+            self.origin = origin
+        else:
+            raise UnsupportedSyntax('unsupported directive "%s"' % tokens[0])
+
+
+def maxttl(path, origin=None):
+    '''
+    Find the maximum TTL of the records in a zone file.
+    The file is handed to dnspython if the scanner can't parse it.
+
+    @param path: Zone file path.
+    @type path: str
+    @param origin: Zone origin (used by dnspython only).
+    @type origin: str
+
+    @returns: maximum TTL
+    @rtype: int
+    '''
+    try:
+        return TTLScanner().scan(path)
+    except UnsupportedSyntax:
+        zone = dns.zone.from_file(path, origin=origin, check_origin=False)
+        return max((
+            rdataset.ttl
+            for node in zone.values()
+            for rdataset in node.rdatasets), default=0)
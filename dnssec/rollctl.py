@@ -18,6 +18,7 @@ import re
 import signal
 import sys
 
+from . import defs
 from .common import *
 from .defs import *
 from .rolllog import *
@@ -65,6 +66,7 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
         'zonelog': False,  # Set a zone's/zones' logging level.
         'zonestatus': False,  # Get status of zones.
         'zsargs': False,  # Set zonesigner args for some zones.
+        'stdin': False,  # Read commands from stdin.
         'group': False,  # Apply command to zone group.
         'Version': False,  # Display the version number.
         'quiet': False,  # Don't print anything.
@@ -106,6 +108,7 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
     zonestatflag = False
     zrollallflag = False
     zsargsflag = False
+    stdinflag = False
     pidfile = ''
     sockfile = ''  # socket file
     quiet = False
@@ -135,6 +138,8 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
 \t-rollzone <zone>\trestart named suspended zone
 \t-rollrec <rollrec>\tset rollrec file
 \t-runqueue\t\trun queue
+\t-queuelist\t\tlist the queued zone events
+\t-queuestatus\t\tget the event queue's status and recent passes
 \t-shutdown [now]\t\tshutdown rollerd
 \t-signzone <zone>\tsign named zone (no key rollover)
 \t-signzones [all|active]\tsign zones (no key rollover)
@@ -145,8 +150,10 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
 \t-status\t\t\tget rollerd's status
 \t-zonegroup [zonegroup]\tshow zone groups
 \t-zonelog\t\tset a zone's log level
-\t-zonestatus\t\tget status of zones
+\t-zonestatus [filters]\tget status of zones (phase=, type=, zone=,
+\t\t\t\toffset=, limit=)
 \t-zsargs <args> <zone>\tset zonesigner arguments for zones
+\t-stdin\t\t\trun the commands read from stdin, one per line
 \t-Version\t\tdisplay version number
 \t-quiet\t\t\tdon't give any output
 \t-help\t\t\thelp message''')
@@ -189,7 +196,9 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
             self.usage()
 
         # Parse the options.
-        self.opts = self.get_options(self.opts, sys.argv[1:]) or self.usage()
+        self.opts = (
+            self.get_options(self.opts, sys.argv[1:], positional=True) or
+            self.usage())
 
         # Give a usage flag if asked.
         if self.opts['help']:
@@ -203,7 +212,7 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
             self.dispflag = self.opts['display']
             self.commandcount += 1
         if self.opts['dspub']:
-            self.dspubflag = opts['dspub']
+            self.dspubflag = self.opts['dspub']
             self.commandcount += 1
         if self.opts['dspuball']:
             self.dspuballflag = self.opts['dspuball']
@@ -298,6 +307,9 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
         if self.opts['zsargs']:
             self.zsargsflag = self.opts['zsargs']
             self.commandcount += 1
+        if self.opts['stdin']:
+            self.stdinflag = self.opts['stdin']
+            self.commandcount += 1
         if self.opts['Version']:
             self.version = self.opts['Version']
             self.commandcount += 1
@@ -344,6 +356,49 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
 
         return self.rollmgr_sendcmd(CHANNEL_WAIT, cmd, arg)
 
+    def sendcmds(self, cmd, args):
+        '''
+        Send a command for each argument and get the responses, through
+        a single connection if rollerd allows it.
+        cmd - Command to send rollerd.
+        args - Arguments of the commands.
+
+        @returns: iterator of (argument, retcode, response)
+        @rtype: iterator
+        '''
+        if self.groupflag:
+            cmd = ROLLMGR_GROUP + cmd
+
+        for cmd, arg, ret, resp in self.rollmgr_pipeline(
+                (cmd, arg) for arg in args):
+            yield arg, ret, resp
+
+    def stdincmds(self):
+        '''
+        Read the commands to send from stdin, one per line: a rollctl
+        command without its leading dash, then its argument, e.g.
+        "rollzsk example.com".  Empty lines and comments are ignored.
+
+        @returns: iterator of (command, argument)
+        @rtype: iterator
+        '''
+        commands = {
+            value for name, value in vars(defs).items()
+            if name.startswith('ROLLCMD_') and isinstance(value, str)}
+        for line in sys.stdin:
+            words = line.split(None, 1)
+            if not words or words[0].startswith('#'):
+                continue
+            cmd = 'rollcmd_' + words[0].lstrip('-')
+            if cmd not in commands or cmd == ROLLCMD_SESSION:
+                print(
+                    'pyrollctl:  unknown command "%s"' % words[0],
+                    file=sys.stderr)
+                continue
+            if self.groupflag:
+                cmd = ROLLMGR_GROUP + cmd
+            yield cmd, words[1].strip() if len(words) > 1 else ''
+
     def main(self, args):
         rcret = 0  # Return code for rollctl.
 
@@ -372,13 +427,7 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
             if not args[2:]:
                 print('pyrollctl: -dspub missing zone argument', file=sys.stderr)
                 sys.exit(1)
-            for zone in args[2:]:
-                if not self.sendcmd(ROLLCMD_DSPUB, zone):
-                    print(
-                        'pyrollctl:  error sending command DSPUB(%s)' % zone,
-                        file=sys.stderr)
-                    sys.exit(1)
-                ret, resp = self.rollmgr_getresp()
+            for zone, ret, resp in self.sendcmds(ROLLCMD_DSPUB, args[2:]):
                 if ret == ROLLCMD_RC_OKAY:
                     print(
                         'rollerd informed that parent has published DS '
@@ -534,13 +583,7 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
             if not args[2:]:
                 print('pyrollctl: -rollksk missing zone argument', file=sys.stderr)
                 sys.exit(2)
-            for zone in args[2:]:
-                if not self.sendcmd(ROLLCMD_ROLLKSK, zone):
-                    print(
-                        'pyrollctl:  error sending command ROLLKSK(%s)' % zone,
-                        file=sys.stderr)
-                    sys.exit(1)
-                ret, resp = self.rollmgr_getresp()
+            for zone, ret, resp in self.sendcmds(ROLLCMD_ROLLKSK, args[2:]):
                 if ret == ROLLCMD_RC_OKAY:
                     print(resp)
                 else:
@@ -554,13 +597,7 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
                     'pyrollctl: -rollzone missing zone argument',
                     file=sys.stderr)
                 sys.exit(2)
-            for zone in args[2:]:
-                if not self.sendcmd(ROLLCMD_ROLLZONE, zone):
-                    print(
-                        'pyrollctl:  error sending command ROLLZONE(%s)' % zone,
-                        file=sys.stderr)
-                    sys.exit(1)
-                ret, resp = self.rollmgr_getresp()
+            for zone, ret, resp in self.sendcmds(ROLLCMD_ROLLZONE, args[2:]):
                 if ret == ROLLCMD_RC_OKAY:
                     print('rollover restarted for zone %s' % zone)
                 else:
@@ -572,13 +609,7 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
             if not args[2:]:
                 print('pyrollctl: -rollzsk missing zone argument', file=sys.stderr)
                 sys.exit(2)
-            for zone in args[2:]:
-                if not self.sendcmd(ROLLCMD_ROLLZSK, zone):
-                    print(
-                        'pyrollctl:  error sending command ROLLZSK(%s)' % zone,
-                        file=sys.stderr)
-                    sys.exit(1)
-                ret, resp = self.rollmgr_getresp()
+            for zone, ret, resp in self.sendcmds(ROLLCMD_ROLLZSK, args[2:]):
                 if ret == ROLLCMD_RC_OKAY:
                     print(resp)
                 else:
@@ -629,13 +660,7 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
                     'pyrollctl: -signzone missing zone argument',
                     file=sys.stderr)
                 sys.exit(2)
-            for zone in args[2:]:
-                if not self.sendcmd(ROLLCMD_SIGNZONE, zone):
-                    print(
-                        'pyrollctl:  error sending command SIGNZONE(%s)' % zone,
-                        file=sys.stderr)
-                    sys.exit(1)
-                ret, resp = self.rollmgr_getresp()
+            for zone, ret, resp in self.sendcmds(ROLLCMD_SIGNZONE, args[2:]):
                 if ret == ROLLCMD_RC_OKAY:
                     print('zone %s signed' % zone)
                 else:
@@ -678,17 +703,13 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
                     'pyrollctl: -skipzone missing zone argument',
                     file=sys.stderr)
                 sys.exit(2)
-            for zone in args[2:]:
-                if not self.sendcmd(ROLLCMD_SKIPZONE, zone):
-                    print(
-                        'pyrollctl:  error sending command SKIPZONE(%s)' % zone,
-                        file=sys.stderr)
-                    sys.exit(1)
-                ret, resp = self.rollmgr_getresp()
+            for zone, ret, resp in self.sendcmds(ROLLCMD_SKIPZONE, args[2:]):
                 if ret == ROLLCMD_RC_OKAY:
                     print('rollover stopped for zone %s' % zone)
                 else:
-                    print('unable to stop rollover for zone $zone:  "%s"' % resp)
+                    print(
+                        'unable to stop rollover for zone %s:  "%s"' %
+                        (zone, resp))
                     rcret += 1
         elif self.sleeptimeflag:
             if not self.sendcmd(ROLLCMD_SLEEPTIME, self.sleeptimeflag):
@@ -770,33 +791,30 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
                     'pyrollctl: -zonelog missing zone:loglevel argument',
                     file=sys.stderr)
                 sys.exit(2)
+            zones = []
             for zone in args[2:]:
                 if not re.match(r'.+\:.+', zone):
                     print(
                         'pyrollctl:  improperly formed zone:loglevel pair',
                         file=sys.stderr)
                     continue
-                if not self.sendcmd(ROLLCMD_ZONELOG, zone):
-                    print(
-                        'pyrollctl:  error sending command ZONELOG(%s)' % zone,
-                        file=sys.stderr)
-                    sys.exit(1)
-                ret, resp = self.rollmgr_getresp()
+                zones.append(zone)
+            for zone, ret, resp in self.sendcmds(ROLLCMD_ZONELOG, zones):
                 if ret == ROLLCMD_RC_OKAY:
                     print('rollerd logging changed for %s' % zone)
                 else:
                     print('zonelog failed:  %s' % resp)
                     rcret += 1
         elif self.zonestatflag:
-            if not self.sendcmd(ROLLCMD_ZONESTATUS):
+            # Filters may follow, e.g. "phase=ksk zone=*.example limit=100".
+            if not self.sendcmd(
+                    ROLLCMD_ZONESTATUS, ' '.join(['stream'] + args[2:])):
                 print(
                     'pyrollctl:  error sending command ZONESTATUS',
                     file=sys.stderr)
                 sys.exit(1)
-            ret, resp = self.rollmgr_getresp()
-            if ret == ROLLCMD_RC_OKAY:
-                self.zonestatus(resp)
-            else:
+            ret, resp = self.zonestatus(self.rollmgr_getstream())
+            if ret != ROLLCMD_RC_OKAY:
                 print('zonestatus failed:  "%s"' % resp)
                 rcret += 1
         elif self.zsargsflag:
@@ -816,12 +834,31 @@ class RollCtl(RollMgrMixin, RollLogMixin, CommonMixin):
                 else:
                     print('zsarg failed:  "%s"' % resp)
                     rcret += 1
+        elif self.stdinflag:
+            for cmd, data, ret, resp in self.rollmgr_pipeline(self.stdincmds()):
+                if ret == ROLLCMD_RC_OKAY:
+                    if resp:
+                        print(resp)
+                else:
+                    print('%s %s failed:  "%s"' % (cmd, data, resp))
+                    rcret += 1
         return rcret
 
-    def zonestatus(self, resp):
+    def zonestatus(self, resps):
         '''
-        @param resp: Full response from rollerd.
-        @type: str
+        Print the zones' status as it comes.  Older rollerds send it
+        in a single response.
+
+        @param resps: Responses from rollerd.
+        @type resps: iterator
+
+        @returns: final retcode and response
+        @rtype: tuple
         '''
         # pretty-print is not implemented, falling back to plain print
-        print(resp)
+        for ret, resp in resps:
+            if ret == ROLLCMD_RC_CHUNK:
+                sys.stdout.write(resp)
+            elif ret == ROLLCMD_RC_OKAY and resp:
+                print(resp)
+        return ret, resp
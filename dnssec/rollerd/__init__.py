@@ -14,39 +14,58 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+import concurrent.futures
 import datetime
 import os
 import pwd
 import re
 import shlex
-import subprocess
 import sys
+import threading
+import time
 
-from .. import defs
+from .. import defs, execute
 from ..common import CommonMixin
 # from ..defs import *
-from ..parsers.keyrec import KeySet
+from ..parsers.keyrec import KeyRec, KeySetMixin
+from ..parsers.rollrec import KEYREC_CACHE, forget_keyrec
 from ..rolllog import LOG, RollLogMixin
 from ..rollmgr import RollMgrMixin
 from ..rollrec import RollRecMixin
 from .conf import ConfMixin
 from .cmd import CmdMixin
+from .coalesce import CoalesceMixin
+from .control import ControlMixin
 from .daemon import DaemonMixin
+from .eventloop import EventLoopMixin
 from .ksk import KSKMixin
 from .message import MessageMixin
+from .queue import QueueMixin
+from .reload import ReloadMixin
+from .shard import ShardMixin
+from .stats import StatsMixin
+from .status import StatusMixin
 from .zsk import ZSKMixin
 
 
 class RollerD(
         ConfMixin,
         CmdMixin,
+        CoalesceMixin,
         CommonMixin,
+        ControlMixin,
         DaemonMixin,
+        EventLoopMixin,
         KSKMixin,
         MessageMixin,
+        QueueMixin,
+        ReloadMixin,
         RollLogMixin,
         RollMgrMixin,
         RollRecMixin,
+        ShardMixin,
+        StatsMixin,
+        StatusMixin,
         ZSKMixin):
 
     NAME = 'pyrollerd'
@@ -133,25 +152,29 @@ class RollerD(
     # queue.  Every N seconds, the entire queue of zones is scanned to see if any
     # rollover events must be handled.
 
-    # "soon" queue processing is experimental.  It maintains a sub-queue of the
-    # rollover events that must be handled soon.  Rather than processing the full
-    # queue of managed zones every N seconds, the "soon queue" is handled as the
-    # events occur.
+    # "soon" queue processing maintains a sub-queue of the rollover events that
+    # must be handled soon.  Rather than processing the full queue of managed
+    # zones every N seconds, the "soon queue" is handled as the events occur.
 
-    # "soon" processing is still being tested and should *not* be considered
-    # reliable!  (yet...)
+    # "event loop" processing handles the soon queue, the commands run for
+    # the zones and the control socket in a single asyncio loop.  Read-only
+    # commands are served while zones are being signed.
+
+    # The event handler is selected with roll_eventmaster in the config file,
+    # "full" (the default), "soon" or "loop".
     eventmaster = defs.EVT_FULLLIST
     event_methods = (
         'dummy',
         'Full List',
         'Soon Queue',
+        'Event Loop',
     )
 
-    queue_eventtimes = []
+    queue_eventtimes = {}  # Queued event time of the soon zones.
     queue_maxttls = []
     queue_signtimes = []
     queue_allzones = []
-    queue_sooners = []
+    queue_sooners = []  # Heap of (event time, zone) of the soon zones.
 
     queue_firstsoon = 0  # Index of first unprocessed soon entry.
     queue_lastscan = 0  # GMT of last full scan.
@@ -164,6 +187,14 @@ class RollerD(
 
     wassigned = False  # Flag indicating zone was signed.
 
+    signers = 1  # Number of zones handled concurrently.
+    signlock = None  # Lock held by the zone being handled, while signing.
+
+    signer_name = 'zonesigner'  # Default zone signer.
+
+    cmd_timeout = 3600  # Seconds an external command may run.
+    rndc_timeout = 60  # Seconds an rndc command may run.
+
     ret = 0  # Return code from main().
     runerr = 0  # Execution error -- used in runner().
 
@@ -242,6 +273,10 @@ class RollerD(
                 errs[ch_ret])
             sys.exit(3)
 
+        # The event loop serves the connections itself.
+        if self.control_clients and self.eventmaster != defs.EVT_EVENTLOOP:
+            self.control_start()
+
         # Main event loop.  If the rollrec file is okay, we'll read it,
         # check its zones -- rolling 'em if need be -- and saving its state.
         # We'll always check for user commands and then sleep a bit.
@@ -251,6 +286,9 @@ class RollerD(
         elif self.eventmaster == defs.EVT_QUEUE_SOON:
             self.rolllog_log(LOG.ALWAYS, '', ' ')
             self.queue_soon_event_loop()
+        elif self.eventmaster == defs.EVT_EVENTLOOP:
+            self.rolllog_log(LOG.ALWAYS, '', ' ')
+            self.event_loop()
         else:
             self.rolllog_log(
                 LOG.FATAL, '',
@@ -301,6 +339,9 @@ class RollerD(
             keyrec[rname]['rollmgr'] = 'pyrollerd'
             keyrec.save()
 
+        # Load the zones' status for the read-only commands.
+        self.status_load()
+
         # Save the current rollrec file state.
         self.rollrec_close()
         self.rollrec_unlock()
@@ -334,12 +375,16 @@ class RollerD(
             if self.rrfchk():
                 # Get the contents of the rollrec file and check
                 # for expired KSKs and ZSKs.
-                self.rollrec_lock()
-                if self.rollrec_read():
+                self.stats_begin()
+                self.stats_rollrec_lock()
+                if self.stats_rollrec_read():
+                    self.status_load()
                     # Check the zones for expired ZSKs.  We'll also
                     # keep track of how long it takes to check the
                     # ZSKs.
                     kronos1 = datetime.datetime.utcnow()
+                    self.queue_lastscan = time.time()
+                    skipped = self.stats_pass['skipped']
                     self.rollkeys()
                     kronos2 = datetime.datetime.utcnow()
                     kronodiff = kronos2 - kronos1
@@ -347,12 +392,17 @@ class RollerD(
                         LOG.TMI, '<timer>',
                         'keys checked in %s' % kronodiff)
 
+                    # Each pass is a full scan.
+                    self.queue_scantime = time.time() - self.queue_lastscan
+                    self.queue_scanskips = self.stats_pass['skipped'] - skipped
+
                     # Save the current rollrec file state.
                     self.rollrec_close()
                 self.rollrec_unlock()
+                self.stats_end()
 
             # Check for user commands.
-            self.commander()
+            self.commander(0)
 
             # We'll stop now if we're only running the queue once.
             if self.singlerun:
@@ -372,136 +422,227 @@ class RollerD(
         Go through the zones in the rollrec file and start rolling
         the ZSKs and KSKs for those which have expired.
         '''
+        # Keyrecs are parsed at most once per pass.
+        KEYREC_CACHE.clear()
+
         # Check the zones in the rollrec file to see if they're ready
         # to roll.
-        for rname in self.rollrec_names():
-            # Close down if we've received an INT signal.
+        self.rollzones(self.rollrec_names())
+
+        # Ensure the logging level is set correctly.
+        self.loglevel = self.loglevel_save
+        self.loglevel = self.rolllog_level(self.loglevel, False)
+
+    def rollzones(self, rnames):
+        '''
+        Handle a list of zones, up to $signers of them at a time.
+
+        The zones are handled by a pool of threads which hold a common
+        lock, so the rollrec and keyrec records are changed by a single
+        zone at a time.  The lock is only released by runner() while
+        a zonesigner is running.  Each zone is handled by a single
+        thread, so its rollover steps are still run in order.
+
+        @param rnames: Names of rollrec recs.
+        @type rnames: list
+        '''
+        self.stats_add('scanned', len(rnames))
+        if self.shards > 1 and self.shard is None and not self.LOOP:
+            self.rollzones_sharded(rnames)
             if self.queued_int:
                 self.rolllog_log(
-                    LOG.INFO, rname,
-                    'received immediate shutdown command')
+                    LOG.INFO, '', 'received immediate shutdown command')
                 self.halt_handler()
+            return
 
-            # Return to our execution directory.
-            self.rolllog_log(
-                LOG.TMI, rname,
-                'execution directory:  chdir(%s)' % self.xqtdir)
+        if self.signers <= 1:
+            for rname in rnames:
+                # Close down if we've received an INT signal.
+                if self.queued_int:
+                    self.rolllog_log(
+                        LOG.INFO, rname,
+                        'received immediate shutdown command')
+                    self.halt_handler()
+                self.coalesce_rollzone(rname)
+                self.status_zone(rname)
+                self.shard_report(rname)
+                self.reload_check()
+            self.coalesce_report()
+            self.reload_flush()
+            return
+
+        # The event loop's lock is held by our caller.
+        owned = self.signlock is not None
+        if owned:
+            self.signlock.release()
+        else:
+            self.signlock = threading.Lock()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.signers) as pool:
+                jobs = [
+                    pool.submit(self.rollzone_locked, rname)
+                    for rname in rnames]
+                for job in jobs:
+                    job.result()
+        finally:
+            if owned:
+                self.signlock.acquire()
+            else:
+                self.signlock = None
             os.chdir(self.xqtdir)
+        self.coalesce_report()
+        self.reload_flush()
 
-            # Ensure the logging level is set correctly.
-            self.loglevel = self.loglevel_save
+        # Close down if we've received an INT signal.
+        if self.queued_int:
+            self.rolllog_log(
+                LOG.INFO, '', 'received immediate shutdown command')
+            self.halt_handler()
 
-            # Get the rollrec for this name.  If it doesn't have one,
-            # whinge and continue to the next.
-            # (This should never happen, but...)
-            rrr = self.rollrec_fullrec(rname)
+    def rollzone_locked(self, rname):
+        '''
+        Handle a zone in a rollzones() thread.
 
-            # Set the logging level to the rollrec entry's level (if it
-            # has one) for the duration of processing this zone.
-            self.loglevel_save = self.loglevel
-            if 'loglevel' in rrr:
-                llev = self.rolllog_num(rrr['loglevel'])
-                if llev != -1:
-                    self.loglevel = rrr['loglevel']
-                    self.loglevel = self.rolllog_level(self.loglevel, False)
-                else:
-                    self.rolllog_log(
-                        LOG.ERR, rname,
-                        'invalid rollrec logging level "%s"' % rrr['loglevel'])
+        @param rname: Name of rollrec rec.
+        @type rname: str
+        '''
+        with self.signlock:
+            # The remaining zones are skipped on an INT signal.
+            if not self.queued_int:
+                self.coalesce_rollzone(rname)
+                self.status_zone(rname)
+                self.shard_report(rname)
+                self.reload_check()
+
+    def rollzone(self, rname):
+        '''
+        Check a single zone and start or continue rolling its ZSK or KSK
+        if it has expired.
 
-            # Don't do anything with skip records.
-            if not rrr.is_active:
-                self.rolllog_log(LOG.TMI, rname, 'is a skip rollrec')
-                continue
+        @param rname: Name of rollrec rec.
+        @type rname: str
+        '''
+        # Return to our execution directory.
+        self.rolllog_log(
+            LOG.TMI, rname,
+            'execution directory:  chdir(%s)' % self.xqtdir)
+        os.chdir(self.xqtdir)
 
-            # If this rollrec has a directory record, we'll move into that
-            # directory for execution; if it doesn't we'll stay put.
-            # If the chdir() fails, we'll skip this rollrec.
-            if 'directory' in rrr:
-                if (os.path.exists(rrr['directory']) and
-                        os.path.isdir(rrr['directory'])):
-                    os.chdir(rrr['directory'])
-                else:
-                    continue
-
-            # If the zone's keyrec file doesn't exist, we'll try to
-            # create it with a simple zonesigner call.
-            if not rrr.keyrec():
+        # Ensure the logging level is set correctly.
+        self.loglevel = self.loglevel_save
+
+        # Get the rollrec for this name.  If it doesn't have one,
+        # whinge and continue to the next.
+        # (This should never happen, but...)
+        rrr = self.rollrec_fullrec(rname)
+
+        # Set the logging level to the rollrec entry's level (if it
+        # has one) for the duration of processing this zone.
+        self.loglevel_save = self.loglevel
+        if 'loglevel' in rrr:
+            llev = self.rolllog_num(rrr['loglevel'])
+            if llev != -1:
+                self.loglevel = rrr['loglevel']
+                self.loglevel = self.rolllog_level(self.loglevel, False)
+            else:
                 self.rolllog_log(
                     LOG.ERR, rname,
-                    'keyrec "%s" does not exist; running initial zonesigner' %
-                    rrr.keyrec_path)
-                self.signer(rname, 'initial')
-                if self.auto and self.provider and self.provider_key:
+                    'invalid rollrec logging level "%s"' % rrr['loglevel'])
+
+        # Don't do anything with skip records.
+        if not rrr.is_active:
+            self.rolllog_log(LOG.TMI, rname, 'is a skip rollrec')
+            self.stats_add('skipped')
+            return
+
+        # If this rollrec has a directory record, we'll move into that
+        # directory for execution; if it doesn't we'll stay put.
+        # If the chdir() fails, we'll skip this rollrec.
+        if 'directory' in rrr:
+            if (os.path.exists(rrr['directory']) and
+                    os.path.isdir(rrr['directory'])):
+                os.chdir(rrr['directory'])
+            else:
+                return
+
+        # If the zone's keyrec file doesn't exist, we'll try to
+        # create it with a simple zonesigner call.
+        if not rrr.keyrec():
+            self.rolllog_log(
+                LOG.ERR, rname,
+                'keyrec "%s" does not exist; running initial zonesigner' %
+                rrr.keyrec_path)
+            self.signer(rname, 'initial')
+            if self.auto and self.provider and self.provider_key:
+                self.rolllog_log(
+                    LOG.INFO, rname,
+                    'transfering new keyset to the parent')
+                ret = rrr.dspub(self.provider, self.provider_key)
+                if not ret:
                     self.rolllog_log(
-                        LOG.INFO, rname,
-                        'transfering new keyset to the parent')
-                    ret = rrr.dspub(self.provider, self.provider_key)
-                    if not ret:
-                        self.rolllog_log(
-                            LOG.ERR, rname,
-                            'automatic keyset transfer failed')
-
-            # Ensure the record has the KSK and ZSK phase fields.
-            if 'kskphase' not in rrr:
-                self.rolllog_log(LOG.TMI, rname, 'new kskphase entry')
-                self.nextphase(rname, rrr, 0, 'ksk')
-            if 'zskphase' not in rrr:
-                self.rolllog_log(LOG.TMI, rname, 'new zskphase entry')
-                self.nextphase(rname, rrr, 0, 'zsk')
-
-            # Turn off the flag indicating that the zone was signed.
-            self.wassigned = False
-
-            # If this zone's current KSK has expired, we'll get it rolling.
-            if self.ksk_expired(rname, rrr, 'kskcur'):
+                        LOG.ERR, rname,
+                        'automatic keyset transfer failed')
+
+        # Ensure the record has the KSK and ZSK phase fields.
+        if 'kskphase' not in rrr:
+            self.rolllog_log(LOG.TMI, rname, 'new kskphase entry')
+            self.nextphase(rname, rrr, 0, 'ksk')
+        if 'zskphase' not in rrr:
+            self.rolllog_log(LOG.TMI, rname, 'new zskphase entry')
+            self.nextphase(rname, rrr, 0, 'zsk')
+
+        # Turn off the flag indicating that the zone was signed.
+        self.wassigned = False
+
+        # If this zone's current KSK has expired, we'll get it rolling.
+        if self.ksk_expired(rname, rrr, 'kskcur'):
+            if rrr.zskphase == 0:
+                self.rolllog_log(
+                    LOG.TMI, rname, 'current KSK has expired')
+            self.ksk_phaser(rname, rrr)
+        else:
+            self.rolllog_log(
+                LOG.TMI, rname, 'current KSK still valid')
+
+            # If this zone's current ZSK has expired, we'll get it rolling.
+            if self.zsk_expired(rname, rrr, 'zskcur'):
                 if rrr.zskphase == 0:
                     self.rolllog_log(
-                        LOG.TMI, rname, 'current KSK has expired')
-                self.ksk_phaser(rname, rrr)
+                        LOG.INFO, rname, 'current ZSK has expired')
+                self.zsk_phaser(rname, rrr)
             else:
                 self.rolllog_log(
-                    LOG.TMI, rname, 'current KSK still valid')
-
-                # If this zone's current ZSK has expired, we'll get it rolling.
-                if self.zsk_expired(rname, rrr, 'zskcur'):
-                    if rrr.zskphase == 0:
-                        self.rolllog_log(
-                            LOG.INFO, rname, 'current ZSK has expired')
-                    self.zsk_phaser(rname, rrr)
-                else:
-                    self.rolllog_log(
-                        LOG.TMI, rname, 'current ZSK still valid')
+                    LOG.TMI, rname, 'current ZSK still valid')
 
-            # If -alwayssign was specified, always sign the zone
-            # even if we didn't need to for this period.
-            if self.alwayssign and not self.wassigned:
-                extraargs = ''  # Phase-dependent argument.
+        # If -alwayssign was specified, always sign the zone
+        # even if we didn't need to for this period.
+        if self.alwayssign and not self.wassigned:
+            extraargs = ''  # Phase-dependent argument.
 
-                self.rolllog_log(
-                    LOG.TMI, rname,
-                    'signing the zone "%s" (-alwayssign specified)' % rname)
-
-                # Tell the signer what phase we're in so it
-                # can decide what key to use.
-                if rrr.zskphase > 0:
-                    extraargs = 'ZSK phase %d' % rrr.zskphase
-                elif rrr.kskphase > 0:
-                    extraargs = 'KSK phase %d' % rrr.kskphase
-
-                # KSK signing uses double-signature so nothing
-                # is needed since zonesigner always uses all
-                # available keys.
-
-                # Actually do the signing.
-                ret = self.signer(rname, extraargs, rrr.keyrec())
-                if ret != 0:
-                    self.rolllog_log(
-                        LOG.ERR, 'signing %s failed!' % rname)
+            self.rolllog_log(
+                LOG.TMI, rname,
+                'signing the zone "%s" (-alwayssign specified)' % rname)
 
-        # Ensure the logging level is set correctly.
-        self.loglevel = self.loglevel_save
-        self.loglevel = self.rolllog_level(self.loglevel, False)
+            # Tell the signer what phase we're in so it
+            # can decide what key to use.
+            if rrr.zskphase > 0:
+                extraargs = 'ZSK phase %d' % rrr.zskphase
+            elif rrr.kskphase > 0:
+                extraargs = 'KSK phase %d' % rrr.kskphase
+
+            # KSK signing uses double-signature so nothing
+            # is needed since zonesigner always uses all
+            # available keys.
+
+            # It's a plain re-signing, held or dropped by the coalescer.
+            if self.coalesce:
+                extraargs += ' -signonly'
+
+            # Actually do the signing.
+            ret = self.signer(rname, extraargs, rrr.keyrec())
+            if not ret:
+                self.rolllog_log(
+                    LOG.ERR, rname, 'signing %s failed!' % rname)
 
     def rrfokay(self, mp=''):
         '''
@@ -714,15 +855,64 @@ class RollerD(
                 file=sys.stderr)
             self.opterrs += 1
 
-        # Exit if there were any option-related errors.
-        if self.opterrs > 0:
-            sys.exit(1)
+        # Get the event handler.
+        eventmaster = self.dtconf.get('roll_eventmaster') or 'full'
+        if eventmaster == 'full':
+            self.eventmaster = defs.EVT_FULLLIST
+        elif eventmaster == 'soon':
+            self.eventmaster = defs.EVT_QUEUE_SOON
+        elif eventmaster == 'loop':
+            self.eventmaster = defs.EVT_EVENTLOOP
+        else:
+            print(
+                'pyrollerd:  invalid event handler "%s"' % eventmaster,
+                file=sys.stderr)
+            self.opterrs += 1
 
         # autopublish settings for KSK phase 5
         self.auto = self.dtconf.get('roll_auto') == '1'
         self.provider = self.dtconf.get('roll_provider')
         self.provider_key = self.dtconf.get('roll_provider_key')
 
+        # memory-saving storage of the rollrec and keyrec records
+        self.compact = self.dtconf.get('roll_compact') == '1'
+        # binary snapshot of the rollrec file for fast startup
+        self.snapshot = self.dtconf.get('roll_snapshot') == '1'
+        # parse the rollrec records on demand
+        self.lazy = self.dtconf.get('roll_lazy') == '1'
+        # number of zones signed concurrently
+        self.signers = int(self.dtconf.get('roll_signers') or 1)
+        # coalesced re-signings of a zone
+        self.coalesce = self.dtconf.get('roll_coalesce') == '1'
+        # default zone signer, "zonesigner" or "inline"
+        self.signer_name = (
+            self.dtconf.get('roll_signer') or self.signer_name)
+        # number of worker processes sharing the zones
+        self.shards = int(self.dtconf.get('roll_shards') or 1)
+        # batched zone reloads
+        self.reload_batch = self.dtconf.get('roll_reload_batch') == '1'
+        self.reload_jobs = int(
+            self.dtconf.get('roll_reload_jobs') or self.reload_jobs)
+        if self.reload_jobs < 1:
+            print(
+                'pyrollerd:  invalid rndc job count "%d"' % self.reload_jobs,
+                file=sys.stderr)
+            self.opterrs += 1
+        self.reload_window = int(
+            self.dtconf.get('roll_reload_window') or self.reload_window)
+        # time limits of the external commands
+        self.cmd_timeout = int(
+            self.dtconf.get('roll_cmd_timeout') or self.cmd_timeout)
+        self.rndc_timeout = int(
+            self.dtconf.get('roll_rndc_timeout') or self.rndc_timeout)
+        # control socket connections served at once
+        self.control_clients = int(
+            self.dtconf.get('roll_control_clients') or 0)
+
+        # Exit if there were any option-related errors.
+        if self.opterrs > 0:
+            sys.exit(1)
+
     def getprogs(self):
         '''
         Routine: getprogs()
@@ -791,6 +981,12 @@ class RollerD(
         elif re.match(r'[KZ]SK phase [013567]', zsflag.strip()):
             zsflag = ''
 
+        # Hold or drop a plain re-signing covered by another signing.
+        # Either way the zone is signed in this pass.
+        if self.coalesce_sign(rname, bool(signonly), krr):
+            self.wassigned = True
+            return True
+
         # Get the rollrec and any user-specified zonesigner arguments
         # for this zone.
         rrr = self.rollrec_fullrec(rname)
@@ -834,20 +1030,12 @@ class RollerD(
         # Additional options for dnssec-signzone
         # zsflag += ' -szopts "-o %s"' % rname
 
-        # Build the command to execute.
-        cmdstr = (
-            '%(zonesigner)s -rollmgr pyrollerd -dtconfig %(dtcf)s '
-            '%(zsflag)s %(zonefile)s %(zonesigned)s' % {
-            'zonesigner': self.zonesigner,
-            'dtcf': self.dtcf,
-            'zsflag': zsflag,
-            'zonefile': zonefile,
-            'zonesigned': zonesigned,
-        })
-        # self.rolllog_log(LOG.INFO, rname, 'executing "%s"' % cmdstr)
-
-        # Have zonesigner sign the zone for us.
-        ret = self.runner(rname, cmdstr, rrr['keyrec'], False)
+        # Have the zone's signer sign the zone for us.
+        started = time.time()
+        ret = self.signer_backend(rrr).sign(
+            rname, rrr, krr, zsflag, zonefile, zonesigned)
+        self.stats_add('signings')
+        self.stats_add('signtime', time.time() - started)
         if not ret:
             # Error logging is done in runner(), rather than here
             # or in zoneerr().
@@ -856,9 +1044,38 @@ class RollerD(
         else:
             # rrr['signed'] = 1
             self.wassigned = True
+            self.stats_zone(rname)
+            self.coalesce_signed(rname)
 
         return ret
 
+    def signer_backend(self, rrr):
+        '''
+        Get the signer of a zone: its rollrec's "signer" field or
+        $signer_name, "zonesigner" or "inline".
+
+        @param rrr: Reference to rollrec.
+        @type rrr: Roll
+
+        @returns: signer
+        @rtype: Signer
+        '''
+        name = rrr.get('signer') or self.signer_name
+        if name == 'inline':
+            try:
+                from ..signers.inline import Signer
+                return Signer(self)
+            except ImportError as e:
+                self.rolllog_log(
+                    LOG.ERR, rrr.name,
+                    'inline signer unavailable, using zonesigner:  %s' % e)
+        elif name != 'zonesigner':
+            self.rolllog_log(
+                LOG.ERR, rrr.name,
+                'unknown signer "%s", using zonesigner' % name)
+        from ..signers.zonesigner import Signer
+        return Signer(self)
+
     def runner(self, rname, cmd, krf, negerrflag):
         '''
         This routine executes another command.
@@ -869,23 +1086,20 @@ class RollerD(
         @param cmd: Command to execute.
         @type cmd: str
         @param krf: Zone's keyrec file.
-        @type krf: KeyRec
+        @type krf: KeyRec or str
         @param negerrflag: Only-negative-error flag.
         @type bool
         '''
-        ret = 0  # Command's return code.
-        out = ''  # Command's output.
-
         # Execute the specific command.
         self.rolllog_log(LOG.TMI, rname, 'executing "%s"' % cmd)
 
         # Execute the given command.  We'll save the stdout and stderr
         # output in case of error.
-        p = subprocess.Popen(
-            shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-            cwd=os.getcwd())
-        rcode = p.wait()
-        out = p.stdout.read().decode('utf8')
+        result = self.execute(cmd)
+        rcode = result.returncode
+
+        # The command has probably changed the keyrec file.
+        forget_keyrec(krf._path if isinstance(krf, KeyRec) else krf)
 
         # If the error flag is set and the command exited with an error,
         # we'll log the output.
@@ -894,11 +1108,77 @@ class RollerD(
             self.rolllog_log(
                 LOG.ERR, rname, 'execution error for command "%s"' % cmd)
             self.rolllog_log(LOG.ERR, rname, 'error return - %d' % rcode)
-            self.rolllog_log(LOG.ERR, rname, 'error output - "%s"' % out)
+            self.rolllog_log(
+                LOG.ERR, rname, 'error output - "%s"' % result.output)
 
         # Re-read current keyrec file and return a success/fail indicator.
         return rcode == 0
 
+    def execute(self, cmd, timeout=None):
+        '''
+        Run a command in the current directory and wait for it, for
+        $cmd_timeout seconds at most.  The command is run by the event
+        loop, if there's one.
+
+        @param cmd: Command to execute.
+        @type cmd: str
+        @param timeout: Seconds the command may run, $cmd_timeout by default.
+        @type timeout: int
+
+        @returns: command's outcome
+        @rtype: execute.Result
+        '''
+        args = shlex.split(cmd)
+        cwd = os.getcwd()
+        if timeout is None:
+            timeout = self.cmd_timeout
+        if self.LOOP:
+            def wait():
+                return self.loop_execute(args, cwd, timeout)
+        else:
+            started = time.time()
+            p = execute.start(args, cwd)
+
+            def wait():
+                return execute.collect(p, timeout, started=started)
+
+        if self.signlock:
+            # Let the other zones go on while the command runs.
+            result = self.runner_unlocked(wait)
+        else:
+            result = wait()
+
+        self.rolllog_log(
+            LOG.TMI, '', '%s exited with %d in %.1f seconds, %d bytes of '
+            'output' % (args[0], result.returncode, result.duration,
+                        result.size))
+        if result.timedout:
+            self.rolllog_log(
+                LOG.ERR, '', '%s killed after %d seconds' % (args[0], timeout))
+        return result
+
+    def runner_unlocked(self, wait):
+        '''
+        Wait for a command without holding the rollzones() lock.
+        The other zones may change our directory and the per-zone
+        settings meanwhile, so they are restored afterwards.
+
+        @param wait: Function waiting for the command.
+        @type wait: function
+
+        @returns: command's outcome
+        @rtype: execute.Result
+        '''
+        cwd = os.getcwd()
+        state = (self.loglevel, self.loglevel_save, self.wassigned)
+        self.signlock.release()
+        try:
+            return wait()
+        finally:
+            self.signlock.acquire()
+            os.chdir(cwd)
+            self.loglevel, self.loglevel_save, self.wassigned = state
+
     def rrfchk(self):
         '''
         This routine performs initial checking of the rollrec file.
@@ -994,6 +1274,9 @@ class RollerD(
         self.rollrec_close()
         self.rollrec_read()
         rrr = self.rollrec_fullrec(rname)
+        self.status_zone(rname)
+        self.shard_report(rname)
+        self.stats_zone(rname)
 
         # Get the rollin' key's keyrec for our zone.
         krec = rrr.keyrec()
@@ -1007,7 +1290,7 @@ class RollerD(
             return
 
         # Make sure we've got an actual set keyrec and keys.
-        if not isinstance(setrec, KeySet):
+        if not isinstance(setrec, KeySetMixin):
             self.rolllog_log(
                 LOG.ERR, rname,
                 '"%s"\'s keyrec is not a set keyrec; unable to move to '
@@ -1158,9 +1441,9 @@ class RollerD(
                 newphase = ret
             else:
                 # Set up the arguments for the command.
-                cmdargs = ' '.join(
+                cmdargs = ' '.join((
                     rrr['zonename'], phase, rname,
-                    self.rollrecfile, rrr.keyrec_path)
+                    self.rollrecfile, rrr.keyrec_path))
 
                 # Execute the phase's locally defined program.
                 ret = self.localprog(rname, cmd, cmdargs, phase)
@@ -1264,10 +1547,45 @@ class RollerD(
                 LOG.INFO, rname, 'not reloading zone for %s' % phase)
             return False
 
+        # Queue the reload if they're batched.
+        if self.reload_batch:
+            self.rolllog_log(
+                LOG.INFO, rname, 'queueing zone reload for %s' % phase)
+            self.reload_add(rname, rrr['zonename'], useopts, phase)
+            return True
+
         # Reload the zone for real.
         self.rolllog_log(LOG.INFO, rname, 'reloading zone for %s' % phase)
-        ret = rrr.loadzone(self.rndc, useopts)
-        return ret == 0
+        result = self.execute(
+            '%s %s reload %s' % (self.rndc, useopts, rrr['zonename']),
+            self.rndc_timeout)
+        return result.returncode == 0
+
+    def localprog(self, rname, cmd, cmdargs, phase):
+        '''
+        Run a phase's locally defined program.
+
+        @param rname: Rollrec name of zone.
+        @type rname: str
+        @param cmd: Program to run.
+        @type cmd: str
+        @param cmdargs: Program's arguments.
+        @type cmdargs: str
+        @param phase: Zone's current phase.
+        @type phase: str
+
+        @returns: program's return code
+        @rtype: int
+        '''
+        self.rolllog_log(
+            LOG.INFO, rname, 'running "%s" for %s' % (cmd, phase))
+        result = self.execute('%s %s' % (cmd, cmdargs))
+        if result.returncode != 0:
+            self.rolllog_log(
+                LOG.ERR, rname, 'error return - %d' % result.returncode)
+            self.rolllog_log(
+                LOG.ERR, rname, 'error output - "%s"' % result.output)
+        return result.returncode
 
     def rollnow(self, zone, rolltype, force):
         '''
@@ -1339,5 +1657,8 @@ class RollerD(
         elif rolltype == 'restart':
             # Do nothing, just move from skip to roll.
             pass
+        self.status_zone(zone)
 
+        self.rollrec_close()
+        self.rollrec_unlock()
         return 1
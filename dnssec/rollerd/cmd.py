@@ -14,12 +14,19 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+import fnmatch
+import itertools
 import os
+import re
+import time
 
 from .. import defs
 from ..rolllog import LOG
 
 
+ZONESTATUS_CHUNK = 256  # Zones per chunk of a streamed zonestatus.
+
+
 class CmdMixin(object):
     def groupcmd(self, cmd, data):
         '''
@@ -152,7 +159,7 @@ zone reload:\t%(zoneload)s
 ''' % {
             'boottime': self.boottime.strftime('%Y-%m-%d %H:%M:%S'),
             'realm': self.realm or '-',
-            'curdir': os.getcwd(),
+            'curdir': self.xqtdir or os.getcwd(),
             'rollrecfile': self.rollrecfile,
             'dtconfig': self.dtconfig,
             'lfile': self.logfile,
@@ -328,6 +335,28 @@ zone reload:\t%(zoneload)s
                 '%s has bad values in rollrec file %s' %
                 (zone, self.rollrecfile))
 
+    def cmd_rollzone(self, zone):
+        '''
+        This command restarts a zone's rollover processing: a skip
+        rollrec is changed to a roll rollrec, in whichever phase it is.
+        It calls rollnow() to change the rollrec.
+
+        @param zone: Command's data.
+        @type zone: str
+        '''
+        self.rolllog_log(
+            LOG.TMI, '<command>', 'rollzone command received; zone - "%s"' %
+            zone)
+
+        # Restart the zone and send an appropriate response.
+        if self.rollnow(zone, 'restart', 1) == 1:
+            self.rollmgr_sendresp(
+                defs.ROLLCMD_RC_OKAY, '%s rollover restarted' % zone)
+        else:
+            self.rollmgr_sendresp(
+                defs.ROLLCMD_RC_BADZONE, '%s not in rollrec file %s' %
+                (zone, self.rollrecfile))
+
     def cmd_shutdown(self, data):
         ''' This command forces rollerd to shut down. '''
         self.rolllog_log(LOG.TMI, '<command>', 'shutdown command received')
@@ -338,19 +367,40 @@ zone reload:\t%(zoneload)s
         '''
         Return zone status to the control program.
 
+        The command's data may hold options, separated by blanks:
+            stream          send the status in chunks, as it's generated
+            phase=<phase>   zones in KSK or ZSK rollover ("ksk", "zsk"),
+                            in a phase ("ksk<n>", "zsk<n>") or not
+                            rolling ("none")
+            type=<type>     "roll" or "skip" zones
+            zone=<glob>     zones whose name matches the glob
+            offset=<n>      skip the first n zones
+            limit=<n>       give n zones at most
+
         @param data: Command's data.
         @type data: str
         '''
-        cnt = 0  # Zone count.
-        outbuf = ''  # Zone status line.
-
         self.rolllog_log(LOG.TMI, '<command>', 'zonestatus command received')
 
-        self.rollrec_lock()
+        try:
+            opts = self.zonestatus_opts(data)
+        except ValueError as e:
+            self.rollmgr_sendresp(defs.ROLLCMD_RC_BADARGS, str(e))
+            self.rolllog_log(LOG.ERR, '<command>', str(e))
+            return
 
-        # Read the rollrec file.  If we couldn't, complain and return.
-        if not self.rollrec_read():
+        # The zones' status is kept in memory by the daemon.  It's loaded
+        # here when no pass has done it, unless the command runs
+        # concurrently with the zones.  If we couldn't, complain and return.
+        table = self.status_table()
+        if (table is None and
+                not self.control_readonly(defs.ROLLCMD_ZONESTATUS)):
+            self.rollrec_lock()
+            if self.rollrec_read():
+                self.status_load()
             self.rollrec_unlock()
+            table = self.status_table()
+        if table is None:
             self.rollmgr_sendresp(
                 defs.ROLLCMD_RC_RRFOPEN,
                 'unable to open rollrec file %s' % self.rollrecfile)
@@ -359,39 +409,220 @@ zone reload:\t%(zoneload)s
                 'unable to open rollrec file %s' % self.rollrecfile)
             return
 
-        # Add the status of each zone in the rollrec file to our output buffer.
-        for rname in self.rollrec_names():
-            # Get the rollrec for this name.
-            rrr = self.rollrec_fullrec(rname)
+        # An empty rollrec file is an error, filtering every zone out isn't.
+        if not table.zones:
+            self.rollmgr_sendresp(
+                defs.ROLLCMD_RC_NOZONES,
+                'no zones defined in %s' % self.rollrecfile)
+            self.rolllog_log(
+                LOG.ALWAYS, '<command>',
+                'no zones defined in %s' % self.rollrecfile)
+            return
+
+        # The table doesn't change, so its status lines are generated
+        # while they're sent.
+        lines = itertools.islice(
+            self.zonestatus_lines(table.zones, opts), opts['offset'],
+            None if opts['limit'] is None else opts['offset'] + opts['limit'])
+
+        # Send a response to the control program.
+        if opts['stream']:
+            self.rollmgr_sendstream(self.zonestatus_chunks(lines))
+        else:
+            self.rollmgr_sendresp(defs.ROLLCMD_RC_OKAY, ''.join(lines))
+
+    def zonestatus_opts(self, data):
+        '''
+        Parse the options of a zonestatus command.
+
+        @param data: Command's data.
+        @type data: str
+
+        @returns: options
+        @rtype: dict
+        @raises ValueError: on an invalid option
+        '''
+        opts = {
+            'stream': False,
+            'phase': None,
+            'type': None,
+            'zone': None,
+            'offset': 0,
+            'limit': None,
+        }
+        for word in (data or '').split():
+            if word == 'stream':
+                opts['stream'] = True
+                continue
+            key, sep, value = word.partition('=')
+            if key in ('offset', 'limit') and value.isdigit():
+                value = int(value)
+            elif key == 'phase' and re.match(r'^(none|ksk\d*|zsk\d*)$', value):
+                pass
+            elif key == 'type' and value in ('roll', 'skip'):
+                pass
+            elif not (key == 'zone' and value):
+                raise ValueError('invalid zonestatus option "%s"' % word)
+            opts[key] = value
+        return opts
+
+    def zonestatus_lines(self, zones, opts):
+        '''
+        Generate the status lines of the zones kept by the options.
+
+        @param zones: Zones' status.
+        @type zones: tuple of ZoneStatus
+        @param opts: Options from zonestatus_opts().
+        @type opts: dict
+
+        @returns: iterator of status lines
+        @rtype: iterator
+        '''
+        phasesel = opts['phase']
+        for zst in zones:
+            if opts['type'] and zst.rollrec_type != opts['type']:
+                continue
+            if opts['zone'] and not fnmatch.fnmatch(zst.name, opts['zone']):
+                continue
+            if phasesel:
+                kskphase, zskphase = zst.kskphase, zst.zskphase
+                if phasesel == 'none':
+                    keep = not kskphase and not zskphase
+                elif phasesel == 'ksk':
+                    keep = kskphase > 0
+                elif phasesel == 'zsk':
+                    keep = not kskphase and zskphase > 0
+                elif phasesel.startswith('ksk'):
+                    keep = kskphase == int(phasesel[3:])
+                else:
+                    keep = not kskphase and zskphase == int(phasesel[3:])
+                if not keep:
+                    continue
 
             # Get the data we're interested in.
-            if rrr.kskphase > 0:
-                phase = 'KSK %d' % rrr.kskphase
+            if zst.kskphase > 0:
+                phase = 'KSK %d' % zst.kskphase
             else:
-                phase = 'ZSK %d' % rrr.zskphase
-            pstr = rrr.phase_description
+                phase = 'ZSK %d' % zst.zskphase
+            pstr = zst.phase_description
 
             phase = '%s: %s' % (phase, pstr) if pstr else ''
-            if not rrr.is_active:
+            if not zst.is_active:
                 phase = '-'
 
-            # Add the data to the output buffer and bump our zone count.
-            outbuf += '%s/%s\t%s\t%s\n' % (
-                rname, rrr['zonename'], rrr.rollrec_type, phase)
-            cnt += 1
+            yield '%s/%s\t%s\t%s\n' % (
+                zst.name, zst.zonename, zst.rollrec_type, phase)
 
-        # Send a response to the control program.
-        if not cnt:
+    def zonestatus_chunks(self, lines):
+        '''
+        Group the status lines into the responses of a streamed
+        zonestatus: $ZONESTATUS_CHUNK zones per ROLLCMD_RC_CHUNK
+        response, then the final response.
+
+        @param lines: Status lines.
+        @type lines: iterable
+
+        @returns: iterator of (retcode, respmsg)
+        @rtype: iterator
+        '''
+        lines = iter(lines)
+        while 42:
+            chunk = ''.join(itertools.islice(lines, ZONESTATUS_CHUNK))
+            if not chunk:
+                break
+            yield defs.ROLLCMD_RC_CHUNK, chunk
+        yield defs.ROLLCMD_RC_OKAY, ''
+
+    def cmd_queuelist(self, data):
+        '''
+        Return the queued events to the control program, by event
+        time: a line per zone with the event's GMT and the zone's phase.
+
+        @param data: Command's data.
+        @type data: str
+        '''
+        self.rolllog_log(LOG.TMI, '<command>', 'queuelist command received')
+
+        if self.eventmaster == defs.EVT_FULLLIST:
             self.rollmgr_sendresp(
-                defs.ROLLCMD_RC_NOZONES,
-                'no zones defined in %s' % self.rollrecfile)
-            self.rolllog_log(
-                LOG.ALWAYS, '<command>',
-                'no zones defined in %s' % self.rollrecfile)
-        else:
-            self.rollmgr_sendresp(defs.ROLLCMD_RC_OKAY, outbuf)
+                defs.ROLLCMD_RC_OKAY,
+                'no event queue with the %s event method\n' %
+                self.event_methods[self.eventmaster])
+            return
 
-        self.rollrec_unlock()
+        # The queue is changed by the zones, so we take a copy of it.
+        events = sorted(
+            (eventtime, rname)
+            for rname, eventtime in list(self.queue_eventtimes.items()))
+        lines = []
+        for eventtime, rname in events:
+            zst = self.status_of(rname)
+            if zst is None:
+                phase = ''
+            elif zst.kskphase > 0:
+                phase = 'KSK %d' % zst.kskphase
+            else:
+                phase = 'ZSK %d' % zst.zskphase
+            lines.append('%s\t%s\t%s\n' % (
+                self.queue_timestr(eventtime), rname, phase))
+        self.rollmgr_sendresp(defs.ROLLCMD_RC_OKAY, ''.join(lines))
+
+    def cmd_queuestatus(self, data):
+        '''
+        Return the event queue's state and the counters of the recent
+        passes, newest first, to the control program.
+
+        @param data: Command's data.
+        @type data: str
+        '''
+        self.rolllog_log(LOG.TMI, '<command>', 'queuestatus command received')
+
+        events = [
+            (eventtime, rname)
+            for rname, eventtime in list(self.queue_eventtimes.items())]
+        passes = list(self.stats_passes)
+        table = self.status_table()
+
+        outbuf = 'event method:\t%s\n' % self.event_methods[self.eventmaster]
+        outbuf += 'queued events:\t%d\n' % len(events)
+        if events:
+            eventtime, rname = min(events)
+            outbuf += 'next event:\t%s %s\n' % (
+                self.queue_timestr(eventtime), rname)
+        if self.queue_lastscan:
+            outbuf += 'last scan:\t%s\n' % (
+                self.queue_timestr(self.queue_lastscan))
+            outbuf += 'scan time:\t%.2f s\n' % self.queue_scantime
+            outbuf += 'scan skips:\t%d\n' % self.queue_scanskips
+        if table is not None:
+            outbuf += 'zones:\t\t%d (%d skipped)\n' % (
+                len(table.zones),
+                sum(1 for zst in table.zones if not zst.is_active))
+            outbuf += 'status version:\t%d\n' % table.version
+
+        outbuf += '\nrecent passes:\t%d\n' % len(passes)
+        if passes:
+            outbuf += (
+                'started\t\t\telapsed\tscanned\tskipped\tacted\tsigned\t'
+                'signing\trrread\twaiting\tlocking\n')
+        for stats in reversed(passes):
+            outbuf += (
+                '%s\t%.2f\t%d\t%d\t%d\t%d\t%.2f\t%.2f\t%.2f\t%.2f\n' % (
+                    self.queue_timestr(stats.started), stats.elapsed,
+                    stats.scanned, stats.skipped, stats.acted, stats.signings,
+                    stats.signtime, stats.rrreadtime, stats.waittime,
+                    stats.locktime))
+        self.rollmgr_sendresp(defs.ROLLCMD_RC_OKAY, outbuf)
+
+    def queue_timestr(self, gmt):
+        '''
+        @param gmt: Seconds since the epoch.
+        @type gmt: float
+
+        @returns: GMT as "YYYY-MM-DD HH:MM:SS"
+        @rtype: str
+        '''
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(gmt))
 
     def cmd_rollall(self):
         '''
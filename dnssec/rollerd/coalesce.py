@@ -0,0 +1,151 @@
+# Copyright (C) 2015 Okami, okami@fuzetsu.info
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import threading
+
+from ..parsers.abstract import file_stamp
+from ..rolllog import LOG
+
+
+class CoalesceMixin(object):
+    '''
+    Signing coalescer.  While a zone is handled by a pass, its plain
+    re-signings (the "-signonly" ones, asked for by zonemodified() or
+    -alwayssign) are held until the end of the zone's turn, and only
+    run if no other signing has covered them in the meantime: any
+    zonesigner run signs the current zone file.  A re-signing of a zone
+    file which hasn't changed since the zone was last signed in the
+    pass is dropped too.
+
+    The rollover signings (new or rolled keys) are always run at once,
+    as the phases depend on their result.
+    '''
+    coalesce = False  # Coalesce the signings of a zone.
+
+    coalesce_runs = 0  # zonesigner runs in the current pass.
+    coalesce_saved = 0  # Signings saved in the current pass.
+    coalesce_zone = threading.local()  # Zone handled by the thread.
+
+    def coalesce_rollzone(self, rname):
+        '''
+        Handle a zone, coalescing its signings.
+
+        @param rname: Name of rollrec rec.
+        @type rname: str
+        '''
+        if not self.coalesce:
+            self.rollzone(rname)
+            return
+
+        zone = self.coalesce_zone
+        zone.rname = rname
+        zone.pending = False  # A re-signing is held.
+        zone.stamp = None  # Zone file stamp of the running signing.
+        zone.signed = None  # Zone file stamp at the last signing.
+        try:
+            self.rollzone(rname)
+        finally:
+            zone.rname = None
+
+        # Run the re-signing nobody has done for us.
+        if zone.pending:
+            rrr = self.rollrec_fullrec(rname)
+            if rrr and rrr.is_active:
+                self.rolllog_log(LOG.TMI, rname, 'running held re-signing')
+                self.coalesce_runs += 1
+                self.signer(rname, rrr.phaseargs, rrr.keyrec())
+
+    def coalesce_sign(self, rname, signonly, krr):
+        '''
+        Record a signing of a zone.
+
+        @param rname: Name of rollrec rec.
+        @type rname: str
+        @param signonly: Plain re-signing flag.
+        @type signonly: bool
+        @param krr: Zone's keyrec.
+        @type krr: KeyRec
+
+        @returns: True if the signing is held or dropped, False if it
+                  is to be run now
+        @rtype: bool
+        '''
+        zone = self.coalesce_zone
+        if not self.coalesce or getattr(zone, 'rname', None) != rname:
+            return False
+
+        zone.stamp = self.coalesce_stamp(rname, krr)
+        if not signonly:
+            self.coalesce_runs += 1
+            return False
+
+        if zone.pending:
+            self.rolllog_log(LOG.TMI, rname, 're-signing already held')
+            self.coalesce_saved += 1
+        elif zone.stamp is not None and zone.stamp == zone.signed:
+            self.rolllog_log(
+                LOG.TMI, rname, 'zone file unchanged since signed; '
+                'not re-signing')
+            self.coalesce_saved += 1
+        else:
+            self.rolllog_log(
+                LOG.TMI, rname, 're-signing held until the end of the pass')
+            zone.pending = True
+        return True
+
+    def coalesce_signed(self, rname):
+        '''
+        Note a successful signing of a zone, which covers its held
+        re-signing.
+
+        @param rname: Name of rollrec rec.
+        @type rname: str
+        '''
+        zone = self.coalesce_zone
+        if not self.coalesce or getattr(zone, 'rname', None) != rname:
+            return
+        if zone.pending:
+            self.rolllog_log(
+                LOG.TMI, rname, 'held re-signing done by this signing')
+            self.coalesce_saved += 1
+            zone.pending = False
+        zone.signed = zone.stamp
+
+    def coalesce_stamp(self, rname, krr):
+        '''
+        @param rname: Name of rollrec rec.
+        @type rname: str
+        @param krr: Zone's keyrec.
+        @type krr: KeyRec
+
+        @returns: stamp of the zone file, None if unknown
+        @rtype: tuple
+        '''
+        try:
+            return file_stamp(krr[rname].zonefile_path)
+        except (OSError, KeyError, TypeError):
+            return None
+
+    def coalesce_report(self):
+        '''
+        Log the signings of the pass, and start a new one.
+        '''
+        if self.coalesce and (self.coalesce_runs or self.coalesce_saved):
+            self.rolllog_log(
+                LOG.INFO, '', '%d zone signings run, %d coalesced' %
+                (self.coalesce_runs, self.coalesce_saved))
+        self.coalesce_runs = 0
+        self.coalesce_saved = 0
@@ -0,0 +1,195 @@
+# Copyright (C) 2015 Okami, okami@fuzetsu.info
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import os
+import queue
+import threading
+
+from .. import defs, rollmgr
+from ..rolllog import LOG
+
+
+# Commands which only read the daemon's state.
+READONLY_COMMANDS = frozenset((
+    defs.ROLLCMD_QUEUELIST,
+    defs.ROLLCMD_QUEUESTATUS,
+    defs.ROLLCMD_STATUS,
+    defs.ROLLCMD_ZONESTATUS,
+))
+
+
+class ControlMixin(object):
+    '''
+    Concurrent control socket server.  Each connection is served by its
+    own thread, up to $control_clients at once:
+
+    * The read-only commands are run right away by the connection's
+      thread, from the zones' status kept in memory (see StatusMixin).
+    * The other commands are queued for the main thread, which runs
+      them one at a time between the zones' passes, as commander()
+      does for the connections it accepts itself.
+
+    The commands of a session are handled the same way, in order.
+    '''
+    control_clients = 0  # Connections served at once, 0 for one at a time.
+    control_queue = None  # Queue of (connection, command, data, done) to run.
+    control_slots = None  # Semaphore bounding the connections served.
+    control_wakeup = None  # Pipe waking up sleeper() for the queued commands.
+
+    def control_start(self):
+        '''
+        Start serving the command socket in the background.
+        '''
+        self.control_queue = queue.Queue()
+        self.control_slots = threading.BoundedSemaphore(self.control_clients)
+        self.control_wakeup = os.pipe()
+        for fd in self.control_wakeup:
+            os.set_blocking(fd, False)
+        threading.Thread(target=self.control_accept, daemon=True).start()
+
+    def control_accept(self):
+        '''
+        Accept the connections to the command socket, each one served
+        by a new thread once a slot is free.
+        '''
+        self.SOCK.settimeout(None)
+        while 42:
+            self.control_slots.acquire()
+            try:
+                sock, addr = self.SOCK.accept()
+            except OSError:
+                self.control_slots.release()
+                return
+            threading.Thread(
+                target=self.control_client, args=(sock,), daemon=True).start()
+
+    def control_client(self, sock):
+        '''
+        Serve a connection to the command socket.
+
+        @param sock: Client's socket.
+        @type sock: socket.socket
+        '''
+        conn = rollmgr.Connection(sock)
+        queued = False
+        try:
+            cmd, data = conn.getcmd()
+            if cmd == defs.ROLLCMD_SESSION:
+                conn.sendresp(
+                    [(defs.ROLLCMD_RC_OKAY, rollmgr.SESSION_VERSION)])
+                while 42:
+                    cmd, data = conn.getcmd(rollmgr.SESSION_WAIT)
+                    if not cmd:
+                        break
+                    self.control_command(conn, cmd, data, threading.Event())
+            elif cmd:
+                queued = self.control_command(conn, cmd, data, None)
+        except Exception as e:
+            self.rolllog_log(
+                LOG.ERR, '<command>', 'command failed:  %s' % e)
+        finally:
+            if not queued:
+                conn.close()
+            self.control_slots.release()
+
+    def control_command(self, conn, cmd, data, done):
+        '''
+        Run a read-only command right away, or queue it for the main
+        thread.
+
+        @param conn: Client's connection.
+        @type conn: rollmgr.Connection
+        @param cmd: Client's command.
+        @type cmd: str
+        @param data: Command's data.
+        @type data: str
+        @param done: Event set once a session's command is answered,
+                     None outside sessions.
+        @type done: threading.Event
+
+        @returns: True if the main thread closes the connection
+        @rtype: bool
+        '''
+        self.rolllog_log(LOG.TMI, '<command>', 'cmd   - "%s"' % cmd)
+        if data:
+            self.rolllog_log(LOG.TMI, '<command>', 'data  - "%s"' % data)
+
+        if self.control_readonly(cmd):
+            resp = []
+            self.rollmgr_keepresp(resp)
+            try:
+                self.singlecmd(cmd, data)
+            finally:
+                self.rollmgr_keepresp(None)
+            conn.sendresp(resp, done is not None)
+            return False
+
+        self.control_queue.put((conn, cmd, data, done))
+        try:
+            os.write(self.control_wakeup[1], b'\0')
+        except BlockingIOError:
+            pass
+        if done is None:
+            return True
+        done.wait()
+        return False
+
+    def control_readonly(self, cmd):
+        '''
+        @param cmd: Client's command.
+        @type cmd: str
+
+        @returns: command may run concurrently with the others
+        @rtype: bool
+        '''
+        return bool(self.control_clients) and cmd in READONLY_COMMANDS
+
+    def control_commands(self, waiter=0):
+        '''
+        Run the commands queued by the connections' threads.
+
+        @param waiter: Time to wait for a first command.
+        @type waiter: int
+
+        @returns: True if the rollrec file was changed by a command
+        @rtype: bool
+        '''
+        try:
+            while os.read(self.control_wakeup[0], 512) == 512:
+                pass
+        except BlockingIOError:
+            pass
+
+        while 42:
+            try:
+                conn, cmd, data, done = self.control_queue.get(timeout=waiter)
+            except queue.Empty:
+                return False
+            waiter = 0
+
+            resp = []
+            self.rollmgr_keepresp(resp)
+            try:
+                if self.runcmd(cmd, data):
+                    return True
+            finally:
+                # A shutdown is answered before we exit.
+                self.rollmgr_keepresp(None)
+                conn.sendresp(resp, done is not None)
+                if done is None:
+                    conn.close()
+                else:
+                    done.set()
@@ -14,26 +14,39 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
-import time
+import os
+import selectors
 import signal
 import sys
+import time
 
-from .. import rollmgr
+from .. import defs, rollmgr
 from ..rolllog import LOG
 
 
 class DaemonMixin(object):
-    def commander(self):
+    SLEEPSEL = None  # Selector waiting for commands and signals.
+    SIGPIPE = None  # Pipe written to on signals.
+
+    def commander(self, waiter=5):
         '''
         Get any commands sent to rollerd's command socket.
+
+        @param waiter: Time to wait for a connection, 0 to take only
+                       the waiting ones.
+        @type waiter: int
         '''
-        gstr = rollmgr.ROLLMGR_GROUP  # Group command indicator.
         self.rolllog_log(LOG.TMI, '<command>', 'checking commands')
 
+        # The connections are accepted by the control server's thread.
+        if self.control_queue is not None:
+            self.control_commands(waiter)
+            return
+
         # Read and handle all the commands we've been sent.
         while 42:
             # Get the command, return if there wasn't one.
-            cmd, data = self.rollmgr_getcmd(5)
+            cmd, data = self.rollmgr_getcmd(waiter)
             if not cmd:
                 return
 
@@ -41,27 +54,50 @@ class DaemonMixin(object):
             if data:
                 self.rolllog_log(LOG.TMI, '<command>', 'data  - "%s"' % data)
 
-            # Deal with the command as zone-related or as a group command.
-            if cmd.startswith(gstr):
-                cmd = cmd[len(gstr):]
-                self.groupcmd(cmd, data)
-            else:
-                if self.singlecmd(cmd, data):
-                    break
+            if cmd == defs.ROLLCMD_SESSION:
+                # Waiting for a session's commands would hold up the
+                # rollovers: the client falls back to a connection per
+                # command.
+                self.rollmgr_sendresp(
+                    defs.ROLLCMD_RC_BADEVENT,
+                    'sessions need roll_control_clients or the loop '
+                    'eventmaster')
+            elif self.runcmd(cmd, data):
+                break
             self.rollmgr_closechan()
 
+    def runcmd(self, cmd, data):
+        '''
+        Deal with a command as zone-related or as a group command.
+
+        @param cmd: Client's command.
+        @type cmd: str
+        @param data: Command's data.
+        @type data: str
+
+        @returns: True if the rollrec file was changed by the command
+        @rtype: bool
+        '''
+        gstr = rollmgr.ROLLMGR_GROUP  # Group command indicator.
+        if cmd.startswith(gstr):
+            self.groupcmd(cmd[len(gstr):], data)
+            return False
+        return self.singlecmd(cmd, data)
+
     def intcmd_handler(self):
         ''' Handle an interrupt and get a command. '''
         self.rolllog_log(
             LOG.TMI, '<command>',
             'rollover manager:  got a command interrupt\n')
         self.controllers(False)
-        self.commander()
+        self.commander(0)
         self.controllers(True)
 
     def halt_handler(self):
         ''' Handle the "halt" command. '''
         self.rolllog_log(LOG.ALWAYS, '', 'rollover manager shutting down...\n')
+        if self.reload_queue:
+            self.reload_flush()
         # self.rollrec_write()   # dump the current file with commands
         sys.exit(0)
 
@@ -80,7 +116,8 @@ class DaemonMixin(object):
         @param onflag: Handler on/off flag.
         @type onflag: bool
         '''
-        # Set the signal handlers that will manage incoming commands.
+        # The signal handlers only remember the signals; they are handled
+        # here and by sleeper(), which is woken up by them.
         if onflag:
             if self.queued_int:
                 self.queued_int = False
@@ -88,33 +125,69 @@ class DaemonMixin(object):
             if self.queued_hup:
                 self.queued_hup = False
                 self.intcmd_handler()
-            signal.signal(
-                signal.SIGHUP,
-                lambda signalnum, frame: self.intcmd_handler())
-            signal.signal(
-                signal.SIGINT,
-                lambda signalnum, frame: self.halt_handler())
-        else:
-            signal.signal(
-                signal.SIGHUP,
-                lambda signalnum, frame: self.queue_hup_handler())
-            signal.signal(
-                signal.SIGINT,
-                lambda signalnum, frame: self.queue_int_handler())
-
-    def sleeper(self):
+        signal.signal(
+            signal.SIGHUP,
+            lambda signalnum, frame: self.queue_hup_handler())
+        signal.signal(
+            signal.SIGINT,
+            lambda signalnum, frame: self.queue_int_handler())
+
+    def sleep_selector(self):
+        '''
+        Set up the selector used by sleeper(): it waits for connections
+        to the command socket and for signals, which are written to
+        a pipe by the interpreter.
+
+        @returns: selector
+        @rtype: selectors.BaseSelector
+        '''
+        if not self.SLEEPSEL:
+            self.SIGPIPE = os.pipe()
+            for fd in self.SIGPIPE:
+                os.set_blocking(fd, False)
+            signal.set_wakeup_fd(self.SIGPIPE[1])
+            self.SLEEPSEL = selectors.DefaultSelector()
+            self.SLEEPSEL.register(self.SIGPIPE[0], selectors.EVENT_READ)
+            if self.control_wakeup:
+                self.SLEEPSEL.register(
+                    self.control_wakeup[0], selectors.EVENT_READ)
+            elif self.SOCK:
+                self.SLEEPSEL.register(self.SOCK, selectors.EVENT_READ)
+        return self.SLEEPSEL
+
+    def sleeper(self, naptime=None):
         '''
         Routine: sleeper()
         Purpose: Sleep for a specific amount of time.  This will take into
                  account interrupts we've taken from rollctl.
                  We may be overridden by a rollctl command.
+
+        @param naptime: Seconds to sleep, $sleeptime by default.
+        @type naptime: int
         '''
         if self.sleep_override:
             return
+        if naptime is None:
+            naptime = self.sleeptime
         self.rolllog_log(
-            LOG.TMI, '', 'sleeping for %s seconds' % self.sleeptime)
+            LOG.TMI, '', 'sleeping for %s seconds' % naptime)
+        selector = self.sleep_selector()
+        started = time.time()
         self.sleepcnt = 0
-        while self.sleepcnt < self.sleeptime:
-            nap = self.sleeptime - self.sleepcnt
-            self.sleepcnt += nap
-            time.sleep(nap)
+        while self.sleepcnt < naptime:
+            for key, events in selector.select(naptime - self.sleepcnt):
+                if key.fileobj == self.SIGPIPE[0]:
+                    # Drop the signal numbers, the handlers queued them.
+                    while os.read(self.SIGPIPE[0], 512) == 512:
+                        pass
+                else:
+                    # Answer the waiting commands right away.
+                    self.controllers(False)
+                    self.commander(0)
+                    self.controllers(True)
+
+            # Handle the signals received meanwhile.
+            self.controllers(True)
+            if self.sleep_override:
+                return
+            self.sleepcnt = time.time() - started
@@ -0,0 +1,323 @@
+# Copyright (C) 2015 Okami, okami@fuzetsu.info
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import asyncio
+import concurrent.futures
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from .. import defs, execute, rollmgr
+from ..rolllog import LOG
+
+
+class EventLoopMixin(object):
+    '''
+    asyncio event loop processing.  The zone timers of the soon queue,
+    the commands run by the zones and the control socket are all
+    handled by a single loop, which sleeps until one of them is ready.
+
+    The zones and the commands are handled by threads holding the
+    rollzones() lock, as the rollover phases are not coroutines: the
+    lock is released while a zone waits for its zonesigner or rndc,
+    which the loop runs, so the other zones go on meanwhile.  The
+    read-only commands are served while zones are being signed; the
+    other commands close and unlock the rollrec file, so they wait
+    for the end of the running tick.
+    '''
+    LOOP = None  # Event loop, when it's running.
+
+    loop_wakeup = None  # Event waking up the zone timers.
+    loop_workers = None  # Threads running the zones and the commands.
+    loop_readers = None  # Threads running the read-only commands.
+    loop_ticklock = None  # Lock held by the running tick and commands.
+    loop_halt = False  # Stop once the running tick is done.
+
+    def event_loop(self):
+        '''
+        Rollover event handler -- event loop.
+        '''
+        self.queue_sooners = []
+        self.queue_eventtimes = {}
+        self.queue_soonend = 0
+
+        self.LOOP = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.LOOP)
+        self.signlock = threading.Lock()
+        self.loop_ticklock = threading.Lock()
+        self.loop_wakeup = asyncio.Event()
+        self.loop_workers = concurrent.futures.ThreadPoolExecutor(2)
+        if self.control_clients:
+            self.loop_readers = concurrent.futures.ThreadPoolExecutor(
+                self.control_clients)
+
+        # The signals are handled by the loop, between the callbacks.
+        self.LOOP.add_signal_handler(signal.SIGINT, self.loop_stop)
+        self.LOOP.add_signal_handler(signal.SIGHUP, self.loop_wakeup.set)
+
+        self.LOOP.run_until_complete(asyncio.start_server(
+            self.loop_client, sock=self.SOCK, limit=rollmgr.FRAME_LIMIT))
+        try:
+            self.LOOP.run_until_complete(self.loop_zones())
+        finally:
+            # Stop waiting for the running commands, so the zones'
+            # threads end.  The commands themselves are left running.
+            tasks = asyncio.all_tasks(self.LOOP)
+            for task in tasks:
+                task.cancel()
+            self.LOOP.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True))
+            self.loop_workers.shutdown(wait=False)
+            if self.loop_readers:
+                self.loop_readers.shutdown(wait=False)
+        self.halt_handler()
+
+    def loop_stop(self):
+        '''
+        Stop the event loop once the running tick is done, so the zones
+        being handled aren't interrupted.
+        '''
+        self.rolllog_log(LOG.INFO, '', 'received immediate shutdown command')
+        self.loop_halt = True
+        self.loop_wakeup.set()
+
+    async def loop_zones(self):
+        '''
+        Handle the due zones, then sleep until the next zone event,
+        for $sleeptime seconds at most or until we're woken up by
+        a command or a signal.  Returns once we're told to stop.
+        '''
+        while not self.loop_halt:
+            await self.LOOP.run_in_executor(self.loop_workers, self.loop_tick)
+
+            # We'll stop now if we're only running the queue once.
+            if self.singlerun:
+                self.rolllog_log(
+                    LOG.INFO, '',
+                    'rollover manager shutting down at end of single-run '
+                    'execution')
+                break
+            if self.loop_halt:
+                break
+
+            self.loop_wakeup.clear()
+            naptime = self.queue_naptime()
+            self.rolllog_log(
+                LOG.TMI, '', 'sleeping for %s seconds' % naptime)
+            try:
+                await asyncio.wait_for(self.loop_wakeup.wait(), naptime)
+            except asyncio.TimeoutError:
+                pass
+
+    def loop_tick(self):
+        '''
+        Rebuild the soon queue if the rollrec file has changed, otherwise
+        handle the zones whose events are due.
+        '''
+        with self.loop_ticklock, self.signlock:
+            os.chdir(self.xqtdir)
+            self.stats_begin()
+            if self.queue_stamp != self.queue_rrfstamp():
+                self.queue_runscan()
+            else:
+                self.queue_rundue()
+            self.stats_end()
+
+    async def loop_client(self, reader, writer):
+        '''
+        Serve a connection to the control socket.
+
+        @param reader: Connection's reader.
+        @type reader: asyncio.StreamReader
+        @param writer: Connection's writer.
+        @type writer: asyncio.StreamWriter
+        '''
+        async def readline():
+            try:
+                line = await reader.readuntil(rollmgr.EOL)
+                line = line[:-len(rollmgr.EOL)]
+            except asyncio.IncompleteReadError as e:
+                # The last frame may be cut off by the client's EOF.
+                line = e.partial
+            if line.endswith(b' '):
+                line = line[:-1]
+            return line.decode('utf8')
+
+        try:
+            cmd = await readline()
+            data = await readline()
+            session = cmd == defs.ROLLCMD_SESSION
+            if session:
+                writer.write(rollmgr.frames(
+                    str(defs.ROLLCMD_RC_OKAY), rollmgr.SESSION_VERSION))
+            while cmd:
+                if session:
+                    try:
+                        cmd = await asyncio.wait_for(
+                            readline(), rollmgr.SESSION_WAIT)
+                        data = await readline()
+                    except asyncio.TimeoutError:
+                        break
+                    if not cmd:
+                        break
+                self.rolllog_log(LOG.TMI, '<command>', 'cmd   - "%s"' % cmd)
+                if data:
+                    self.rolllog_log(
+                        LOG.TMI, '<command>', 'data  - "%s"' % data)
+
+                resp = []
+                if self.control_readonly(cmd):
+                    await self.LOOP.run_in_executor(
+                        self.loop_readers, self.loop_readonly, cmd, data, resp)
+                    halt = False
+                else:
+                    halt = await self.LOOP.run_in_executor(
+                        self.loop_workers, self.loop_command, cmd, data, resp)
+                for frame in rollmgr.respframes(resp, session):
+                    writer.write(frame)
+                    await writer.drain()
+                if halt:
+                    self.loop_stop()
+                    break
+                self.loop_wakeup.set()
+                if not session:
+                    break
+        except asyncio.LimitOverrunError:
+            # We can't find the next frame, so the connection is closed.
+            writer.write(rollmgr.frames(
+                str(defs.ROLLCMD_RC_BADARGS),
+                'command frame longer than %d bytes' % rollmgr.FRAME_LIMIT))
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def loop_command(self, cmd, data, resp):
+        '''
+        Run a command, keeping its response.  The command waits for the
+        running tick, as the zones' lock is released while they're signed.
+
+        @param cmd: Client's command.
+        @type cmd: str
+        @param data: Command's data.
+        @type data: str
+        @param resp: List getting the response.
+        @type resp: list
+
+        @returns: True if we're shutting down
+        @rtype: bool
+        '''
+        with self.loop_ticklock, self.signlock:
+            os.chdir(self.xqtdir)
+            self.rollmgr_keepresp(resp)
+            try:
+                self.runcmd(cmd, data)
+            except SystemExit:
+                # Leave the loop once the response is sent.
+                return True
+            finally:
+                self.rollmgr_keepresp(None)
+        return False
+
+    def loop_readonly(self, cmd, data, resp):
+        '''
+        Run a read-only command, keeping its response.  It doesn't wait
+        for the zones, see ControlMixin.
+
+        @param cmd: Client's command.
+        @type cmd: str
+        @param data: Command's data.
+        @type data: str
+        @param resp: List getting the response.
+        @type resp: list
+        '''
+        self.rollmgr_keepresp(resp)
+        try:
+            self.singlecmd(cmd, data)
+        finally:
+            self.rollmgr_keepresp(None)
+
+    def loop_execute(self, args, cwd, timeout=None):
+        '''
+        Run a command in the event loop, from a zone's thread.
+
+        @param args: Command's arguments.
+        @type args: list
+        @param cwd: Command's directory.
+        @type cwd: str
+        @param timeout: Seconds the command may run, None for no limit.
+        @type timeout: float
+
+        @returns: command's outcome
+        @rtype: execute.Result
+        '''
+        return self.loop_start(args, cwd, timeout).result()
+
+    def loop_start(self, args, cwd, timeout=None):
+        '''
+        Start a command in the event loop, from a zone's thread.
+
+        @param args: Command's arguments.
+        @type args: list
+        @param cwd: Command's directory.
+        @type cwd: str
+        @param timeout: Seconds the command may run, None for no limit.
+        @type timeout: float
+
+        @returns: command's outcome, once it's done
+        @rtype: concurrent.futures.Future
+        '''
+        return asyncio.run_coroutine_threadsafe(
+            self.loop_subprocess(args, cwd, timeout), self.LOOP)
+
+    async def loop_subprocess(self, args, cwd, timeout):
+        '''
+        Run a command, as execute.execute() does.
+        '''
+        started = time.time()
+        proc = await asyncio.create_subprocess_exec(
+            *args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, cwd=cwd, start_new_session=True)
+        output = execute.RingBuffer()
+
+        async def collect():
+            while 42:
+                data = await proc.stdout.read(execute.READ_SIZE)
+                if not data:
+                    break
+                output.write(data)
+            return await proc.wait()
+
+        task = self.LOOP.create_task(collect())
+        timedout = False
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            timedout = True
+            execute.kill(proc, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(task), execute.KILL_GRACE)
+            except asyncio.TimeoutError:
+                execute.kill(proc, signal.SIGKILL)
+        returncode = await proc.wait()
+        if not task.done():
+            # The output is kept open by a program left behind.
+            task.cancel()
+        return execute.Result(
+            args, returncode, time.time() - started, output.getvalue(),
+            output.size, timedout)
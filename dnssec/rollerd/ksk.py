@@ -23,7 +23,7 @@ from email.mime.text import MIMEText
 
 from ..defs import *
 from ..rolllog import LOG
-from ..parsers.keyrec import KeySet
+from ..parsers.keyrec import KeySetMixin
 
 
 class KSKMixin(object):
@@ -81,7 +81,7 @@ class KSKMixin(object):
             return False
 
         # Make sure we've got an actual set keyrec and keys.
-        if not isinstance(krec, KeySet):
+        if not isinstance(krec, KeySetMixin):
             self.rolllog_log(
                 LOG.ERR, rname, '"%s" keyrec is not a set keyrec' %
                 keyset)
@@ -0,0 +1,324 @@
+# Copyright (C) 2015 Okami, okami@fuzetsu.info
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import calendar
+import heapq
+import os
+import sys
+import time
+
+from .. import defs
+from ..parsers.abstract import file_stamp
+from ..parsers.keyrec import KeySetMixin
+from ..parsers.rollrec import KEYREC_CACHE
+from ..rolllog import LOG
+
+
+class QueueMixin(object):
+    '''
+    "Soon" queue processing.  The zones with a rollover event before
+    the end of the current "soon" period (QUEUE_SOONLIMIT seconds) are
+    kept in a heap ordered by the event time, and only the zones whose
+    events are due are handled.  A fake QUEUE_RUNSCAN entry at the end
+    of the period triggers a full scan of the rollrec file, which builds
+    the next period's queue.
+    '''
+    queue_stamp = None  # Rollrec file stamp after our last change.
+
+    def queue_soon_event_loop(self):
+        '''
+        Rollover event handler -- soon queue.
+        The rollrec file is scanned once per "soon" period, or when it
+        was changed by a command or by someone else.  Between scans,
+        we sleep until the next event is due (or for $sleeptime seconds
+        at most, to notice the changes).
+        '''
+        self.queue_sooners = []
+        self.queue_eventtimes = {}
+        self.queue_soonend = 0
+
+        while 42:
+            # Turn off signal handlers so they don't interrupt us
+            # while we're running the queue.
+            self.controllers(False)
+            self.sleep_override = False
+
+            # Return to our execution directory.
+            os.chdir(self.xqtdir)
+
+            # Rebuild the queue if the rollrec file has changed behind
+            # our back, otherwise handle the zones whose events are due.
+            self.stats_begin()
+            if self.queue_stamp != self.queue_rrfstamp():
+                self.queue_runscan()
+            else:
+                self.queue_rundue()
+            self.stats_end()
+
+            # Check for user commands.
+            self.commander(0)
+
+            # We'll stop now if we're only running the queue once.
+            if self.singlerun:
+                self.rolllog_log(
+                    LOG.INFO, '',
+                    'rollover manager shutting down at end of single-run '
+                    'execution')
+                self.halt_handler()
+                sys.exit(0)
+
+            # Turn on our signal handlers and then take a nap.
+            self.controllers(True)
+            self.sleeper(self.queue_naptime())
+
+    def queue_rrfstamp(self):
+        '''
+        @returns: current stamp of the rollrec file
+        @rtype: tuple
+        '''
+        try:
+            return file_stamp(self.rollrecfile)
+        except OSError:
+            return None
+
+    def queue_naptime(self):
+        '''
+        @returns: seconds until the next queued event, at most $sleeptime
+        @rtype: int
+        '''
+        if not self.queue_sooners:
+            return self.sleeptime
+        left = int(self.queue_sooners[0][0] - time.time()) + 1
+        return max(0, min(left, self.sleeptime))
+
+    def queue_push(self, rname, eventtime):
+        '''
+        Put a zone on the soon queue.  A zone is queued once: an older
+        entry is left in the heap and skipped when it is popped.
+
+        @param rname: Name of rollrec rec.
+        @type rname: str
+        @param eventtime: GMT of the zone's next event.
+        @type eventtime: int
+        '''
+        if eventtime > self.queue_soonend and rname != defs.QUEUE_RUNSCAN:
+            self.queue_eventtimes.pop(rname, None)
+            return
+        self.queue_eventtimes[rname] = eventtime
+        heapq.heappush(self.queue_sooners, (eventtime, rname))
+
+    def queue_runscan(self):
+        '''
+        Full scan of the rollrec file: handle the zones with due events
+        and build the soon queue for the next QUEUE_SOONLIMIT seconds.
+        '''
+        if not self.rrfchk():
+            self.queue_stamp = None
+            return
+
+        kronos = time.time()
+        self.queue_sooners = []
+        self.queue_eventtimes = {}
+        self.queue_soonend = int(kronos) + defs.QUEUE_SOONLIMIT
+        self.queue_push(defs.QUEUE_RUNSCAN, self.queue_soonend)
+
+        self.stats_rollrec_lock()
+        if self.stats_rollrec_read():
+            KEYREC_CACHE.clear()
+            self.status_load()
+            self.queue_scanskips = 0
+            due = []
+            rnames = self.rollrec_names()
+            for rname in rnames:
+                eventtime = self.queue_eventtime(rname)
+                if eventtime is None:
+                    self.queue_scanskips += 1
+                elif eventtime <= kronos:
+                    due.append(rname)
+                else:
+                    self.queue_push(rname, eventtime)
+            # The due zones are counted by rollzones().
+            self.stats_add('scanned', len(rnames) - len(due))
+            self.stats_add('skipped', self.queue_scanskips)
+            self.queue_rollzones(due)
+            self.rollrec_close()
+        self.rollrec_unlock()
+        self.loglevel = self.rolllog_level(self.loglevel_save, False)
+
+        self.queue_lastscan = kronos
+        self.queue_scantime = time.time() - kronos
+        self.queue_stamp = self.queue_rrfstamp()
+        self.rolllog_log(
+            LOG.TMI, '<timer>',
+            'full scan in %.2f seconds, %d zones queued, %d skipped' % (
+                self.queue_scantime, len(self.queue_eventtimes) - 1,
+                self.queue_scanskips))
+
+    def queue_rundue(self):
+        '''
+        Handle the zones on the soon queue whose events are due.
+        '''
+        kronos = time.time()
+        due = []
+        while self.queue_sooners and self.queue_sooners[0][0] <= kronos:
+            eventtime, rname = heapq.heappop(self.queue_sooners)
+            if self.queue_eventtimes.get(rname) != eventtime:
+                continue  # stale entry of a requeued zone
+            del self.queue_eventtimes[rname]
+            if rname == defs.QUEUE_RUNSCAN:
+                self.queue_runscan()
+                return
+            due.append(rname)
+        if not due:
+            return
+
+        self.stats_rollrec_lock()
+        if self.stats_rollrec_read():
+            KEYREC_CACHE.clear()
+            self.queue_rollzones(
+                [rname for rname in due if rname in self.ROLLREC])
+            self.rollrec_close()
+        self.rollrec_unlock()
+        self.loglevel = self.rolllog_level(self.loglevel_save, False)
+        self.queue_stamp = self.queue_rrfstamp()
+
+    def queue_rollzones(self, rnames):
+        '''
+        Handle the zones with a due event and queue their next events.
+        A zone which stays due is checked again after $sleeptime seconds,
+        as the full list processing would do.
+
+        @param rnames: Names of rollrec recs.
+        @type rnames: list
+        '''
+        self.rollzones(rnames)
+        os.chdir(self.xqtdir)
+        kronos = time.time()
+        for rname in rnames:
+            eventtime = self.queue_eventtime(rname)
+            if eventtime is not None:
+                if eventtime <= kronos:
+                    eventtime = int(kronos) + self.sleeptime
+                self.queue_push(rname, eventtime)
+
+    def queue_eventtime(self, rname):
+        '''
+        Get the GMT of a zone's next rollover event: the end of the current
+        rollover phase or the expiration of its current ZSK or KSK.
+        With -autosign, the zone file may be modified at any time, so
+        a zone out of rollover is checked again within $sleeptime seconds,
+        and right away once its zone file is newer than its signed zone.
+
+        @param rname: Name of rollrec rec.
+        @type rname: str
+
+        @returns: event time, or None for skip rollrecs
+        @rtype: int
+        '''
+        rrr = self.rollrec_fullrec(rname)
+        if not rrr or not rrr.is_active:
+            return None
+
+        try:
+            if 'directory' in rrr:
+                os.chdir(rrr['directory'])
+
+            # New zones are handled right away to get their phase fields.
+            if 'kskphase' not in rrr or 'zskphase' not in rrr:
+                return 0
+
+            # A zone in rollover waits for the end of the current phase,
+            # the other phases are run as soon as possible.
+            if rrr.phasetype:
+                phaseend = rrr.phaseend_date
+                if not phaseend:
+                    return 0
+                return calendar.timegm(phaseend.timetuple())
+
+            ksktime = self.queue_keyexpiry(
+                rname, rrr, 'ksk', 'kskcur', self.krollmethod)
+            zsktime = self.queue_keyexpiry(
+                rname, rrr, 'zsk', 'zskcur', self.zrollmethod)
+            eventtime = min(ksktime, zsktime)
+            if self.autosign:
+                if self.queue_zonemodified(rname, rrr):
+                    return 0
+                eventtime = min(eventtime, int(time.time()) + self.sleeptime)
+            return eventtime
+        except (OSError, KeyError, ValueError, AttributeError) as e:
+            # Let the usual processing report the problem, later.
+            self.rolllog_log(
+                LOG.TMI, rname, 'unable to get the next event time: %s' % e)
+            return int(time.time()) + defs.QUEUE_ERRTIME
+        finally:
+            os.chdir(self.xqtdir)
+
+    def queue_zonemodified(self, rname, rrr):
+        '''
+        Check a zone file against its signed version, as zonemodified()
+        does.
+
+        @param rname: Name of rollrec rec.
+        @type rname: str
+        @param rrr: Reference to rollrec.
+        @type rrr: Roll
+
+        @returns: the zone file is newer than the signed zone file
+        @rtype: bool
+        '''
+        keyrec = rrr.keyrec()
+        if not keyrec:
+            return False
+        zone = keyrec[rname]
+        return (
+            os.stat(zone.zonefile_path).st_mtime >
+            os.stat(zone.signedzone_path).st_mtime)
+
+    def queue_keyexpiry(self, rname, rrr, keytype, keyset, rollmethod):
+        '''
+        Expiration time of a zone's signing set, as calculated by
+        ksk_expired() and zsk_expired().
+
+        @param rname: Name of rollrec rec.
+        @type rname: str
+        @param rrr: Reference to rollrec.
+        @type rrr: Roll
+        @param keytype: Key type ("ksk" or "zsk").
+        @type keytype: str
+        @param keyset: Signing set ("kskcur" or "zskcur").
+        @type keyset: str
+        @param rollmethod: Rollover calculation to use.
+        @type rollmethod: int
+
+        @returns: expiration time
+        @rtype: int
+        '''
+        keyrec = rrr.keyrec()
+        if not keyrec:
+            return 0
+        krec = getattr(keyrec[rname], keyset)
+        if not isinstance(krec, KeySetMixin) or not krec.keys:
+            return 0
+        minhr = krec.minlife_key()
+        if rollmethod == defs.RM_ENDROLL:
+            starter = int(rrr.get('%s_rollsecs' % keytype, 0))
+        elif rollmethod == defs.RM_KEYGEN:
+            starter = int(minhr.get('keyrec_gensecs', 0))
+        else:
+            return sys.maxsize
+        if starter == 0:
+            return 0
+        return starter + minhr.life
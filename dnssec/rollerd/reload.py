@@ -0,0 +1,139 @@
+# Copyright (C) 2015 Okami, okami@fuzetsu.info
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import collections
+import shlex
+import time
+
+from .. import execute
+from ..rolllog import LOG
+
+
+class ReloadMixin(object):
+    '''
+    Batched zone reloads.  The zones to reload are queued by loadzone()
+    during a pass, once per zone, and reloaded at the end of the pass
+    or when the oldest one has waited for $reload_window seconds.
+    Up to $reload_jobs rndc commands are run at the same time, by the
+    event loop if it's running, without the zones' lock.
+    '''
+    reload_batch = False  # Queue the zone reloads.
+    reload_jobs = 4  # Number of rndc commands run at once.
+    reload_window = 60  # Seconds a reload may be delayed.
+
+    reload_queue = None  # Queued reloads, by zone and rndc options.
+    reload_since = 0  # Time of the oldest queued reload.
+
+    def reload_add(self, rname, zone, rndcopts, phase):
+        '''
+        Queue a zone reload.
+
+        @param rname: Rollrec name of zone.
+        @type rname: str
+        @param zone: Zone name.
+        @type zone: str
+        @param rndcopts: Options for rndc.
+        @type rndcopts: str
+        @param phase: Zone's current phase.
+        @type phase: str
+        '''
+        if not self.reload_queue:
+            self.reload_queue = collections.OrderedDict()
+            self.reload_since = time.time()
+        key = (zone, rndcopts)
+        if key in self.reload_queue:
+            self.rolllog_log(
+                LOG.TMI, rname, 'zone reload for %s already queued' % phase)
+            self.reload_queue[key][1].append(phase)
+        else:
+            self.reload_queue[key] = (rname, [phase])
+
+    def reload_check(self):
+        '''
+        Reload the queued zones if the oldest one has waited too long.
+        '''
+        if (self.reload_queue and
+                time.time() - self.reload_since >= self.reload_window):
+            self.reload_flush()
+
+    def reload_flush(self):
+        '''
+        Reload the queued zones.
+
+        @returns: reload success, by rollrec name
+        @rtype: dict
+        '''
+        queue, self.reload_queue = self.reload_queue, None
+        results = {}
+        if not queue:
+            return results
+
+        running = collections.deque()
+        for (zone, rndcopts), (rname, phases) in queue.items():
+            if len(running) >= self.reload_jobs:
+                self.reload_wait(running.popleft(), results)
+            cmd = '%s %s reload %s' % (self.rndc, rndcopts, zone)
+            running.append(
+                (rname, phases, self.reload_start(shlex.split(cmd))))
+        while running:
+            self.reload_wait(running.popleft(), results)
+        return results
+
+    def reload_start(self, args):
+        '''
+        Start an rndc command.
+
+        @param args: Command's arguments.
+        @type args: list
+
+        @returns: function waiting for the command's outcome
+        @rtype: function
+        '''
+        if self.LOOP and self.LOOP.is_running():
+            return self.loop_start(args, None, self.rndc_timeout).result
+        started = time.time()
+        p = execute.start(args)
+        return lambda: execute.collect(p, self.rndc_timeout, started=started)
+
+    def reload_wait(self, job, results):
+        '''
+        Wait for a zone reload and report its result.
+
+        @param job: Rollrec name, phases and function waiting for rndc.
+        @type job: tuple
+        @param results: Reload success, by rollrec name.
+        @type results: dict
+        '''
+        rname, phases, wait = job
+        if self.LOOP and self.LOOP.is_running():
+            # The zones' lock is held by the event loop's tick or command.
+            result = self.runner_unlocked(wait)
+        else:
+            result = wait()
+        results[rname] = result.returncode == 0
+        if results[rname]:
+            self.rolllog_log(
+                LOG.INFO, rname, 'zone reloaded for %s' % ', '.join(phases))
+        else:
+            self.rolllog_log(
+                LOG.ERR, rname, 'unable to reload zone for %s' %
+                ', '.join(phases))
+            if result.timedout:
+                self.rolllog_log(
+                    LOG.ERR, rname, 'rndc killed after %d seconds' %
+                    self.rndc_timeout)
+            self.rolllog_log(
+                LOG.ERR, rname, 'error output - "%s"' % result.output)
@@ -0,0 +1,204 @@
+# Copyright (C) 2015 Okami, okami@fuzetsu.info
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import marshal
+import os
+import threading
+import zlib
+
+from ..parsers.rollrec import MAXTTL_CACHE
+from ..rolllog import LOG
+
+
+class ShardMixin(object):
+    '''
+    Zone sharding.  The zones of a pass are split between $shards worker
+    processes, forked by rollzones() for the pass.  A worker handles the
+    zones of its shard with its own lock file and doesn't write the
+    rollrec file: the records it has changed are sent back to us as
+    soon as each zone is done (then its pass counters, at the end), and
+    we write them in the rollrec file with the rest of the pass.  The
+    records sent by a failed worker are still kept.
+
+    The zones are sharded on their keyrec file, so the zones which
+    share a keyrec file are handled by the same worker.
+    '''
+    shards = 1  # Number of worker processes.
+    shard = None  # Our shard number, in a worker.
+    shard_out = None  # Pipe to the supervisor, in a worker.
+    shard_sent = None  # Records last sent to the supervisor, by name.
+
+    def shard_of(self, rname):
+        '''
+        @param rname: Name of rollrec rec.
+        @type rname: str
+
+        @returns: shard handling the zone
+        @rtype: int
+        '''
+        rrr = self.rollrec_fullrec(rname)
+        key = rrr.get('keyrec') or rname
+        return zlib.crc32(key.encode('utf8')) % self.shards
+
+    def rollzones_sharded(self, rnames):
+        '''
+        Handle a list of zones with $shards worker processes, and merge
+        their changes in our rollrec.
+
+        @param rnames: Names of rollrec recs.
+        @type rnames: list
+        '''
+        slices = [[] for i in range(self.shards)]
+        for rname in rnames:
+            slices[self.shard_of(rname)].append(rname)
+
+        workers = []
+        for shard, names in enumerate(slices):
+            if not names:
+                continue
+            r, w = os.pipe()
+            pid = os.fork()
+            if not pid:
+                os.close(r)
+                self.shard_worker(shard, names, w)
+            os.close(w)
+            workers.append((shard, pid, r))
+
+        # Read the results in turn: a worker blocked on a full pipe
+        # simply waits for us.
+        for shard, pid, r in workers:
+            done = False
+            with os.fdopen(r, 'rb') as f:
+                while not done:
+                    try:
+                        record = marshal.load(f)
+                    except (EOFError, ValueError, TypeError):
+                        break
+                    if record[0] == 'roll':
+                        self.shard_merge([record[1:]])
+                        continue
+                    maxttls, counters, acted = record[1:]
+                    MAXTTL_CACHE.update(maxttls)
+                    for counter, value in counters.items():
+                        self.stats_add(counter, value)
+                    for rname in acted:
+                        self.stats_zone(rname)
+                    done = True
+            pid, status = os.waitpid(pid, 0)
+            if not done:
+                self.rolllog_log(
+                    LOG.ERR, '', 'shard %d worker failed (status %d)' %
+                    (shard, status))
+        os.chdir(self.xqtdir)
+
+    def shard_worker(self, shard, rnames, w):
+        '''
+        Handle the zones of a shard in a worker process, and send the
+        changed rollrec records through a pipe, one marshal record per
+        zone.  Never returns.
+
+        @param shard: Shard number.
+        @type shard: int
+        @param rnames: Names of rollrec recs.
+        @type rnames: list
+        @param w: Pipe's write end.
+        @type w: int
+        '''
+        status = 1
+        try:
+            # The lock file descriptor is shared with the supervisor.
+            self.shard = shard
+            self.RRLOCK = None
+            self.lockfile = '%s.shard%d' % (
+                self.lockfile or '/run/dnssec-tools/rollrec.lock', shard)
+            self.readonly = True
+            # The status lock may have been held by a reader thread.
+            self.status_lock = threading.Lock()
+            self.stats_mutex = threading.Lock()
+            self.stats_begin()
+
+            self.shard_sent = dict(
+                (rname, self.shard_record(rname)) for rname in rnames)
+            self.shard_out = os.fdopen(w, 'wb')
+            self.rollrec_lock()
+            self.rollzones(rnames)
+            self.rollrec_unlock()
+
+            # The zones changed once they were reported, e.g. by the
+            # coalesced signings.
+            for rname in rnames:
+                self.shard_report(rname)
+            # Our share of the pass' counters.
+            counters = dict(
+                (counter, self.stats_pass[counter])
+                for counter in ('skipped', 'signings', 'signtime'))
+            acted = sorted(self.stats_acted)
+            marshal.dump(('end', MAXTTL_CACHE, counters, acted), self.shard_out)
+            self.shard_out.close()
+            status = 0
+        except BaseException as e:
+            self.rolllog_log(
+                LOG.ERR, '', 'shard %d worker failed:  %s' % (shard, e))
+        finally:
+            os._exit(status)
+
+    def shard_report(self, rname):
+        '''
+        Send a zone's rollrec record to the supervisor if it has changed
+        since it was last sent.  Does nothing outside of a worker.
+
+        @param rname: Name of rollrec rec.
+        @type rname: str
+        '''
+        if self.shard_out is None:
+            return
+        record = self.shard_record(rname)
+        if record != self.shard_sent.get(rname):
+            self.shard_sent[rname] = record
+            marshal.dump(('roll', rname) + record, self.shard_out)
+            self.shard_out.flush()
+
+    def shard_record(self, rname):
+        '''
+        @param rname: Name of rollrec rec.
+        @type rname: str
+
+        @returns: rollrec type and fields
+        @rtype: tuple
+        '''
+        rrr = self.rollrec_fullrec(rname)
+        return rrr.is_active, tuple(rrr.items())
+
+    def shard_merge(self, rolls):
+        '''
+        Apply the rollrec records changed by a worker.
+
+        @param rolls: Records, as (name, is_active, fields).
+        @type rolls: list
+        '''
+        for rname, is_active, fields in rolls:
+            rrr = self.ROLLREC.get(rname)
+            if rrr is None:
+                continue
+            if rrr.is_active != is_active:
+                rrr.is_active = is_active
+            keys = set(key for key, value in fields)
+            for key in [key for key in rrr if key not in keys]:
+                del rrr[key]
+            for key, value in fields:
+                if rrr.get(key) != value:
+                    rrr[key] = value
+            self.status_zone(rname)
@@ -0,0 +1,130 @@
+# Copyright (C) 2015 Okami, okami@fuzetsu.info
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import collections
+import threading
+import time
+
+
+STATS_PASSES = 32  # Passes kept in the ring of recent passes.
+
+# Counters of a pass, the times are in seconds.
+PassStats = collections.namedtuple('PassStats', (
+    'started',  # GMT of the pass' start.
+    'elapsed',  # Length of the pass.
+    'scanned',  # Zones checked.
+    'skipped',  # Skip zones, left alone.
+    'acted',  # Zones moved to another phase or signed.
+    'signings',  # Signer invocations.
+    'signtime',  # Time spent signing.
+    'rrreadtime',  # Time spent reading the rollrec file.
+    'waittime',  # Time waited since the previous pass.
+    'locktime',  # Time waited for the rollrec lock.
+))
+
+
+class StatsMixin(object):
+    '''
+    Introspection counters of the event loops.  Each pass counts its
+    zones, signings and the time spent in them, then is kept in a ring
+    of the STATS_PASSES recent passes for the queuestatus command.
+
+    The counters of the running pass are changed by the zones' threads,
+    under $stats_mutex.  Outside of a pass (e.g. a signzone command),
+    nothing is counted.
+    '''
+    stats_pass = None  # Counters of the running pass.
+    stats_acted = None  # Names of the zones acted on by the running pass.
+    stats_lastend = None  # time.time() at the end of the previous pass.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_mutex = threading.Lock()  # Held while the counters change.
+        self.stats_passes = collections.deque(maxlen=STATS_PASSES)
+
+    def stats_begin(self):
+        '''
+        Start counting a pass.
+        '''
+        now = time.time()
+        with self.stats_mutex:
+            self.stats_pass = dict.fromkeys(PassStats._fields, 0)
+            self.stats_pass['started'] = now
+            if self.stats_lastend is not None:
+                self.stats_pass['waittime'] = now - self.stats_lastend
+            self.stats_acted = set()
+
+    def stats_end(self):
+        '''
+        Put the pass' counters in the ring, unless the pass had nothing
+        to check.
+        '''
+        now = time.time()
+        with self.stats_mutex:
+            counters = self.stats_pass
+            if counters is None:
+                return
+            counters['elapsed'] = now - counters['started']
+            counters['acted'] = len(self.stats_acted)
+            self.stats_pass = self.stats_acted = None
+            if counters['scanned'] or counters['signings']:
+                self.stats_passes.append(PassStats(**counters))
+                self.stats_lastend = now
+
+    def stats_add(self, counter, value=1):
+        '''
+        Add to a counter of the running pass.
+
+        @param counter: PassStats field.
+        @type counter: str
+        @param value: Count or seconds.
+        @type value: int or float
+        '''
+        with self.stats_mutex:
+            if self.stats_pass is not None:
+                self.stats_pass[counter] += value
+
+    def stats_zone(self, rname):
+        '''
+        Count a zone as acted on by the running pass.
+
+        @param rname: Name of rollrec rec.
+        @type rname: str
+        '''
+        with self.stats_mutex:
+            if self.stats_acted is not None:
+                self.stats_acted.add(rname)
+
+    def stats_rollrec_lock(self):
+        '''
+        Lock the rollrec file, counting the time waited.
+        '''
+        started = time.time()
+        self.rollrec_lock()
+        self.stats_add('locktime', time.time() - started)
+
+    def stats_rollrec_read(self):
+        '''
+        Read the rollrec file, counting the time spent.
+
+        @returns: status
+        @rtype: bool
+        '''
+        started = time.time()
+        try:
+            return self.rollrec_read()
+        finally:
+            self.stats_add('rrreadtime', time.time() - started)
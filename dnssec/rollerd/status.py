@@ -0,0 +1,135 @@
+# Copyright (C) 2015 Okami, okami@fuzetsu.info
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import collections
+import threading
+
+
+# Status of a zone, as given by the zonestatus command.
+ZoneStatus = collections.namedtuple('ZoneStatus', (
+    'name', 'zonename', 'rollrec_type', 'kskphase', 'zskphase',
+    'phase_description', 'is_active'))
+
+# Zones' status at a given version, in the rollrec file order.
+StatusTable = collections.namedtuple('StatusTable', ('version', 'zones'))
+
+
+class StatusMixin(object):
+    '''
+    In-memory status of the zones, for the read-only commands.
+
+    The daemon loads all the entries when it scans the whole rollrec
+    file (at startup, on the soon queue's scans and the full list's
+    passes), and refreshes a zone's entry after each phase transition
+    and once the zone has been handled, so the passes which only handle
+    a few zones don't parse the other records of a lazy rollrec.  Each
+    change bumps the entries' version.  The readers get an immutable
+    table of the entries, built again once they have changed, so they
+    neither wait for the rollrec lock nor read the rollrec file.
+    '''
+    status_version = 0  # Version of the entries.
+    status_loaded = False  # The entries have been loaded.
+    status_snap = None  # Table of the entries for the readers.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.status_lock = threading.Lock()  # Held while the entries change.
+        self.status_zones = {}  # Zones' status by name, in file order.
+
+    def status_load(self):
+        '''
+        Load the entries of all the zones from the rollrec file.
+        '''
+        rollrec = self.ROLLREC
+        if rollrec is None:
+            return
+        zones = {}
+        for rname, rrr in rollrec.rolls(active_only=False):
+            if rname != 'info rollrec':
+                zones[rname] = self.status_entry(rname, rrr)
+        with self.status_lock:
+            self.status_zones = zones
+            self.status_loaded = True
+            self.status_version += 1
+
+    def status_zone(self, rname):
+        '''
+        Refresh a zone's entry from its rollrec.  A zone added since
+        the entries were loaded is put last, until they're loaded again.
+
+        @param rname: Name of rollrec rec.
+        @type rname: str
+        '''
+        if self.ROLLREC is None or not self.status_loaded:
+            return
+        rrr = self.ROLLREC.get(rname)
+        if rrr is None:
+            return
+        entry = self.status_entry(rname, rrr)
+        with self.status_lock:
+            if self.status_zones.get(rname) != entry:
+                self.status_zones[rname] = entry
+                self.status_version += 1
+
+    def status_entry(self, rname, rrr):
+        '''
+        @param rname: Name of rollrec rec.
+        @type rname: str
+        @param rrr: Rollrec reference.
+        @type rrr: Roll
+
+        @returns: zone's status
+        @rtype: ZoneStatus
+        '''
+        # The phases are only added by the zone's first pass.
+        try:
+            kskphase, zskphase = rrr.kskphase, rrr.zskphase
+            pstr = rrr.phase_description
+        except (KeyError, ValueError):
+            kskphase, zskphase, pstr = 0, 0, None
+        return ZoneStatus(
+            rname, rrr.get('zonename'), rrr.rollrec_type, kskphase, zskphase,
+            pstr, rrr.is_active)
+
+    def status_of(self, rname):
+        '''
+        @param rname: Name of rollrec rec.
+        @type rname: str
+
+        @returns: zone's status, None for an unknown zone
+        @rtype: ZoneStatus
+        '''
+        return self.status_zones.get(rname)
+
+    def status_table(self):
+        '''
+        Get the zones' status for the read-only commands.
+
+        @returns: zones' status, None until the entries are loaded
+        @rtype: StatusTable
+        '''
+        snap = self.status_snap
+        if snap is None or snap.version != self.status_version:
+            with self.status_lock:
+                if not self.status_loaded:
+                    return None
+                snap = self.status_snap
+                if snap is None or snap.version != self.status_version:
+                    snap = StatusTable(
+                        self.status_version,
+                        tuple(self.status_zones.values()))
+                    self.status_snap = snap
+        return snap
@@ -20,7 +20,7 @@ import time
 
 from ..defs import *
 from ..rolllog import LOG
-from ..parsers.keyrec import KeySet
+from ..parsers.keyrec import KeySetMixin
 
 
 class ZSKMixin(object):
@@ -77,7 +77,7 @@ class ZSKMixin(object):
             return False
 
         # Make sure we've got an actual set keyrec and keys.
-        if not isinstance(krec, KeySet):
+        if not isinstance(krec, KeySetMixin):
             self.rolllog_log(
                 LOG.ERR, rname, '"%s"\'s keyrec is not a set keyrec' %
                 keyset)
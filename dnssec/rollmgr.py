@@ -16,8 +16,12 @@
 
 
 import fcntl
+import collections
 import os
 import socket
+import threading
+
+from . import defs
 
 
 # Type of channel we're using.
@@ -42,9 +46,151 @@ EOL = b'\r\n'  # Net-standard end-of-line.
 CHANNEL_WAIT = False
 CHANNEL_CLOSE = True
 
+READ_SIZE = 1 << 16  # Bytes read from the socket at once.
+FRAME_LIMIT = 1 << 24  # Longest frame read by the event loop.
+
+# Responses kept by the threads running commands, see rollmgr_keepresp().
+RESPONSES = threading.local()
+
+# A session carries many commands and their responses over one
+# connection.  It's opened by a ROLLCMD_SESSION command, answered with
+# ROLLCMD_RC_OKAY and SESSION_VERSION by the rollerds knowing about it.
+SESSION_VERSION = '1'  # Version of the session protocol.
+SESSION_WINDOW = 64  # Commands sent ahead of their responses.
+SESSION_WAIT = 30  # Seconds rollerd waits for the next command.
+
+
+def frames(*texts):
+    '''
+    @returns: texts as frames of the command socket
+    @rtype: bytes
+    '''
+    return b''.join(text.encode('utf8') + b' ' + EOL for text in texts)
+
+
+def respframes(resp, session=False):
+    '''
+    Encode the responses kept by rollmgr_sendresp() and
+    rollmgr_sendstream(), a streamed response as it is generated.
+    A command of a session is answered once, unless it streamed its
+    response: the messages are joined, with the first error code,
+    and commands which didn't answer get an empty ROLLCMD_RC_OKAY.
+
+    @param resp: List of (retcode, respmsg) and of streams.
+    @type resp: list
+    @param session: Command is part of a session.
+    @type session: bool
+
+    @returns: iterator of response frames
+    @rtype: iterator
+    '''
+    if session and all(type(r) is tuple for r in resp):
+        retcode = next(
+            (r for r, m in resp if r != defs.ROLLCMD_RC_OKAY),
+            defs.ROLLCMD_RC_OKAY)
+        resp = [(retcode, '\n'.join(m for r, m in resp))]
+    for r in resp:
+        if type(r) is tuple:
+            yield frames(str(r[0]), r[1])
+        else:
+            for retcode, respmsg in r:
+                yield frames(str(retcode), respmsg)
+
+
+class FrameReader(object):
+    '''
+    Buffered reader of the frames of the command socket.  A frame is
+    a line of text followed by " " and EOL.  The socket is read in
+    READ_SIZE chunks, and only the bytes received since the last read
+    are searched for the EOL.
+    '''
+    def __init__(self, sock, size=READ_SIZE):
+        self.sock = sock
+        self._buf = bytearray()
+        self._pos = 0  # Start of the next frame in the buffer.
+        self._chunk = bytearray(size)
+        self._view = memoryview(self._chunk)
+
+    def readframe(self):
+        '''
+        Read a frame.  A truncated frame is returned as is when the
+        peer closes the connection.
+
+        @returns: frame, without the trailing " " and EOL
+        @rtype: bytes
+        '''
+        scanned = self._pos
+        while 42:
+            i = self._buf.find(EOL, scanned)
+            if i >= 0:
+                frame = bytes(self._buf[self._pos:i])
+                self._pos = i + len(EOL)
+                if frame.endswith(b' '):
+                    frame = frame[:-1]
+                return frame
+            scanned = max(self._pos, len(self._buf) - len(EOL) + 1)
+
+            # Drop the frames already read before growing the buffer.
+            if self._pos:
+                del self._buf[:self._pos]
+                scanned -= self._pos
+                self._pos = 0
+            n = self.sock.recv_into(self._chunk)
+            if not n:
+                frame = bytes(self._buf)
+                self._buf.clear()
+                return frame
+            self._buf += self._view[:n]
+
+
+class Connection(object):
+    '''
+    A client's connection to the command socket, served on its own.
+    '''
+    def __init__(self, sock, frames=None):
+        self.sock = sock
+        self.frames = frames or FrameReader(sock)
+
+    def getcmd(self, waiter=5):
+        '''
+        Read the client's command and its data.
+
+        @param waiter: Time to wait for them.
+        @type waiter: int
+
+        @returns: command and data, empty on timeout
+        @rtype: tuple
+        '''
+        self.sock.settimeout(waiter)
+        try:
+            cmd = self.frames.readframe()
+            data = self.frames.readframe()
+        except (socket.timeout, OSError):
+            return '', ''
+        return cmd.decode('utf8'), data.decode('utf8')
+
+    def sendresp(self, resp, session=False):
+        '''
+        Send the responses to the client, ignoring a client gone away.
+
+        @param resp: Responses, as kept by rollmgr_sendresp().
+        @type resp: list
+        @param session: Command is part of a session, see respframes().
+        @type session: bool
+        '''
+        try:
+            for frame in respframes(resp, session):
+                self.sock.sendall(frame)
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.close()
+
 
 class RollMgrMixin(object):
     CLNTSOCK = None
+    CLNTFRAMES = None  # Frame reader of CLNTSOCK.
     SOCK = None
 
     queuedcmds = []
@@ -186,21 +332,11 @@ class RollMgrMixin(object):
                 # Nothing to do now for Unix-domain sockets.
                 pass
 
-            # Get the command and data, and lop off the trailing goo.
-            def clntsock():
-                data = b''
-                buf = b'  '  # 2-byted buf
-                while buf != EOL:
-                    s = self.CLNTSOCK.recv(1)
-                    if not s:
-                        break
-                    buf += s  # push byte into buf
-                    data += s  # and into stored data
-                    buf = buf[-2:]  # truncate to last 2 bytes
-                return data
-            cmd = clntsock()[:-3]
-            data = clntsock()[:-3]
-        except socket.timeout:
+            # Get the command and data, without the trailing goo.
+            frames = self.rollmgr_frames()
+            cmd = frames.readframe()
+            data = frames.readframe()
+        except (socket.timeout, BlockingIOError):
             pass
 
         # Close the remote socket and return the client's data.
@@ -223,12 +359,7 @@ class RollMgrMixin(object):
             return False
 
         # Send the command and data.
-        self.CLNTSOCK.sendall(cmd.encode('utf8'))
-        self.CLNTSOCK.sendall(b' ' + EOL)
-        if data:
-            self.CLNTSOCK.sendall(data.encode('utf8'))
-        self.CLNTSOCK.sendall(b' ' + EOL)
-        # self.CLNTSOCK.flush()
+        self.CLNTSOCK.sendall(frames(cmd, data or ''))
 
         # Select the previous file handle once more.
         # select($oldsel);
@@ -257,32 +388,175 @@ class RollMgrMixin(object):
         self.CLNTSOCK.settimeout(waiter)
         try:
             # Get the response code and message from rollerd.
-            def clntsock():
-                data = b''
-                buf = b'  '  # 2-byted buf
-                while buf != EOL:
-                    s = self.CLNTSOCK.recv(1)
-                    if not s:
-                        break
-                    buf += s  # push byte into buf
-                    data += s  # and into stored data
-                    buf = buf[-2:]  # truncate to last 2 bytes
-                return data
-            retcode = clntsock()[:-3]
-            respbuf = clntsock()[:-3]
+            frames = self.rollmgr_frames()
+            retcode = frames.readframe()
+            respbuf = frames.readframe()
             return int(retcode), respbuf.decode('utf8')
         except socket.timeout:
             return None, None
 
+    def rollmgr_getstream(self):
+        '''
+        Routine: rollmgr_getstream()
+        Purpose: This routine allows a client to read a response sent
+                 in chunks by rollmgr_sendstream(), or a plain response.
+                 The final response is the last one returned.
+
+        @returns: iterator of (retcode, respmsg)
+        @rtype: iterator
+        '''
+        while 42:
+            retcode, respbuf = self.rollmgr_getresp()
+            yield retcode, respbuf
+            if retcode != defs.ROLLCMD_RC_CHUNK:
+                return
+
+    def rollmgr_session(self):
+        '''
+        Open a session with rollerd.  Older rollerds don't know about
+        them and close the connection.
+
+        @returns: the connection is kept for several commands
+        @rtype: bool
+        '''
+        if not self.rollmgr_sendcmd(
+                CHANNEL_WAIT, defs.ROLLCMD_SESSION, SESSION_VERSION):
+            return False
+        try:
+            retcode, respbuf = self.rollmgr_getresp()
+        except ValueError:
+            retcode = respbuf = None
+        if retcode == defs.ROLLCMD_RC_OKAY and respbuf == SESSION_VERSION:
+            return True
+        self.CLNTSOCK.close()
+        return False
+
+    def rollmgr_pipeline(self, cmds, window=SESSION_WINDOW):
+        '''
+        Send commands to rollerd and get their responses, in order.
+        The commands are sent through a session, $window of them ahead
+        of their responses, or one connection each if rollerd doesn't
+        know about sessions.  A command which couldn't be answered gets
+        None, as do the commands left once one couldn't be sent (or
+        answered, in a session).
+
+        @param cmds: Iterable of (command, data).
+        @type cmds: iterable
+        @param window: Commands sent before reading their responses.
+        @type window: int
+
+        @returns: iterator of (command, data, retcode, respmsg)
+        @rtype: iterator
+        '''
+        if not self.rollmgr_session():
+            failed = False
+            for cmd, data in cmds:
+                retcode = respbuf = None
+                if not failed:
+                    failed = not self.rollmgr_sendcmd(CHANNEL_WAIT, cmd, data)
+                if not failed:
+                    # A streamed response is joined.
+                    chunks = []
+                    try:
+                        for retcode, respbuf in self.rollmgr_getstream():
+                            chunks.append(respbuf)
+                    except (OSError, ValueError):
+                        retcode = None
+                    respbuf = None if retcode is None else ''.join(chunks)
+                    self.rollmgr_closechan()
+                yield cmd, data, retcode, respbuf
+            return
+
+        cmds = iter(cmds)
+        pending = collections.deque()
+        failed = False
+        try:
+            while 42:
+                # Send the next commands, then read their responses.
+                for cmd, data in cmds:
+                    pending.append((cmd, data))
+                    if len(pending) >= window:
+                        break
+                if not pending:
+                    break
+                if not failed:
+                    try:
+                        self.CLNTSOCK.sendall(b''.join(
+                            frames(cmd, data or '') for cmd, data in pending))
+                    except OSError:
+                        failed = True
+                while pending:
+                    cmd, data = pending.popleft()
+                    retcode = respbuf = None
+                    if not failed:
+                        # A streamed response is joined.
+                        chunks = []
+                        try:
+                            for retcode, respbuf in self.rollmgr_getstream():
+                                chunks.append(respbuf)
+                        except (OSError, ValueError):
+                            retcode = None
+                        failed = retcode is None
+                        respbuf = None if failed else ''.join(chunks)
+                    yield cmd, data, retcode, respbuf
+        finally:
+            self.rollmgr_closechan()
+
+    def rollmgr_frames(self):
+        '''
+        Get the frame reader of the current connection.  The frames
+        of a connection are read by a single reader, which may have
+        read ahead.
+
+        @returns: frame reader
+        @rtype: FrameReader
+        '''
+        frames = self.CLNTFRAMES
+        if frames is None or frames.sock is not self.CLNTSOCK:
+            self.CLNTFRAMES = FrameReader(self.CLNTSOCK)
+        return self.CLNTFRAMES
+
     def rollmgr_sendresp(self, retcode, respmsg):
         '''
         This routine allows rollerd to send a message to a client.
         retcode - Return code.
         respmsg - Response message.
         '''
+        # The thread running the command sends the response itself.
+        respbuf = getattr(RESPONSES, 'buf', None)
+        if respbuf is not None:
+            respbuf.append((retcode, respmsg))
+            return
+
         # Send the return code and response message.
-        self.CLNTSOCK.sendall(str(retcode).encode('utf8') + b' ' + EOL)
-        self.CLNTSOCK.sendall(respmsg.encode('utf8') + b' ' + EOL)
+        self.CLNTSOCK.sendall(frames(str(retcode), respmsg))
+
+    def rollmgr_sendstream(self, resps):
+        '''
+        This routine allows rollerd to send a response in chunks, as
+        they are generated: ROLLCMD_RC_CHUNK responses, followed by
+        the final one.  Only the clients asking for it get them.
+        resps - Iterator of (retcode, respmsg).
+        '''
+        # The thread running the command sends the response itself.
+        respbuf = getattr(RESPONSES, 'buf', None)
+        if respbuf is not None:
+            respbuf.append(resps)
+            return
+
+        for retcode, respmsg in resps:
+            self.CLNTSOCK.sendall(frames(str(retcode), respmsg))
+
+    def rollmgr_keepresp(self, respbuf):
+        '''
+        Keep the responses sent by the current thread in a list rather
+        than sending them to CLNTSOCK.
+
+        @param respbuf: List getting the responses, None to send them
+                        again.
+        @type respbuf: list
+        '''
+        RESPONSES.buf = respbuf
 
     def rollmgr_closechan(self):
         '''
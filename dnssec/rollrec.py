@@ -17,12 +17,20 @@
 import fcntl
 import os
 
-from .parsers.rollrec import RollRec
+from .parsers.abstract import file_stamp
+from .parsers.rollrec import LazyRollRec, RollRec
+from .rolllog import LOG
 
 
 class RollRecMixin(object):
     ROLLREC = None
     RRLOCK = None
+    RRCACHE = None  # last parsed rollrec, kept across rollrec_close()
+
+    compact = False  # Keep the records as compact (slotted) objects.
+    snapshot = False  # Keep a binary snapshot next to the rollrec file.
+    lazy = False  # Parse the rollrec records on first access only.
+    readonly = False  # Keep the changes in memory, don't write the file.
 
     def rollrec_lock(self):
         '''
@@ -55,10 +63,27 @@ class RollRecMixin(object):
     def rollrec_read(self):
         '''
         Read a DNSSEC-Tools rollrec file.
+        The file is parsed again only if it has been changed since
+        it was last read or written by us.
         '''
         if os.path.exists(self.rollrecfile) and os.path.isfile(self.rollrecfile):
-            self.ROLLREC = RollRec()
-            self.ROLLREC.read(self.rollrecfile)
+            rollrec = self.RRCACHE
+            if (rollrec is None or
+                    rollrec._path != self.rollrecfile or
+                    rollrec._stamp != file_stamp(self.rollrecfile)):
+                if self.lazy:
+                    rollrec = LazyRollRec()
+                    rollrec.read(self.rollrecfile, compact=self.compact)
+                    self.RRCACHE = self.ROLLREC = rollrec
+                    return True
+                rollrec = RollRec()
+                if not (self.snapshot and rollrec.read_snapshot(
+                        self.rollrecfile, compact=self.compact)):
+                    rollrec.read(self.rollrecfile, compact=self.compact)
+                    if self.snapshot:
+                        self.rollrec_snapshot(rollrec)
+                self.RRCACHE = rollrec
+            self.ROLLREC = rollrec
             return True
         else:
             return False
@@ -79,8 +104,28 @@ class RollRecMixin(object):
         We'll make a (hopefully atomic) copy of the in-core rollrec
         lines prior to trying to write.  This is an attempt to
         keep the data from being mucked with while we're using it.
+
+        Nothing is written if the rollrec hasn't been changed.
+        '''
+        if self.ROLLREC._dirty and not self.readonly:
+            self.ROLLREC.save()
+            if self.snapshot:
+                self.rollrec_snapshot(self.ROLLREC)
+
+    def rollrec_snapshot(self, rollrec):
+        '''
+        Refresh the binary snapshot of the rollrec file.  The text file
+        stays the reference, so failing to write the snapshot is only
+        logged.
+
+        @param rollrec: rollrec in sync with the file
+        @type rollrec: RollRec
         '''
-        self.ROLLREC.write(self.rollrecfile)
+        try:
+            rollrec.write_snapshot()
+        except OSError as e:
+            self.rolllog_log(
+                LOG.ERR, '', 'unable to write rollrec snapshot:  %s' % e)
 
     def rollrec_names(self):
         '''
@@ -92,10 +137,8 @@ class RollRecMixin(object):
         '''
         if not self.ROLLREC:
             return tuple()
-        rolls = filter(
-            lambda x: x[1].name != 'info rollrec',
-            self.ROLLREC.rolls(active_only=False))
-        return tuple(dict(rolls).keys())
+        return tuple(
+            rname for rname in self.ROLLREC if rname != 'info rollrec')
 
     def rollrec_fullrec(self, rname):
         '''
@@ -0,0 +1,295 @@
+# Copyright (C) 2015 Okami, okami@fuzetsu.info
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import base64
+import shlex
+import time
+
+import dns
+import dns.dnssec
+import dns.exception
+import dns.name
+import dns.rdataclass
+import dns.rdataset
+import dns.rdatatype
+import dns.rdtypes.ANY.DNSKEY
+import dns.zone
+
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, ed448, rsa
+
+from ..parsers.abstract import replace_file
+from ..parsers.keyrec import KeySetMixin
+from ..rolllog import LOG
+from . import zonesigner
+
+# zonesigner options handled here, with their number of arguments.
+OPTIONS = {'-usezskpub': 0, '-signonly': 0, '-zone': 1, '-krfile': 1}
+
+# Records of a previous signing, dropped from the zone file.
+DNSSEC_TYPES = frozenset((
+    dns.rdatatype.RRSIG, dns.rdatatype.NSEC, dns.rdatatype.NSEC3,
+    dns.rdatatype.NSEC3PARAM))
+
+ENDTIME = '+2592000'  # Signature validity, as dnssec-signzone's default.
+INCEPTION_SKEW = 3600  # Signature inception before now, as dnssec-signzone.
+
+CURVES = {13: ec.SECP256R1, 14: ec.SECP384R1}
+
+
+def private_key(key):
+    '''
+    Load the private key of a keyrec key from its BIND .private file.
+
+    @param key: Keyrec key.
+    @type key: Key
+
+    @returns: private key
+    @rtype: cryptography private key
+    '''
+    fields = key.private_key()
+    algorithm = key.dnskey.algorithm
+
+    def number(name):
+        return int.from_bytes(base64.b64decode(fields[name]), 'big')
+
+    if algorithm in (5, 7, 8, 10):
+        public = rsa.RSAPublicNumbers(
+            number('PublicExponent'), number('Modulus'))
+        return rsa.RSAPrivateNumbers(
+            number('Prime1'), number('Prime2'), number('PrivateExponent'),
+            number('Exponent1'), number('Exponent2'), number('Coefficient'),
+            public).private_key()
+    if algorithm in CURVES:
+        return ec.derive_private_key(
+            number('PrivateKey'), CURVES[algorithm]())
+    if algorithm == 15:
+        return ed25519.Ed25519PrivateKey.from_private_bytes(
+            base64.b64decode(fields['PrivateKey']))
+    if algorithm == 16:
+        return ed448.Ed448PrivateKey.from_private_bytes(
+            base64.b64decode(fields['PrivateKey']))
+    raise ValueError('unsupported algorithm %d' % algorithm)
+
+
+def dnskey_rdata(key):
+    '''
+    @param key: Keyrec key.
+    @type key: Key
+
+    @returns: DNSKEY record of the key's .key file
+    @rtype: dns.rdtypes.ANY.DNSKEY.DNSKEY
+    '''
+    dnskey = key.dnskey
+    return dns.rdtypes.ANY.DNSKEY.DNSKEY(
+        dns.rdataclass.IN, dns.rdatatype.DNSKEY, dnskey.flags,
+        dnskey.protocol, dnskey.algorithm, dnskey.key)
+
+
+def next_serial(serial, previous):
+    '''
+    SOA serial of a new signing: the zone file's serial if it comes after
+    the previous signed one (RFC 1982), the previous one plus one otherwise.
+
+    @param serial: Zone file's serial.
+    @type serial: int
+    @param previous: Previous signed zone's serial, None if unknown.
+    @type previous: int
+
+    @returns: serial
+    @rtype: int
+    '''
+    if previous is None or 0 < (serial - previous) % 2 ** 32 < 2 ** 31:
+        return serial
+    return (previous + 1) % 2 ** 32
+
+
+def signed_serial(path, origin):
+    '''
+    @param path: Signed zone file.
+    @type path: str
+    @param origin: Zone name.
+    @type origin: dns.name.Name
+
+    @returns: SOA serial of the signed zone, None if there's none
+    @rtype: int
+    '''
+    try:
+        zone = dns.zone.from_file(path, origin, check_origin=False)
+        soa = zone.get_rdataset(zone.origin, dns.rdatatype.SOA)
+    except (OSError, dns.exception.DNSException):
+        return None
+    return soa[0].serial if soa else None
+
+
+def expiration_time(endtime, now):
+    '''
+    Convert a zonesigner end time ("+<seconds>", "now+<seconds>" or
+    YYYYMMDDHHMMSS) to a signature expiration time.
+    '''
+    if endtime.startswith('now'):
+        endtime = endtime[3:]
+    if endtime.startswith('+'):
+        return now + int(endtime[1:])
+    if len(endtime) == 14 and endtime.isdigit():
+        return endtime
+    raise ValueError('bad end time "%s"' % endtime)
+
+
+class Signer(zonesigner.Signer):
+    '''
+    Signs the zones in-process with dnspython, with the keys of their
+    keyrec, and writes the signed zone file and the keyrec signing date.
+    It saves the start of zonesigner and dnssec-signzone, which costs
+    more than the signing of a small zone.
+
+    Only the NSEC signings which keep the current keys are done here.
+    Key generations and rolls, zonesigner options other than the ones
+    in OPTIONS and the zones using NSEC3 are left to zonesigner, as well
+    as the signings which fail here.
+    '''
+    def sign(self, rname, rrr, krr, zsflag, zonefile, zonesigned):
+        rollerd = self.rollerd
+        usezskpub = self.options(zsflag)
+        if krr is None or usezskpub is None:
+            rollerd.rolllog_log(
+                LOG.TMI, rname, 'zonesigner needed for "%s"' % zsflag.strip())
+            return super().sign(rname, rrr, krr, zsflag, zonefile, zonesigned)
+        if self.nsec3(rname, krr):
+            rollerd.rolllog_log(LOG.TMI, rname, 'zonesigner needed for NSEC3')
+            return super().sign(rname, rrr, krr, zsflag, zonefile, zonesigned)
+
+        started = time.time()
+        try:
+            records = self.sign_zone(rname, krr, usezskpub)
+        except Exception as e:
+            rollerd.rolllog_log(
+                LOG.ERR, rname, 'unable to sign zone in-process:  %s' % e)
+            return super().sign(rname, rrr, krr, zsflag, zonefile, zonesigned)
+        rollerd.rolllog_log(
+            LOG.TMI, rname, 'zone signed in-process in %.2f seconds, '
+            '%d records' % (time.time() - started, records))
+        return True
+
+    def options(self, zsflag):
+        '''
+        @param zsflag: zonesigner options.
+        @type zsflag: str
+
+        @returns: -usezskpub flag, None if an option isn't handled here
+        @rtype: bool
+        '''
+        args = shlex.split(zsflag)
+        i = 0
+        while i < len(args):
+            if args[i] not in OPTIONS:
+                return None
+            i += 1 + OPTIONS[args[i]]
+        return '-usezskpub' in args
+
+    def nsec3(self, rname, krr):
+        '''
+        @param rname: Name of rollrec.
+        @type rname: str
+        @param krr: Zone's keyrec.
+        @type krr: KeyRec
+
+        @returns: the zone uses NSEC3, as set by usensec3 in the
+                  DNSSEC-Tools config file or the zone's keyrec
+        @rtype: bool
+        '''
+        zonerec = krr.get(rname) or {}
+        return any(
+            str(x).lower() in ('yes', '1') for x in (
+                self.rollerd.dtconf.get('usensec3', 'no'),
+                zonerec.get('usensec3', 'no')))
+
+    def sign_zone(self, rname, krr, usezskpub):
+        '''
+        Sign a zone file with the keys of its keyrec.  The DNSKEY RRset
+        is made of the current and published KSKs and ZSKs.  It is signed
+        by the KSKs, and the other RRsets by the current ZSKs (and the
+        published ZSKs with -usezskpub).
+
+        @param rname: Name of rollrec.
+        @type rname: str
+        @param krr: Zone's keyrec.
+        @type krr: KeyRec
+        @param usezskpub: Sign with the published ZSKs too.
+        @type usezskpub: bool
+
+        @returns: number of records in the signed zone
+        @rtype: int
+        '''
+        zonerec = krr[rname]
+        origin = dns.name.from_text(zonerec.name)
+
+        def keys(*setnames):
+            found = []
+            for setname in setnames:
+                keyset = getattr(zonerec, '_%s' % setname)
+                if isinstance(keyset, KeySetMixin):
+                    found.extend(keyset.keys)
+            return found
+
+        published = keys('kskcur', 'kskpub', 'zskcur', 'zskpub')
+        signing = keys('kskcur', 'kskpub', 'zskcur')
+        if usezskpub:
+            signing += keys('zskpub')
+        if not signing:
+            raise ValueError('no signing keys in the keyrec')
+
+        zone = dns.zone.from_file(zonerec.zonefile_path, origin)
+
+        # Drop the records of a previous signing.
+        for name in list(zone.keys()):
+            node = zone[name]
+            node.rdatasets[:] = [
+                rdataset for rdataset in node.rdatasets
+                if rdataset.rdtype not in DNSSEC_TYPES and not (
+                    name == dns.name.empty and
+                    rdataset.rdtype == dns.rdatatype.DNSKEY)]
+            if not node.rdatasets:
+                del zone[name]
+
+        soa = zone.find_rdataset(dns.name.empty, dns.rdatatype.SOA)
+        serial = next_serial(soa[0].serial, signed_serial(
+            zonerec.signedzone_path, origin))
+        if serial != soa[0].serial:
+            zone.replace_rdataset(dns.name.empty, dns.rdataset.from_rdata(
+                soa.ttl, soa[0].replace(serial=serial)))
+
+        dnskeys = zone.find_rdataset(
+            dns.name.empty, dns.rdatatype.DNSKEY, create=True)
+        for key in published:
+            dnskeys.add(dnskey_rdata(key), soa.ttl)
+
+        now = int(time.time())
+        endtime = (
+            zonerec.get('endtime') or self.rollerd.dtconf.get('endtime') or
+            ENDTIME)
+        dns.dnssec.sign_zone(
+            zone, keys=[(private_key(x), dnskey_rdata(x)) for x in signing],
+            add_dnskey=False, inception=now - INCEPTION_SKEW,
+            expiration=expiration_time(endtime, now))
+
+        replace_file(
+            zonerec.signedzone_path,
+            zone.to_text(sorted=True, nl='\n', want_origin=True))
+        zonerec.settime()
+        krr.save()
+        return sum(
+            len(rdataset) for node in zone.values()
+            for rdataset in node.rdatasets)
@@ -0,0 +1,60 @@
+# Copyright (C) 2015 Okami, okami@fuzetsu.info
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+class Signer(object):
+    '''
+    Signs the zones with the DNSSEC-Tools zonesigner, which runs
+    dnssec-keygen and dnssec-signzone.
+    '''
+    def __init__(self, rollerd):
+        self.rollerd = rollerd
+
+    def sign(self, rname, rrr, krr, zsflag, zonefile, zonesigned):
+        '''
+        Sign a zone.
+
+        @param rname: Name of rollrec.
+        @type rname: str
+        @param rrr: Zone's rollrec.
+        @type rrr: Roll
+        @param krr: Zone's keyrec, None for an initial signing.
+        @type krr: KeyRec
+        @param zsflag: zonesigner options.
+        @type zsflag: str
+        @param zonefile: Zone file.
+        @type zonefile: str
+        @param zonesigned: Signed zone file.
+        @type zonesigned: str
+
+        @returns: True on success
+        @rtype: bool
+        '''
+        rollerd = self.rollerd
+
+        # Build the command to execute.
+        cmdstr = (
+            '%(zonesigner)s -rollmgr pyrollerd -dtconfig %(dtcf)s '
+            '%(zsflag)s %(zonefile)s %(zonesigned)s' % {
+            'zonesigner': rollerd.zonesigner,
+            'dtcf': rollerd.dtcf,
+            'zsflag': zsflag,
+            'zonefile': zonefile,
+            'zonesigned': zonesigned,
+        })
+
+        # Have zonesigner sign the zone for us.
+        return rollerd.runner(rname, cmdstr, rrr['keyrec'], False)
@@ -17,8 +17,10 @@ setup(**{
         'dnssec.api',
         'dnssec.parsers',
         'dnssec.rollerd',
+        'dnssec.signers',
     ],
     'scripts': ['rollerd'],
+    'python_requires': '>=3.7',
     'long_description': '',
     'classifiers': [
         'Development Status :: 3 - Alpha',
@@ -26,6 +28,9 @@ setup(**{
         'License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)',
     ],
     'install_requires': [
-        'dnspython3 >= 1.12.0',
+        'dnspython >= 1.13.0',
     ],
+    'extras_require': {
+        'inline': ['dnspython >= 2.4', 'cryptography'],
+    },
 })
@@ -15,15 +15,25 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+import collections
 import os
+import re
+import signal
+import socket
+import stat
 import subprocess
+import tempfile
 import time
 import sys
 
 from base64 import b64encode
 
-from dnssec.parsers.rollrec import RollRec
-from dnssec.parsers.keyrec import KeySet, Key, Zone
+from dnssec import defs, execute, rollmgr
+from dnssec.parsers import DATETIME_FORMAT, zonefile
+from dnssec.parsers.abstract import replace_file, tokenize, tokenize_lines
+from dnssec.parsers.rollrec import SNAPSHOT_SUFFIX, LazyRollRec, RollRec
+from dnssec.parsers.keyrec import KeyRec, KeySet, Key, Zone, dnskey_keytag
+from dnssec.rolllog import LOG
 
 
 HOME_DIR = '/tmp'
@@ -122,6 +132,130 @@ _443._tcp.gnome.org IN TLSA 1 0 1 36CDC83056FE85D0BC3292FECD53214236B232D929862A
     return True
 
 
+def generate_rollrec(**kwargs):
+    '''
+    Writes the rollrec of the test zone, without rollinit
+    '''
+    fields = {
+        'zonename': 'fuzetsu.info',
+        'directory': HOME_DIR,
+        'zonefile': 'fuzetsu.info',
+        'keyrec': 'fuzetsu.info.krf',
+        'kskphase': '0',
+        'zskphase': '0',
+        'phasestart': time.strftime(DATETIME_FORMAT, time.gmtime()),
+    }
+    fields.update(kwargs)
+    if os.path.exists(RRF):
+        os.remove(RRF)
+    f = open(RRF, 'w')
+    print('roll\t"fuzetsu.info"', file=f)
+    for i in fields.items():
+        print('\t%s\t\t"%s"' % i, file=f)
+    f.close()
+    return True
+
+
+def generate_rollrecs(count):
+    '''
+    Writes a rollrec of $count zones, every third one a skip zone
+    '''
+    if os.path.exists(RRF):
+        os.remove(RRF)
+    f = open(RRF, 'w')
+    for i in range(count):
+        name = 'z%d.fuzetsu.info' % i
+        print('%s\t"%s"' % ('skip' if i % 3 == 2 else 'roll', name), file=f)
+        print('\tzonename\t\t"%s"' % name, file=f)
+        print('\tzonefile\t\t"%s.signed"' % name, file=f)
+        print('\tkeyrec\t\t"%s.krf"' % name, file=f)
+        print('\tkskphase\t\t"0"', file=f)
+        print('\tzskphase\t\t"%d"' % (i % 5), file=f)
+        print('', file=f)
+    f.close()
+    return True
+
+
+def records(rollrec):
+    '''
+    @returns: the zones of a rollrec, as (name, is_active, fields)
+    @rtype: list
+    '''
+    return [
+        (name, roll.is_active, list(roll.items()))
+        for name, roll in rollrec.items()]
+
+
+def generate_key(keytype, length):
+    '''
+    Writes an RSASHA256 key pair as dnssec-keygen does, without
+    dnssec-keygen
+
+    @returns: key name
+    @rtype: str
+    '''
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    def encode(number):
+        return b64encode(
+            number.to_bytes((number.bit_length() + 7) // 8, 'big')
+        ).decode('ascii')
+
+    flags = {'ksk': 257, 'zsk': 256}[keytype]
+    private = rsa.generate_private_key(65537, length).private_numbers()
+    public = private.public_numbers
+    exponent = public.e.to_bytes((public.e.bit_length() + 7) // 8, 'big')
+    key = (
+        bytes((len(exponent),)) + exponent +
+        public.n.to_bytes((public.n.bit_length() + 7) // 8, 'big'))
+    name = 'Kfuzetsu.info.+008+%05d' % dnskey_keytag(flags, 3, 8, key)
+    path = os.path.join(HOME_DIR, name)
+    with open(path + '.key', 'w') as f:
+        print('fuzetsu.info. IN DNSKEY %d 3 8 %s' % (
+            flags, b64encode(key).decode('ascii')), file=f)
+    with open(path + '.private', 'w') as f:
+        for i in (
+                ('Private-key-format', 'v1.3'),
+                ('Algorithm', '8 (RSASHA256)'),
+                ('Modulus', encode(public.n)),
+                ('PublicExponent', encode(public.e)),
+                ('PrivateExponent', encode(private.d)),
+                ('Prime1', encode(private.p)),
+                ('Prime2', encode(private.q)),
+                ('Exponent1', encode(private.dmp1)),
+                ('Exponent2', encode(private.dmq1)),
+                ('Coefficient', encode(private.iqmp))):
+            print('%s: %s' % i, file=f)
+    return name
+
+
+def generate_keyrec(**keysets):
+    '''
+    Writes the keyrec of the test zone, with a key set of each given
+    type ({set_type: (key names)}), without zonesigner
+    '''
+    if os.path.exists(ZF + '.krf'):
+        os.remove(ZF + '.krf')
+    f = open(ZF + '.krf', 'w')
+    print('zone\t"fuzetsu.info"', file=f)
+    print('\tzonefile\t\t"fuzetsu.info"', file=f)
+    print('\tsignedzone\t\t"fuzetsu.info.signed"', file=f)
+    for set_type in keysets:
+        print('\t%s\t\t"%s-set"' % (set_type, set_type), file=f)
+    for set_type, names in keysets.items():
+        print('\nset\t"%s-set"' % set_type, file=f)
+        print('\tzonename\t\t"fuzetsu.info"', file=f)
+        print('\tset_type\t\t"%s"' % set_type, file=f)
+        print('\tkeys\t\t"%s"' % ' '.join(names), file=f)
+        for name in names:
+            print('\nkey\t"%s"' % name, file=f)
+            print('\tzonename\t\t"fuzetsu.info"', file=f)
+            print('\tkeyrec_type\t\t"%s"' % set_type, file=f)
+            print('\tkeypath\t\t"%s.key"' % name, file=f)
+    f.close()
+    return True
+
+
 def rollinit():
     '''
     Executes "rollinit" provided by original dnssec-tools
@@ -257,6 +391,7 @@ def parsers():
 
                 assert section.protocol == 3
                 assert section.algorithm == 8
+                assert section.dnskey.keytag == section.keytag
                 assert (
                     b64encode(section.public_key_source()) ==
                     section.public_key().replace(' ', '').encode('utf8'))
@@ -273,6 +408,924 @@ def parsers():
                     assert section.length == DTCONFIG['ksklength']
 
 
+def dirty():
+    '''
+    Reading the phase timings doesn't mark the rollrec as changed
+    '''
+    assert generate_zone()
+    for compact in (False, True):
+        # The first pass records the zone's maximum TTL.
+        assert generate_rollrec(zskphase='1')
+        rrf = RollRec()
+        rrf.read(RRF, compact=compact)
+        roll = rrf['fuzetsu.info']
+        assert roll.maxttl() == 2
+        assert rrf._dirty
+        rrf.save()
+
+        rrf = RollRec()
+        rrf.read(RRF, compact=compact)
+        roll = rrf['fuzetsu.info']
+        assert roll.phaseend_date
+        assert roll.phase_left is not None
+        assert roll.phase_progress is not None
+        assert roll.maxttl() == 2
+        assert not rrf._dirty
+
+
+def atomic():
+    '''
+    Files are replaced, never truncated
+    '''
+    directory = tempfile.mkdtemp(dir=HOME_DIR)
+    path = os.path.join(directory, 'test.rollrec')
+    with open(path, 'w') as f:
+        f.write('old')
+    os.chmod(path, 0o640)
+
+    # Readers of the old file keep reading it.
+    with open(path, 'r') as f:
+        stamp = replace_file(path, 'new')
+        assert f.read() == 'old'
+    with open(path, 'r') as f:
+        assert f.read() == 'new'
+    assert stamp[0] == os.stat(path).st_ino
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+
+    # A failed write leaves the old file.
+    try:
+        replace_file(path, '\udcff')
+    except UnicodeEncodeError:
+        pass
+    else:
+        assert False
+    with open(path, 'r') as f:
+        assert f.read() == 'new'
+
+    # Links are followed.
+    link = os.path.join(directory, 'link.rollrec')
+    os.symlink(path, link)
+    replace_file(link, 'linked')
+    assert os.path.islink(link)
+    with open(path, 'r') as f:
+        assert f.read() == 'linked'
+
+    assert sorted(os.listdir(directory)) == ['link.rollrec', 'test.rollrec']
+    os.remove(link)
+    os.remove(path)
+    os.rmdir(directory)
+
+
+def inline():
+    '''
+    Zones signed by the inline signer validate with the keys zonesigner
+    would have published (dnspython >= 2.4 and cryptography required)
+    '''
+    import dns.dnssec
+    import dns.name
+    import dns.rdatatype
+    import dns.zone
+
+    from dnssec.signers.inline import Signer
+
+    class RollerD(object):
+        dtconf = {}
+        zonesigner = 'zonesigner'
+        dtcf = DTCF
+
+        def __init__(self):
+            self.cmds = []
+
+        def rolllog_log(self, level, rname, message):
+            pass
+
+        def runner(self, rname, cmd, krf, negerrflag):
+            self.cmds.append(cmd)
+            return True
+
+    assert generate_zone()
+    ksk = generate_key('ksk', 2048)
+    zsk = generate_key('zsk', 1024)
+    zskpub = generate_key('zsk', 1024)
+    assert generate_keyrec(kskcur=(ksk,), zskcur=(zsk,), zskpub=(zskpub,))
+    krr = KeyRec()
+    krr.read(ZF + '.krf')
+    rollerd = RollerD()
+    assert Signer(rollerd).sign(
+        'fuzetsu.info', None, krr, ' -signonly', ZF, ZF + '.signed')
+    assert rollerd.cmds == []
+
+    origin = dns.name.from_text('fuzetsu.info')
+    zone = dns.zone.from_file(ZF + '.signed', origin, relativize=False)
+    dnskeys = zone.get_rdataset(origin, dns.rdatatype.DNSKEY)
+    published = set(
+        krr[name].dnskey.key for name in (ksk, zsk, zskpub))
+    assert set(x.key for x in dnskeys) == published
+    keytags = {
+        'ksk': set((krr[ksk].keytag,)),
+        'zsk': set((krr[zsk].keytag,)),
+    }
+
+    signed = 0
+    for name, node in zone.items():
+        for rdataset in node.rdatasets:
+            if rdataset.rdtype == dns.rdatatype.RRSIG:
+                continue
+            rrsigs = node.get_rdataset(
+                dns.rdataclass.IN, dns.rdatatype.RRSIG, rdataset.rdtype)
+            assert rrsigs
+            expected = keytags[
+                'ksk' if rdataset.rdtype == dns.rdatatype.DNSKEY else 'zsk']
+            assert set(x.key_tag for x in rrsigs) == expected
+            dns.dnssec.validate(
+                (name, rdataset), (name, rrsigs), {origin: dnskeys})
+            signed += 1
+    assert signed
+    assert zone.get_rdataset(origin, dns.rdatatype.NSEC)
+
+    # NSEC3 zones are left to zonesigner.
+    rrr = {'keyrec': ZF + '.krf'}
+    rollerd = RollerD()
+    rollerd.dtconf = {'usensec3': 'yes', 'nsec3iter': '100'}
+    assert Signer(rollerd).sign(
+        'fuzetsu.info', rrr, krr, ' -signonly', ZF, ZF + '.signed')
+    rollerd.dtconf = {'usensec3': 'no'}
+    krr['fuzetsu.info']['usensec3'] = 'yes'
+    assert Signer(rollerd).sign(
+        'fuzetsu.info', rrr, krr, ' -signonly', ZF, ZF + '.signed')
+    del krr['fuzetsu.info']['usensec3']
+    assert Signer(rollerd).sign(
+        'fuzetsu.info', rrr, krr, ' -signonly -usensec3', ZF, ZF + '.signed')
+    assert len(rollerd.cmds) == 3
+    for cmd in rollerd.cmds:
+        assert cmd.startswith('zonesigner -rollmgr pyrollerd ')
+        assert cmd.endswith(' %s %s' % (ZF, ZF + '.signed'))
+    assert dns.zone.from_file(
+        ZF + '.signed', origin, relativize=False) == zone
+
+
+def ttl():
+    '''
+    Zone file TTL scanner, against dnspython
+    '''
+    import dns.zone
+
+    def dnspython_maxttl(path):
+        zone = dns.zone.from_file(path, 'fuzetsu.info', check_origin=False)
+        return max(
+            rdataset.ttl for node in zone.values()
+            for rdataset in node.rdatasets)
+
+    directory = tempfile.mkdtemp(dir=HOME_DIR)
+    main = os.path.join(directory, 'main.zone')
+    included = os.path.join(directory, 'included.zone')
+    with open(main, 'w') as f:
+        f.write('''$ORIGIN fuzetsu.info.
+$TTL 1h
+@ IN SOA ns6.gandi.net. okami.fuzetsu.info. (
+    2015010106 ; serial ( not a parenthesis
+    43200
+    3600
+    1209600
+    1 )
+@ IN NS ns6.gandi.net.
+www 2h IN A 8.8.8.8
+txt IN 3h TXT "a ) b ; c" "(d"
+$INCLUDE %s sub.fuzetsu.info.
+tail IN A 8.8.4.4
+''' % included)
+    with open(included, 'w') as f:
+        f.write('''@ 1d IN A 1.2.3.4
+    IN TXT "$TTL"
+''')
+    assert zonefile.TTLScanner().scan(main) == 86400
+    assert zonefile.maxttl(main) == dnspython_maxttl(main)
+
+    # Without $TTL, a record has the TTL of the previous one.
+    with open(main, 'w') as f:
+        f.write('''$ORIGIN fuzetsu.info.
+@ 300 IN SOA ns. host. 1 2 3 4 5
+@ IN NS ns.
+www 7200 IN A 1.1.1.1
+w2 IN A 1.1.1.2
+''')
+    scanner = zonefile.TTLScanner()
+    assert scanner.scan(main) == 7200
+    assert scanner.last_ttl == 7200
+    assert scanner.records == 4
+    assert zonefile.maxttl(main) == dnspython_maxttl(main)
+
+    # The files the scanner can't read are parsed by dnspython.
+    with open(main, 'w') as f:
+        f.write('''$ORIGIN fuzetsu.info.
+$TTL 60
+@ IN SOA ns. host. 1 2 3 4 5
+@ IN NS ns.
+$GENERATE 1-3 host$ 600 IN A 10.0.0.$
+''')
+    try:
+        zonefile.TTLScanner().scan(main)
+    except zonefile.UnsupportedSyntax:
+        pass
+    else:
+        assert False
+    assert zonefile.maxttl(main) == 600
+
+    with open(main, 'w') as f:
+        f.write('@ 60 IN SOA ns. host. ( 1 2 3 4 5\n')
+    try:
+        zonefile.TTLScanner().scan(main)
+    except zonefile.UnsupportedSyntax:
+        pass
+    else:
+        assert False
+
+    os.remove(main)
+    os.remove(included)
+    os.rmdir(directory)
+
+
+def tokens():
+    '''
+    tokenize() gives the pairs the per-line regex of the parsers gave
+    '''
+    def legacy_pairs(lines):
+        for i in lines:
+            if not i.strip().startswith('#'):
+                match = re.match(r'(\S+)\s+"([^"]+)"', i.strip())
+                if match:
+                    yield match.group(1), match.group(2)
+
+    lines = [
+        'roll\t"fuzetsu.info"\n',
+        '\tzonename\t\t"fuzetsu.info"\n',
+        '    kskphase  "0"\n',
+        'key "two words" and the rest\n',
+        'key "a"b"\n',
+        '"quoted" "key"\n',
+        'key#hash "value # not a comment"\n',
+        '# roll "commented"\n',
+        '   # key "indented comment"\n',
+        'key ""\n',
+        'key ""x"\n',
+        'key "unterminated\n',
+        'key unquoted\n',
+        'key\n',
+        '"\n',
+        '\n',
+        '   \n',
+        'key "crlf"\r\n',
+        'cl\u00e9 "valeur \u00e9"\n',
+    ]
+    assert list(tokenize_lines(lines)) == list(legacy_pairs(lines))
+
+    # The files written by the parsers.
+    assert generate_rollrec(zskphase='1')
+    generate_keyrec(kskcur=('Kfuzetsu.info.+008+00001',))
+    for path in (RRF, ZF + '.krf'):
+        with open(path, 'r') as f:
+            expected = list(legacy_pairs(f))
+        assert expected
+        assert list(tokenize(path)) == expected
+
+
+def snapshot():
+    '''
+    Rollrec snapshots give the records of the text file, until it changes
+    '''
+    assert generate_rollrecs(50)
+    for compact in (False, True):
+        if os.path.exists(RRF + SNAPSHOT_SUFFIX):
+            os.remove(RRF + SNAPSHOT_SUFFIX)
+        rrf = RollRec()
+        assert not rrf.read_snapshot(RRF, compact=compact)
+        rrf.read(RRF, compact=compact)
+        rrf.write_snapshot()
+
+        snap = RollRec()
+        assert snap.read_snapshot(RRF, compact=compact)
+        assert records(snap) == records(rrf)
+        assert not snap._dirty
+        assert str(snap) == str(rrf)
+
+        # Records loaded from a snapshot are saved as the others.
+        snap['z1.fuzetsu.info']['zskphase'] = '2'
+        snap.save()
+        rrf = RollRec()
+        rrf.read(RRF, compact=compact)
+        assert rrf['z1.fuzetsu.info']['zskphase'] == '2'
+        assert records(rrf) == records(snap)
+
+        # The text file has changed since the snapshot.
+        assert not RollRec().read_snapshot(RRF, compact=compact)
+        rrf.write_snapshot()
+        assert not RollRec().read_snapshot(RRF, compact=not compact)
+        with open(RRF + SNAPSHOT_SUFFIX, 'r+b') as f:
+            f.truncate(os.path.getsize(RRF + SNAPSHOT_SUFFIX) // 2)
+        assert not RollRec().read_snapshot(RRF, compact=compact)
+    os.remove(RRF + SNAPSHOT_SUFFIX)
+
+
+def lazy():
+    '''
+    Lazy rollrecs parse the records they're asked for, and save the
+    others as they are
+    '''
+    def parsed(rollrec):
+        return [
+            name for name, roll in collections.OrderedDict.items(rollrec)
+            if roll is not None]
+
+    assert generate_rollrecs(50)
+    with open(RRF, 'r') as f:
+        text = f.read()
+    for compact in (False, True):
+        rrf = RollRec()
+        rrf.read(RRF, compact=compact)
+        lrf = LazyRollRec()
+        lrf.read(RRF, compact=compact)
+        assert list(lrf) == list(rrf)
+        assert not parsed(lrf)
+        assert str(lrf) == text
+
+        roll = lrf['z7.fuzetsu.info']
+        assert roll.is_active == rrf['z7.fuzetsu.info'].is_active
+        assert list(roll.items()) == list(rrf['z7.fuzetsu.info'].items())
+        assert not lrf['z8.fuzetsu.info'].is_active
+        assert parsed(lrf) == ['z7.fuzetsu.info', 'z8.fuzetsu.info']
+        assert not lrf._dirty
+
+        # The changes are saved as by a RollRec, the other records are
+        # copied.
+        for conf in (rrf, lrf):
+            conf['z7.fuzetsu.info']['zskphase'] = '3'
+            conf['z8.fuzetsu.info'].is_active = True
+            del conf['z9.fuzetsu.info']
+        lrf.save()
+        assert parsed(lrf) == ['z7.fuzetsu.info', 'z8.fuzetsu.info']
+        saved = RollRec()
+        saved.read(RRF, compact=compact)
+        assert records(saved) == records(rrf)
+        with open(RRF, 'r') as f:
+            data = f.read()
+        assert text.split('\n\n')[0] in data
+        assert rrf['z7.fuzetsu.info'].text() in data
+
+        # The records are found again in the new file.
+        lrf['z20.fuzetsu.info']['kskphase'] = '1'
+        rrf['z20.fuzetsu.info']['kskphase'] = '1'
+        lrf.save()
+        saved = RollRec()
+        saved.read(RRF, compact=compact)
+        assert records(saved) == records(rrf)
+        assert records(lrf) == records(rrf)
+        assert generate_rollrecs(50)
+
+
+def make_rollerd():
+    '''
+    @returns: pyrollerd for the test rollrec, with the zones' events
+              and handling left to the caller
+    @rtype: RollerD
+    '''
+    from dnssec.rollerd import RollerD
+
+    rollerd = RollerD()
+    rollerd.rollrecfile = RRF
+    rollerd.lockfile = LOCK
+    rollerd.sockfile = SOCK
+    rollerd.xqtdir = HOME_DIR
+    rollerd.readonly = True
+    rollerd.sleeptime = 60
+    rollerd.eventmaster = defs.EVT_QUEUE_SOON
+    rollerd.rrfchk = lambda: True
+    rollerd.rolllog_log = lambda level, rname, message: None
+    return rollerd
+
+
+def queue():
+    '''
+    The soon queue handles the due zones in the order of their events
+    '''
+    assert generate_rollrecs(10)
+    rollerd = make_rollerd()
+    now = int(time.time())
+    eventtimes = {}
+    for i in range(10):
+        name = 'z%d.fuzetsu.info' % i
+        if i % 3 != 2:  # skip zones have no events
+            eventtimes[name] = now + 1000 - i * 100
+    eventtimes['z0.fuzetsu.info'] = now - 10
+    eventtimes['z9.fuzetsu.info'] = now + 2 * defs.QUEUE_SOONLIMIT
+    handled = []
+    rollerd.queue_eventtime = eventtimes.get
+    rollerd.rollzones = handled.append
+
+    rollerd.queue_sooners = []
+    rollerd.queue_eventtimes = {}
+    rollerd.queue_soonend = 0
+    rollerd.queue_runscan()
+    assert handled == [['z0.fuzetsu.info']]
+    assert rollerd.queue_scanskips == 3
+    # z0 stays due and is checked again after $sleeptime.
+    assert rollerd.queue_eventtimes['z0.fuzetsu.info'] == now + 60
+    assert 'z9.fuzetsu.info' not in rollerd.queue_eventtimes
+    assert rollerd.queue_eventtimes[defs.QUEUE_RUNSCAN] == (
+        rollerd.queue_soonend)
+    assert 0 < rollerd.queue_naptime() <= 61
+
+    # The events come due out of order, one zone is queued again later.
+    del handled[:]
+    rollerd.queue_push('z7.fuzetsu.info', now - 5)
+    rollerd.queue_push('z3.fuzetsu.info', now - 30)
+    rollerd.queue_push('z4.fuzetsu.info', now - 20)
+    rollerd.queue_push('z4.fuzetsu.info', now + 500)
+    rollerd.queue_push('z1.fuzetsu.info', now - 1)
+    rollerd.queue_rundue()
+    assert handled == [[
+        'z3.fuzetsu.info', 'z7.fuzetsu.info', 'z1.fuzetsu.info']]
+    assert rollerd.queue_eventtimes['z4.fuzetsu.info'] == now + 500
+    assert min(rollerd.queue_sooners)[0] >= now
+
+    # Nothing is due.
+    del handled[:]
+    rollerd.queue_rundue()
+    assert handled == []
+
+    # The end of the period scans the rollrec file again.
+    rollerd.queue_push(defs.QUEUE_RUNSCAN, now - 1)
+    rollerd.queue_rundue()
+    assert handled == [['z0.fuzetsu.info']]
+
+
+def autosign():
+    '''
+    With -autosign, the soon queue handles a modified zone file right away
+    '''
+    assert generate_zone()
+    assert generate_keyrec()
+    assert generate_rollrec(zonefile='fuzetsu.info.signed')
+    with open(ZF + '.signed', 'w') as f:
+        f.write('')
+    now = int(time.time())
+    os.utime(ZF, (now - 100, now - 100))
+
+    rollerd = make_rollerd()
+    rollerd.queue_keyexpiry = lambda *args: now + 10000
+    handled = []
+    rollerd.rollzones = handled.append
+    rollerd.rollrec_read()
+    assert rollerd.queue_eventtime('fuzetsu.info') == now + 10000
+
+    # The zone file is checked again after $sleeptime.
+    rollerd.autosign = True
+    assert now + 60 <= rollerd.queue_eventtime('fuzetsu.info') <= now + 61
+
+    # The zone file is modified.
+    os.utime(ZF, (now + 100, now + 100))
+    assert rollerd.queue_eventtime('fuzetsu.info') == 0
+    rollerd.queue_sooners = []
+    rollerd.queue_eventtimes = {}
+    rollerd.queue_soonend = 0
+    rollerd.queue_runscan()
+    assert handled == [['fuzetsu.info']]
+
+    # The zones in rollover wait for the end of their phase.
+    rollerd.rollrec_read()
+    rollerd.ROLLREC['fuzetsu.info']['zskphase'] = '1'
+    assert rollerd.queue_eventtime('fuzetsu.info') != 0
+    os.remove(ZF + '.signed')
+
+
+def execution():
+    '''
+    External commands' output, timeouts and left-behind programs, run
+    directly or by the event loop
+    '''
+    import asyncio
+
+    big = execute.OUTPUT_LIMIT * 3
+    cmds = (
+        # The output is cut to its last OUTPUT_LIMIT bytes.
+        ([sys.executable, '-c', 'import sys; sys.stdout.write('
+          '"a" * %d + "tail")' % big], None),
+        # SIGTERM on timeout.
+        (['sleep', '30'], 0.5),
+        # SIGKILL when SIGTERM is ignored.
+        (['sh', '-c', 'trap "" TERM; sleep 30'], 0.5),
+        # The output is kept open by a program left behind.
+        (['sh', '-c', 'sleep 3 & echo started'], 10),
+    )
+
+    rollerd = make_rollerd()
+    rollerd.LOOP = asyncio.new_event_loop()
+    grace, execute.KILL_GRACE = execute.KILL_GRACE, 1
+    try:
+        results = []
+        for args, timeout in cmds:
+            direct = execute.execute(args, HOME_DIR, timeout)
+            looped = rollerd.LOOP.run_until_complete(
+                rollerd.loop_subprocess(args, HOME_DIR, timeout))
+            # The same outcome, whichever way the command is run.
+            assert direct._replace(duration=0) == looped._replace(duration=0)
+            results.append(direct)
+    finally:
+        execute.KILL_GRACE = grace
+        rollerd.LOOP.close()
+
+    result = results[0]
+    assert result.returncode == 0 and not result.timedout
+    assert result.size == big + 4
+    header = '[%d bytes dropped]\n' % (big + 4 - execute.OUTPUT_LIMIT)
+    assert result.output.startswith(header)
+    assert len(result.output) == len(header) + execute.OUTPUT_LIMIT
+    assert result.output.endswith('a' * 100 + 'tail')
+
+    result = results[1]
+    assert result.timedout and result.returncode == -signal.SIGTERM
+    assert 0.5 <= result.duration < 1.5
+
+    result = results[2]
+    assert result.timedout and result.returncode == -signal.SIGKILL
+    assert 1.5 <= result.duration < 2.5
+
+    result = results[3]
+    assert result.returncode == 0 and not result.timedout
+    assert result.output == 'started\n'
+    assert result.duration < 2.5
+
+
+def framing():
+    '''
+    Frames of the command socket, whatever the chunks they're read in
+    '''
+    texts = ['rollcmd_status', '', 'x' * 50, 'two words', 'caf\u00e9']
+    data = rollmgr.frames(*texts) + b'no space\r\n' + b'truncated '
+    for size in (1, 2, 3, 7, rollmgr.READ_SIZE):
+        for split in (1, 5, len(data)):
+            ours, theirs = socket.socketpair()
+            for i in range(0, len(data), split):
+                theirs.sendall(data[i:i + split])
+            theirs.shutdown(socket.SHUT_WR)
+            reader = rollmgr.FrameReader(ours, size)
+            for text in texts:
+                assert reader.readframe() == text.encode('utf8')
+            assert reader.readframe() == b'no space'
+            # The peer closed the connection.
+            assert reader.readframe() == b'truncated '
+            assert reader.readframe() == b''
+            ours.close()
+            theirs.close()
+
+
+def serve(mode, rollzones=None):
+    '''
+    Runs a pyrollerd serving the command socket for the test rollrec,
+    without handling its zones
+
+    @param mode: "classic", "control" (control server) or "loop".
+    @type mode: str
+    @param rollzones: Handler of the due zones, given the pyrollerd.
+    @type rollzones: function
+
+    @returns: pid of the pyrollerd
+    @rtype: int
+    '''
+    rollerd = make_rollerd()
+    if rollzones is None:
+        rollerd.queue_eventtime = lambda rname: None
+        rollerd.rollzones = lambda rnames: None
+    else:
+        rollerd.rollzones = lambda rnames: rollzones(rollerd, rnames)
+    rollerd.rollmgr_channel(True)
+    pid = os.fork()
+    if not pid:
+        try:
+            # As eminent_domains() does.
+            rollerd.rollrec_read()
+            rollerd.status_load()
+            if mode == 'loop':
+                rollerd.control_clients = 2
+                rollerd.event_loop()
+            if mode == 'control':
+                rollerd.control_clients = 2
+                rollerd.control_start()
+            while 42:
+                rollerd.commander(5)
+        finally:
+            os._exit(0)
+    rollerd.SOCK.close()
+    return pid
+
+
+def pipeline():
+    '''
+    Commands sent through a session, or a connection each when
+    pyrollerd doesn't serve sessions, are answered in order
+    '''
+    assert generate_rollrecs(50)
+    cmds = [
+        (defs.ROLLCMD_ZONESTATUS, 'limit=%d' % i) for i in range(1, 6)]
+    cmds.insert(2, (defs.ROLLCMD_STATUS, ''))
+    cmds.append((defs.ROLLCMD_ZONESTATUS, 'stream'))
+    cmds.append((defs.ROLLCMD_ZONESTATUS, 'phase=bogus'))
+    for mode in ('classic', 'control', 'loop'):
+        pid = serve(mode)
+        try:
+            client = make_rollerd()
+            assert client.rollmgr_session() == (mode != 'classic')
+            client.rollmgr_closechan()
+            results = list(client.rollmgr_pipeline(cmds, window=2))
+        finally:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+        assert [(cmd, data) for cmd, data, r, m in results] == cmds
+        for cmd, data, retcode, respmsg in results[:-1]:
+            assert retcode == defs.ROLLCMD_RC_OKAY
+        lines = [m.splitlines() for c, d, r, m in results]
+        assert [len(x) for x in lines[:2] + lines[3:6]] == [1, 2, 3, 4, 5]
+        assert lines[0][0].startswith('z0.fuzetsu.info/')
+        assert lines[2][0].startswith('boot-time:')
+        assert len(lines[6]) == 50
+        assert results[-1][2] == defs.ROLLCMD_RC_BADARGS
+
+
+def zonestatus():
+    '''
+    zonestatus filters and pages, with and without streaming
+    '''
+    assert generate_rollrecs(50)
+    rrf = RollRec()
+    rrf.read(RRF)
+    rrf['z10.fuzetsu.info']['kskphase'] = '2'
+    rrf['z13.fuzetsu.info']['kskphase'] = '3'
+    rrf.save()
+    zones = [
+        (name, roll.rollrec_type, roll.kskphase, roll.zskphase)
+        for name, roll in rrf.items()]
+
+    rollerd = make_rollerd()
+    rollerd.rollrec_read()
+    rollerd.status_load()
+
+    def names(data):
+        resp = []
+        rollerd.rollmgr_keepresp(resp)
+        rollerd.singlecmd(defs.ROLLCMD_ZONESTATUS, data)
+        rollerd.rollmgr_keepresp(None)
+        pairs = [
+            pair for r in resp
+            for pair in ([r] if type(r) is tuple else list(r))]
+        retcode = pairs[-1][0]
+        text = ''.join(m for r, m in pairs)
+        if retcode != defs.ROLLCMD_RC_OKAY:
+            return retcode
+        found = [x.split('/')[0] for x in text.splitlines()]
+        # A streamed response gives the same zones.
+        if 'stream' not in data:
+            assert names(data + ' stream') == found
+        return found
+
+    def expected(keep, offset=0, limit=None):
+        kept = [x[0] for x in zones if keep(*x)]
+        return kept[offset:None if limit is None else offset + limit]
+
+    assert names('') == [x[0] for x in zones]
+    assert names('type=skip') == expected(lambda n, t, k, z: t == 'skip')
+    assert names('type=roll') == expected(lambda n, t, k, z: t == 'roll')
+    assert names('phase=none') == expected(lambda n, t, k, z: not k and not z)
+    assert names('phase=ksk') == ['z10.fuzetsu.info', 'z13.fuzetsu.info']
+    assert names('phase=ksk3') == ['z13.fuzetsu.info']
+    assert names('phase=zsk') == expected(lambda n, t, k, z: not k and z)
+    assert names('phase=zsk3') == expected(
+        lambda n, t, k, z: not k and z == 3)
+    assert names('zone=z1*') == expected(
+        lambda n, t, k, z: n.startswith('z1'))
+    assert names('offset=45') == expected(lambda *x: True, 45)
+    assert names('offset=10 limit=5') == expected(lambda *x: True, 10, 5)
+    assert names('type=roll phase=zsk zone=z2* offset=1 limit=2') == (
+        expected(
+            lambda n, t, k, z: t == 'roll' and not k and z and
+            n.startswith('z2'), 1, 2))
+    assert names('zone=nowhere.*') == []
+    assert names('offset=60') == []
+    for data in ('phase=ksk-1', 'phase=roll', 'type=all', 'limit=x',
+                 'offset=-1', 'zone=', 'bogus'):
+        assert names(data) == defs.ROLLCMD_RC_BADARGS
+
+
+def generate_zonesigner(path, sleep=0):
+    '''
+    Writes a zonesigner stand-in, which logs a line to $path.log when
+    it starts and when it's done
+    '''
+    with open(path, 'w') as f:
+        print('#!/bin/sh', file=f)
+        print('echo "start $*" >> %s.log' % path, file=f)
+        print('sleep %s' % sleep, file=f)
+        print('echo "done $*" >> %s.log' % path, file=f)
+    os.chmod(path, 0o755)
+    if os.path.exists(path + '.log'):
+        os.remove(path + '.log')
+    return True
+
+
+def readlog(path):
+    '''
+    @returns: lines logged by a zonesigner stand-in
+    @rtype: list
+    '''
+    if not os.path.exists(path + '.log'):
+        return []
+    with open(path + '.log') as f:
+        return f.read().splitlines()
+
+
+def ticks():
+    '''
+    Commands changing the rollrec wait for the event loop's running tick
+    '''
+    zonesigner = os.path.join(HOME_DIR, 'zonesigner-sleep')
+    assert generate_zonesigner(zonesigner, sleep=2)
+    assert generate_rollrecs(3)
+
+    def rollzones(rollerd, rnames):
+        for rname in rnames:
+            rollerd.runner(
+                rname, '%s %s' % (zonesigner, rname), ZF + '.krf', False)
+
+    pid = serve('loop', rollzones)
+    try:
+        started = time.time()
+        while not readlog(zonesigner):
+            assert time.time() - started < 10
+            time.sleep(0.05)
+
+        # The skip zone is restarted once the zones are signed.
+        client = make_rollerd()
+        assert client.rollmgr_sendcmd(
+            False, defs.ROLLCMD_ROLLZONE, 'z2.fuzetsu.info')
+        retcode, respmsg = client.rollmgr_getresp()
+        client.rollmgr_closechan()
+        assert retcode == defs.ROLLCMD_RC_OKAY
+        assert readlog(zonesigner)[-1].startswith('done ')
+
+        # pyrollerd is still running.
+        time.sleep(0.5)
+        assert os.waitpid(pid, os.WNOHANG) == (0, 0)
+        assert client.rollmgr_sendcmd(
+            False, defs.ROLLCMD_ZONESTATUS, 'zone=z2.*')
+        retcode, respmsg = client.rollmgr_getresp()
+        client.rollmgr_closechan()
+        assert retcode == defs.ROLLCMD_RC_OKAY
+        assert respmsg.split('\t')[1] == 'roll'
+    finally:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    # z1 is waiting for the end of its ZSK phase.
+    assert readlog(zonesigner) == [
+        'start z0.fuzetsu.info', 'done z0.fuzetsu.info']
+
+
+def coalescing():
+    '''
+    Plain re-signings of a zone are held until the end of its turn,
+    and dropped when another signing covers them
+    '''
+    zonesigner = os.path.join(HOME_DIR, 'zonesigner-count')
+    assert generate_zone()
+    assert generate_keyrec()
+    assert generate_rollrec(zonefile='fuzetsu.info.signed')
+    with open(ZF + '.signed', 'w') as f:
+        f.write('')
+    now = int(time.time())
+
+    rollerd = make_rollerd()
+    rollerd.coalesce = True
+    rollerd.zonesigner = zonesigner
+    rollerd.dtcf = DTCF
+    rollerd.rollrec_read()
+
+    def rollpass(*zsflags):
+        assert generate_zonesigner(zonesigner)
+
+        def rollzone(rname):
+            for zsflag in zsflags:
+                rollerd.signer(rname, zsflag, rollerd.ROLLREC[rname].keyrec())
+        rollerd.rollzone = rollzone
+        rollerd.coalesce_rollzone('fuzetsu.info')
+        saved = rollerd.coalesce_saved
+        rollerd.coalesce_report()
+        runs = [x.split(' ', 1)[1] for x in readlog(zonesigner)
+                if x.startswith('done ')]
+        return runs, saved
+
+    # The re-signings are held, and run once.
+    runs, saved = rollpass(' -signonly', ' -signonly')
+    assert len(runs) == 1 and saved == 1
+    assert ' -signonly ' in runs[0]
+
+    # A held re-signing is done by a rollover signing.
+    runs, saved = rollpass(' -signonly', 'ZSK phase 2')
+    assert len(runs) == 1 and saved == 1
+    assert ' -usezskpub ' in runs[0] and '-signonly' not in runs[0]
+
+    # The zone file hasn't changed since the zone was signed.
+    runs, saved = rollpass('ZSK phase 2', ' -signonly')
+    assert len(runs) == 1 and saved == 1
+
+    # -alwayssign: a held re-signing counts as the zone's signing.
+    rollerd.alwayssign = True
+    rollerd.autosign = True
+    rollerd.ksk_expired = lambda rname, rrr, keyset: False
+
+    def zsk_expired(rname, rrr, keyset):
+        rollerd.zonemodified(rrr, rname)
+        return False
+    rollerd.zsk_expired = zsk_expired
+    del rollerd.rollzone
+    for modified in (True, False):
+        os.utime(ZF, (now, now))
+        mtime = now + 100 if modified else now - 100
+        os.utime(ZF + '.signed', (mtime, mtime))
+        assert generate_zonesigner(zonesigner)
+        rollerd.coalesce_rollzone('fuzetsu.info')
+        # -alwayssign didn't ask for another re-signing.
+        assert rollerd.coalesce_saved == 0
+        runs = [x for x in readlog(zonesigner) if x.startswith('done ')]
+        assert len(runs) == 1 and ' -signonly ' in runs[0]
+        rollerd.coalesce_report()
+    os.remove(ZF + '.signed')
+
+
+def sharding():
+    '''
+    The zones of a pass are handled by worker processes, and the rollrec
+    records they change are merged, even when a worker fails
+    '''
+    zonesigner = os.path.join(HOME_DIR, 'zonesigner-shard')
+    for failing in (False, True):
+        assert generate_zonesigner(zonesigner)
+        assert generate_rollrecs(12)
+        rollerd = make_rollerd()
+        rollerd.shards = 2
+        errors = []
+        rollerd.rolllog_log = lambda level, rname, message: (
+            errors.append(message) if level == LOG.ERR else None)
+        rollerd.rollrec_read()
+        rollerd.status_load()
+        rnames = list(rollerd.rollrec_names())
+        slices = [[], []]
+        for rname in rnames:
+            slices[rollerd.shard_of(rname)].append(rname)
+        assert all(len(x) > 2 for x in slices)
+        stopper = slices[1][1] if failing else None
+
+        def rollzone(rname):
+            if rname == stopper:
+                os._exit(3)
+            rollerd.runner(
+                rname, '%s %s' % (zonesigner, rname), ZF + '.krf', False)
+            rrr = rollerd.ROLLREC[rname]
+            rrr['zsargs'] = '-shard %d' % rollerd.shard
+            if rname == 'z1.fuzetsu.info':
+                rrr.is_active = False
+            del rrr['kskphase']
+            rollerd.stats_zone(rname)
+        rollerd.rollzone = rollzone
+
+        rollerd.stats_begin()
+        rollerd.rollzones(rnames)
+        rollerd.stats_end()
+
+        handled = slices[0] + (slices[1][:1] if failing else slices[1])
+        for rname in rnames:
+            rrr = rollerd.ROLLREC[rname]
+            if rname in handled:
+                assert rrr['zsargs'] == '-shard %d' % rollerd.shard_of(rname)
+                assert 'kskphase' not in rrr
+            else:
+                assert 'zsargs' not in rrr
+                assert rrr['kskphase'] == '0'
+            skipped = int(rname[1:].split('.')[0]) % 3 == 2 or (
+                rname == 'z1.fuzetsu.info' and rname in handled)
+            assert rrr.is_active == (not skipped)
+            assert rollerd.status_of(rname).is_active == rrr.is_active
+        assert sorted(
+            x.split(' ', 1)[1] for x in readlog(zonesigner)
+            if x.startswith('done ')) == sorted(handled)
+
+        if failing:
+            assert errors == ['shard 1 worker failed (status 768)']
+            # The failed worker's counters are lost.
+            assert rollerd.stats_passes[-1].acted == len(slices[0])
+        else:
+            assert errors == []
+            assert rollerd.stats_passes[-1].acted == len(rnames)
+        assert rollerd.ROLLREC._dirty
+
+
 if __name__ == '__main__':
     started = False
 
@@ -285,12 +1338,79 @@ if __name__ == '__main__':
     if 'parsers' in sys.argv:
         started = True
         parsers()
+    if 'dirty' in sys.argv:
+        started = True
+        dirty()
+    if 'atomic' in sys.argv:
+        started = True
+        atomic()
+    if 'inline' in sys.argv:
+        started = True
+        inline()
+    if 'ttl' in sys.argv:
+        started = True
+        ttl()
+    if 'tokens' in sys.argv:
+        started = True
+        tokens()
+    if 'snapshot' in sys.argv:
+        started = True
+        snapshot()
+    if 'lazy' in sys.argv:
+        started = True
+        lazy()
+    if 'queue' in sys.argv:
+        started = True
+        queue()
+    if 'autosign' in sys.argv:
+        started = True
+        autosign()
+    if 'execute' in sys.argv:
+        started = True
+        execution()
+    if 'framing' in sys.argv:
+        started = True
+        framing()
+    if 'pipeline' in sys.argv:
+        started = True
+        pipeline()
+    if 'zonestatus' in sys.argv:
+        started = True
+        zonestatus()
+    if 'ticks' in sys.argv:
+        started = True
+        ticks()
+    if 'coalesce' in sys.argv:
+        started = True
+        coalescing()
+    if 'shards' in sys.argv:
+        started = True
+        sharding()
     if 'all' in sys.argv:
         started = True
         ksk()
         zsk()
         parsers()
+        dirty()
+        atomic()
+        inline()
+        ttl()
+        tokens()
+        snapshot()
+        lazy()
+        queue()
+        autosign()
+        execution()
+        framing()
+        pipeline()
+        zonestatus()
+        ticks()
+        coalescing()
+        sharding()
 
     if not started:
-        print('Usage: ./tests.py <ksk|zsk|parsers|all>')
+        print(
+            'Usage: ./tests.py '
+            '<ksk|zsk|parsers|dirty|atomic|inline|ttl|tokens|snapshot|'
+            'lazy|queue|autosign|execute|framing|pipeline|zonestatus|ticks|coalesce|shards|all>')
         print('    dnssec-tools is reqiured')